@@ -24,3 +24,13 @@ SOFTWARE.
 from .bots import *
 from .config import config
 from .logger import ColourFormatter
+
+
+def __getattr__(name: str):
+    # the twitch bot is optional and twitchio takes about as long to import as discord.py, so it's only imported
+    # when it's asked for
+    if name == "TBot":
+        from .tbot import TBot
+
+        return TBot
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -23,10 +23,10 @@ SOFTWARE.
 """
 import logging
 import pathlib
+import time
 
 import discord
 from discord.ext import commands
-from twitchio.ext import commands as tcommands
 
 from .config import config
 
@@ -34,7 +34,7 @@ from .config import config
 logger: logging.Logger = logging.getLogger(__name__)
 
 
-__all__ = ("Bot", "TBot")
+__all__ = ("Bot",)
 
 
 class Bot(commands.Bot):
@@ -49,20 +49,16 @@ class Bot(commands.Bot):
         logger.info(f"Logged into Discord as: {self.user} | {self.user.id}")
         print("on_ready")
 
+    @staticmethod
+    def get_extensions() -> list[str]:
+        modules: list[str] = [f"{p.parent}.{p.stem}" for p in pathlib.Path("modules").glob("*.py")]
+        return [s.replace("/", ".").replace("\\", ".") for s in modules]
+
     async def setup_hook(self) -> None:
         print("setup_hook")
-        modules: list[str] = [f"{p.parent}.{p.stem}" for p in pathlib.Path("modules").glob("*.py")]
-        modules: list[str] = [s.replace("/", ".").replace("\\", ".") for s in modules]
+        modules: list[str] = self.get_extensions()
         print("modules", modules)
         for module in modules:
+            started_at: float = time.perf_counter()
             await self.load_extension(module)
-
-
-class TBot(tcommands.Bot):
-    def __init__(self) -> None:
-        super().__init__(
-            token=config["TOKENS"]["tbot"], prefix=config["TBOT"]["prefix"], initial_channels=config["TBOT"]["channels"]
-        )
-
-    async def event_ready(self) -> None:
-        logger.info(f"Logged into Twitch as: {self.nick}")
+            logger.info(f"loaded {module} in {(time.perf_counter() - started_at) * 1000:.0f}ms")
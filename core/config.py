@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import tomllib
-from typing import TYPE_CHECKING
+from collections.abc import Iterator, Mapping
+from typing import TYPE_CHECKING, Any
 
 
 if TYPE_CHECKING:
@@ -11,5 +12,30 @@ if TYPE_CHECKING:
 __all__ = ("config",)
 
 
-with open("config.toml", "rb") as fp:
-    config: Config = tomllib.load(fp)
+class LazyConfig(Mapping):
+    """
+    The config, read from config.toml the first time a value is looked up rather than when core is imported, so
+    tools that import core without running the bot don't need a config
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.data: Config | None = None
+
+    def load(self) -> Config:
+        if self.data is None:
+            with open(self.path, "rb") as fp:
+                self.data = tomllib.load(fp)
+        return self.data
+
+    def __getitem__(self, key: str) -> Any:
+        return self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+config: Config = LazyConfig("config.toml")
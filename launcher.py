@@ -23,6 +23,8 @@ SOFTWARE.
 """
 import asyncio
 import logging
+import subprocess
+import sys
 
 import discord.utils
 
@@ -41,7 +43,36 @@ async def main() -> None:
         await bot.start(core.config["TOKENS"]["bot"])
 
 
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    logger.warning(f"Shutting down all bots due to KeyboardInterrupt.")
+def import_report(limit: int = 30) -> None:
+    """
+    Prints the slowest imports of the bot and its extensions, as measured by python's -X importtime in a fresh
+    interpreter, without connecting to discord
+    :param limit: number of modules to list
+    :return:
+    """
+    statements: str = "; ".join(f"import {module}" for module in ["core", *core.Bot.get_extensions()])
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statements], capture_output=True, text=True)
+    timings: list[tuple[int, int, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        timings.append((int(cumulative), int(own), name.rstrip()))
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else "import failed")
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for cumulative, own, name in sorted(timings, reverse=True)[:limit]:
+        print(f"{cumulative / 1000:>13.1f} {own / 1000:>8.1f}  {name}")
+    print(f"{sum(own for cumulative, own, name in timings) / 1000:.1f}ms importing {len(timings)} modules")
+
+
+if __name__ == "__main__":
+    # the guard matters, export helpers run process pools that re-import the main module in their workers
+    if "--import-report" in sys.argv:
+        import_report()
+        sys.exit()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.warning(f"Shutting down all bots due to KeyboardInterrupt.")
@@ -1,8 +1,28 @@
+import asyncio
+import io
+import logging
+import time
+
 import discord
 from discord.ext import commands, tasks
 
 import core
 from modules.exporter.channel_exporter import ChannelExporter
+from modules.exporter.distributed import ExportCoordinator
+from modules.exporter.export_context import ExportContext
+from modules.exporter.export_filter import ExportFilter, parse_bound
+from modules.exporter.guild_exporter import GuildExporter
+from modules.exporter.message_store import MessageStore
+from modules.exporter.preflight import (
+    ExportEstimate,
+    PreflightSampler,
+    apply_settings,
+    check_limits,
+    create_sampler,
+)
+from modules.exporter.progress import ExportProgress
+from modules.exporter.render_profiler import RenderProfiler
+from modules.exporter.worker import ExportWorkerPool
 
 
 try:
@@ -11,10 +31,68 @@ except ImportError:
     from core import *
 
 
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class Bound(commands.Converter):
+    async def convert(self, ctx: commands.Context, argument: str) -> int:
+        try:
+            return parse_bound(argument)
+        except ValueError:
+            raise commands.BadArgument(f"{argument} is neither a date like 2024-01-31 nor a message id")
+
+
+class ExportFlags(commands.FlagConverter):
+    """
+    Which part of the channel to export, e.g. after: 2024-01-01 before: 2024-04-01 author: @someone links: yes
+    """
+
+    after: Bound | None = None
+    before: Bound | None = None
+    author: list[discord.User] = commands.flag(default=lambda ctx: [])
+    attachments: bool = False
+    links: bool = False
+    thread: list[int] = commands.flag(default=lambda ctx: [])
+    skip_thread: list[int] = commands.flag(default=lambda ctx: [])
+
+    def to_filter(self) -> ExportFilter:
+        return ExportFilter(
+            self.after,
+            self.before,
+            {user.id for user in self.author},
+            self.attachments,
+            self.links,
+            set(self.thread),
+            set(self.skip_thread),
+        )
+
+
 class ExportCommand:
-    def __init__(self, export_channel_id: int, output_channel_id: int):
-        self.export_channel_id = export_channel_id
+    def __init__(
+        self,
+        export_channel_id: int,
+        output_channel_id: int,
+        guild_export: bool = False,
+        status_channel_id: int = -1,
+        export_filter: ExportFilter | None = None,
+    ):
+        self.export_channel_id = export_channel_id  # the guild id for guild exports
         self.output_channel_id = output_channel_id
+        self.guild_export = guild_export
+        # the channel the command was given in, where the status of the export is kept up to date
+        self.status_channel_id = status_channel_id
+        self.export_filter: ExportFilter = export_filter or ExportFilter()
+        self.estimate: ExportEstimate | None = None
+        self.queued_at: float = time.monotonic()
+
+    def priority(self) -> float:
+        """
+        Short exports go first so they aren't stuck behind ones that take all day, but an export moves up the queue
+        as it waits, so a long one isn't passed over forever
+        :return: lower runs sooner
+        """
+        expected: float = self.estimate.seconds if self.estimate else 0.0
+        return expected - (time.monotonic() - self.queued_at)
 
 
 class ChannelExport(commands.Cog):
@@ -22,32 +100,261 @@ class ChannelExport(commands.Cog):
         self.bot: Bot = bot
         self.current_export_command: ExportCommand | None = None
         self.export_queue: list[ExportCommand] = []
+        self.worker_pool: ExportWorkerPool | None = None
+        self.coordinator: ExportCoordinator | None = None
+        self.running_commands: set[ExportCommand] = set()
         self.check_export_queue.start()
 
+    def get_message_store(self) -> MessageStore | None:
+        mirror: commands.Cog | None = self.bot.get_cog("MessageMirror")
+        return mirror.store if mirror else None
+
+    def create_export_context(self) -> ExportContext:
+        return ExportContext.from_settings(self.bot, core.config["EXPORT"], self.get_message_store())
+
+    async def cog_load(self) -> None:
+        if core.config["EXPORT"].get("distributed", {}).get("enabled", False):
+            self.coordinator = ExportCoordinator(self.bot, core.config["EXPORT"])
+            return
+        worker_processes: int = core.config["EXPORT"].get("worker_processes", 0)
+        if worker_processes > 0:
+            settings: dict = dict(core.config["EXPORT"])
+            # the memory budget is per process, the workers split it so together they stay within it
+            memory_budget_mb: int = settings.get("memory_budget_mb", 1024)
+            if memory_budget_mb > 0:
+                settings["memory_budget_mb"] = max(memory_budget_mb // worker_processes, 1)
+            self.worker_pool = ExportWorkerPool(core.config["TOKENS"]["bot"], settings, worker_processes)
+            self.worker_pool.start()
+
+    async def cog_unload(self) -> None:
+        self.check_export_queue.cancel()
+        if self.worker_pool:
+            await self.worker_pool.close()
+        if self.coordinator:
+            self.coordinator.close()
+
+    async def run_in_worker(self, export_command: ExportCommand) -> None:
+        # looked up per export, the message mirror may have been loaded after this cog
+        message_store: MessageStore | None = self.get_message_store()
+        if message_store:
+            await message_store.flush()
+        try:
+            await self.worker_pool.run(
+                export_command.export_channel_id,
+                export_command.output_channel_id,
+                export_command.guild_export,
+                export_command.status_channel_id,
+                export_command.estimate,
+                export_command.export_filter,
+                message_store.path if message_store else None,
+            )
+        except RuntimeError as ex:
+            logger.error(f"export of {export_command.export_channel_id} failed: {ex}")
+        finally:
+            self.running_commands.remove(export_command)
+
+    async def run_distributed(self, export_command: ExportCommand) -> None:
+        progress: ExportProgress = self.create_progress(export_command)
+        await progress.start(self.bot.get_channel(export_command.status_channel_id))
+        outcome: str = "failed"
+        try:
+            if export_command.guild_export:
+                guild: discord.Guild = self.bot.get_guild(export_command.export_channel_id)
+                job_id: int = await asyncio.to_thread(
+                    self.coordinator.plan_guild, guild, export_command.output_channel_id, export_command.export_filter
+                )
+            else:
+                channel: discord.TextChannel = self.bot.get_channel(export_command.export_channel_id)
+                job_id: int = await asyncio.to_thread(
+                    self.coordinator.plan_channel,
+                    channel,
+                    export_command.output_channel_id,
+                    export_command.export_filter,
+                )
+            await self.coordinator.wait(job_id, progress=progress)
+            outcome = "done"
+        except RuntimeError as ex:
+            logger.error(f"export of {export_command.export_channel_id} failed: {ex}")
+        finally:
+            await progress.stop(outcome)
+            self.running_commands.remove(export_command)
+
+    def create_progress(self, export_command: ExportCommand) -> ExportProgress:
+        if export_command.guild_export:
+            title: str = f"export of {self.bot.get_guild(export_command.export_channel_id).name}"
+        else:
+            title = f"export of #{self.bot.get_channel(export_command.export_channel_id).name}"
+        if not export_command.export_filter.is_empty:
+            title += f" ({export_command.export_filter.summary()})"
+        return ExportProgress(title, export_command.estimate)
+
     async def backup_channel(self, export_command: ExportCommand) -> None:
-        channel: discord.TextChannel = self.bot.get_channel(export_command.export_channel_id)
-        channel_exporter = ChannelExporter(
-            self.bot, channel, f"output/{export_command.export_channel_id}", export_command.output_channel_id
+        context: ExportContext = self.create_export_context()
+        context.export_filter = export_command.export_filter
+        context.progress = self.create_progress(export_command)
+        await context.progress.start(self.bot.get_channel(export_command.status_channel_id))
+        outcome: str = "failed"
+        try:
+            if export_command.guild_export:
+                guild: discord.Guild = self.bot.get_guild(export_command.export_channel_id)
+                guild_exporter = GuildExporter(
+                    self.bot,
+                    guild,
+                    export_command.export_filter.output_dir(f"output/guild_{export_command.export_channel_id}"),
+                    export_command.output_channel_id,
+                    context,
+                    core.config["EXPORT"].get("guild_concurrency", 3),
+                )
+                await guild_exporter.export()
+            else:
+                channel: discord.TextChannel = self.bot.get_channel(export_command.export_channel_id)
+                channel_exporter = ChannelExporter(
+                    self.bot,
+                    channel,
+                    export_command.export_filter.output_dir(f"output/{export_command.export_channel_id}"),
+                    export_command.output_channel_id,
+                    context,
+                )
+                await channel_exporter.export()
+            outcome = "done"
+        finally:
+            await context.progress.stop(outcome)
+            context.close()
+
+    async def estimate_export(self, export_command: ExportCommand) -> None:
+        """
+        Samples what's being exported, and warns in the status channel if the export is likely to run out of disk
+        space or to need too many uploads
+        """
+        settings: dict = core.config["EXPORT"]
+        output_dir: str = settings.get("distributed", {}).get("output_root", "output") if self.coordinator else "output"
+        if export_command.guild_export:
+            guild: discord.Guild = self.bot.get_guild(export_command.export_channel_id)
+            sampler: PreflightSampler = create_sampler(settings, True, export_command.export_filter)
+            estimate: ExportEstimate = await sampler.estimate_guild(
+                GuildExporter.get_channels(guild), settings.get("guild_concurrency", 3)
+            )
+        else:
+            channel: discord.TextChannel = self.bot.get_channel(export_command.export_channel_id)
+            guild = channel.guild
+            sampler = create_sampler(settings, export_filter=export_command.export_filter)
+            estimate = await sampler.estimate_channel(channel)
+        export_command.estimate = apply_settings(estimate, settings)
+        uploads: bool = export_command.output_channel_id != -1 and not settings.get("storage", {}).get("enabled")
+        warnings: list[str] = await asyncio.to_thread(check_limits, estimate, output_dir, guild.filesize_limit, uploads)
+        logger.info(f"pre-flight estimate of {export_command.export_channel_id}: {estimate.summary()}")
+        status_channel = self.bot.get_channel(export_command.status_channel_id)
+        if status_channel:
+            text: str = f"Queued, {estimate.summary()}, {len(self.export_queue)} other exports waiting"
+            for warning in warnings:
+                text += f"\n:warning: {warning}"
+            await status_channel.send(text)
+
+    async def queue_export(self, export_command: ExportCommand) -> None:
+        await self.estimate_export(export_command)
+        self.export_queue.append(export_command)
+
+    def next_export_command(self) -> ExportCommand:
+        export_command: ExportCommand = min(self.export_queue, key=lambda command: command.priority())
+        self.export_queue.remove(export_command)
+        return export_command
+
+    @commands.command()
+    @commands.has_role(core.config["EXPORT"]["role"])
+    async def export(
+        self,
+        ctx: commands.Context,
+        export_channel_id: int,
+        output_channel_id: int | None = -1,
+        *,
+        flags: ExportFlags,
+    ):
+        """
+        Exports a channel, or part of it with flags such as after: 2024-01-01 before: 2024-04-01 author: @someone
+        attachments: yes links: yes thread: <id> skip_thread: <id>
+        """
+        await self.queue_export(
+            ExportCommand(
+                export_channel_id, output_channel_id, status_channel_id=ctx.channel.id, export_filter=flags.to_filter()
+            )
         )
-        await channel_exporter.export()
 
     @commands.command()
     @commands.has_role(core.config["EXPORT"]["role"])
-    async def export(self, ctx: commands.Context, export_channel_id: int, output_channel_id: int = -1):
-        self.export_queue.append(ExportCommand(export_channel_id, output_channel_id))
+    async def export_guild(self, ctx: commands.Context, output_channel_id: int | None = -1, *, flags: ExportFlags):
+        await self.queue_export(
+            ExportCommand(
+                ctx.guild.id,
+                output_channel_id,
+                guild_export=True,
+                status_channel_id=ctx.channel.id,
+                export_filter=flags.to_filter(),
+            )
+        )
 
     @commands.command()
     @commands.has_role(core.config["EXPORT"]["role"])
     async def debug(self, ctx: commands.Context, export_channel_id: int, export_message_id: int):
         channel: discord.TextChannel = self.bot.get_channel(export_channel_id)
-        channel_exporter = ChannelExporter(self.bot, channel, f"output/debug", ctx.channel.id)
-        await channel_exporter.debug(export_message_id)
+        context: ExportContext = self.create_export_context()
+        try:
+            channel_exporter = ChannelExporter(self.bot, channel, f"output/debug", ctx.channel.id, context)
+            await channel_exporter.debug(export_message_id)
+        finally:
+            context.close()
+
+    @commands.command()
+    @commands.has_role(core.config["EXPORT"]["role"])
+    async def profile(
+        self,
+        ctx: commands.Context,
+        export_channel_id: int,
+        first_message_id: int,
+        last_message_id: int,
+        mode: str = "sample",
+    ):
+        """
+        Renders a range of messages under the render profiler and posts the report and a flamegraph stack file,
+        mode is either sample or cprofile
+        """
+        if mode not in ("sample", "cprofile"):
+            await ctx.send(f"unknown profiler mode {mode}, use sample or cprofile")
+            return
+        channel: discord.TextChannel = self.bot.get_channel(export_channel_id)
+        context: ExportContext = self.create_export_context()
+        profiler = RenderProfiler(mode)
+        try:
+            channel_exporter = ChannelExporter(self.bot, channel, f"output/debug", ctx.channel.id, context)
+            await channel_exporter.profile(first_message_id, last_message_id, profiler)
+        finally:
+            context.close()
+        files: list[discord.File] = [
+            discord.File(io.BytesIO(profiler.report().encode()), filename="render_profile.txt"),
+            discord.File(io.BytesIO(profiler.folded_stacks().encode()), filename="render_profile.folded"),
+        ]
+        await ctx.send(f"{profiler.summary()}\n```\n{profiler.token_report()[:1800]}\n```", files=files)
 
     @tasks.loop(seconds=1)
     async def check_export_queue(self):
+        if self.coordinator:
+            # the work is spread over however many export workers are running, hand everything out right away
+            while self.export_queue:
+                export_command: ExportCommand = self.next_export_command()
+                self.running_commands.add(export_command)
+                asyncio.create_task(self.run_distributed(export_command))
+            return
+
+        if self.worker_pool:
+            # the workers keep the exports off the event loop, so run as many at once as there are workers
+            while self.export_queue and not self.worker_pool.busy:
+                export_command: ExportCommand = self.next_export_command()
+                self.running_commands.add(export_command)
+                asyncio.create_task(self.run_in_worker(export_command))
+            return
+
         # only allow one backup at a time to minimize rate limiting
         if self.current_export_command is None and len(self.export_queue) > 0:
-            self.current_export_command = self.export_queue.pop()
+            self.current_export_command = self.next_export_command()
             try:
                 await self.backup_channel(self.current_export_command)
             finally:
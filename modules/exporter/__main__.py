@@ -0,0 +1,82 @@
+"""
+Exports a channel without starting the bot, for scheduled backups:
+
+    python -m modules.exporter <channel_id> [--output-channel <channel_id>] [--guild]
+        [--after <date or id>] [--before <date or id>] [--author <user_id> ...] [--attachments] [--links]
+        [--thread <thread_id> ...] [--skip-thread <thread_id> ...]
+
+or runs an export worker of a distributed export, taking units of work from the queue in EXPORT.distributed:
+
+    python -m modules.exporter --work
+
+Only the REST API is used, so there is no gateway connection to wait for and no member list to download, names
+and emoji are looked up as the export needs them.  Settings come from the EXPORT section of config.toml, like they
+do for the bot.
+"""
+import argparse
+import asyncio
+import logging
+import time
+import tomllib
+
+import discord
+
+from .distributed import DistributedWorker
+from .export_filter import ExportFilter, parse_bound
+from .rest_client import RestClient
+from .worker import ExportJob, run_export
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m modules.exporter", description="Export a discord channel")
+    parser.add_argument("channel_id", type=int, nargs="?", help="the channel to export, or the guild with --guild")
+    parser.add_argument("--output-channel", type=int, default=-1, help="channel to upload the backup to")
+    parser.add_argument("--guild", action="store_true", help="export every channel of the guild channel_id")
+    parser.add_argument("--work", action="store_true", help="work on distributed exports until stopped")
+    parser.add_argument("--after", type=parse_bound, help="only messages after this date, time or message id")
+    parser.add_argument("--before", type=parse_bound, help="only messages before this date, time or message id")
+    parser.add_argument("--author", type=int, action="append", default=[], help="only messages of this user")
+    parser.add_argument("--attachments", action="store_true", help="only messages with attachments")
+    parser.add_argument("--links", action="store_true", help="only messages with links")
+    parser.add_argument("--thread", type=int, action="append", default=[], help="only this thread")
+    parser.add_argument("--skip-thread", type=int, action="append", default=[], help="leave this thread out")
+    parser.add_argument("--config", default="config.toml")
+    args: argparse.Namespace = parser.parse_args()
+    if args.channel_id is None and not args.work:
+        parser.error("a channel_id or --work is required")
+    return args
+
+
+async def main() -> None:
+    args: argparse.Namespace = parse_args()
+    with open(args.config, "rb") as fp:
+        config: dict = tomllib.load(fp)
+    discord.utils.setup_logging(level=config.get("LOGGING", {}).get("level", logging.INFO))
+
+    started_at: float = time.perf_counter()
+    async with RestClient() as client:
+        await client.login(config["TOKENS"]["bot"])
+        logger.info(f"logged in as {client.user} in {time.perf_counter() - started_at:.2f}s")
+        if args.work:
+            await DistributedWorker(client, config["EXPORT"]).run()
+            return
+        # no message store, without the bot running the mirror it can't tell how far behind it is
+        export_filter = ExportFilter(
+            args.after,
+            args.before,
+            set(args.author),
+            args.attachments,
+            args.links,
+            set(args.thread),
+            set(args.skip_thread),
+        )
+        job = ExportJob(0, args.channel_id, args.output_channel, args.guild, export_filter=export_filter)
+        await run_export(client, job, config["EXPORT"])
+    logger.info(f"export finished in {time.perf_counter() - started_at:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
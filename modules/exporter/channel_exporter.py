@@ -1,22 +1,46 @@
+import asyncio
 import datetime
+import functools
+import json
 import time
 import logging
 import os
 import re
-import shutil
 import urllib.parse
-import humanfriendly
-from zipfile import ZIP_BZIP2, ZipFile
 
 import discord
-import requests
 
-from .markdown_tokenizer import MarkdownTokenizer, MarkdownTokenType
+from .emoji_atlas import EmojiAtlas
+from .export_context import ExportContext
+from .export_filter import ExportFilter
+from .history_crawler import ParallelHistoryCrawler
+from .lazy_import import lazy_import
+from .markdown_tokenizer import MarkdownTokenizer, MarkdownTokenType, Token
+from .memory_governor import MemoryAccount, estimate_message_size
+from .message_store import MessageCoverage, MessageStore
+from .packaging import ExportPackager
+from .render_memo import RenderMemo, RenderMemoEntry
+from .render_profiler import RenderProfiler
+from .thread_catalog import ThreadCatalog
+from .thumbnails import Thumbnail
 
 
+humanfriendly = lazy_import("humanfriendly")
+
 logger: logging.Logger = logging.getLogger(__name__)
 
 
+@functools.cache
+def load_template(name: str) -> str:
+    """
+    Templates are read once per process, every exporter of a guild export and every thread uses the same ones
+    :param name: filename in the templates dir
+    :return:
+    """
+    with open(os.path.join(os.path.dirname(__file__), "templates", name), "r") as f:
+        return f.read()
+
+
 class ChannelExporter:
     """
     Limitations:
@@ -24,16 +48,33 @@ class ChannelExporter:
       * Does not handle most of the special discord.MessageTypes
     """
 
-    def __init__(self, bot: discord.Client, channel: discord.TextChannel, output_dir: str, output_channel_id: int):
+    def __init__(
+        self,
+        bot: discord.Client,
+        channel: discord.TextChannel,
+        output_dir: str,
+        output_channel_id: int,
+        context: ExportContext | None = None,
+    ):
         self.bot: discord.Client = bot
         self.channel: discord.TextChannel = channel
         self.output_dir: str = output_dir
         self.output_channel_id: int = output_channel_id
+        self.context: ExportContext = context or ExportContext(bot)
+        self.export_filter: ExportFilter = self.context.export_filter
+        # a filtered export only sees part of the threads, it would leave holes in the catalog
+        self.thread_catalog: ThreadCatalog = ThreadCatalog(
+            channel.id, self.context.cache_dir if self.export_filter.is_empty else None
+        )
         self.messages: list[discord.Message] = []
+        self.memory: MemoryAccount = self.context.memory.account(f"#{channel.name}")
         self.document_filename = "index.html"
         self.thread_id_map: {int, discord.Thread} = {}
-        with open("modules/exporter/templates/export_doc.html", "r") as f:  # TODO use current path as reference
-            self.doc_template = "".join(f.readlines())
+        self.doc_template: str = load_template("export_doc.html")
+        # swapped out by the markdown harness to compare tokenizer implementations
+        self.tokenizer_class: type[MarkdownTokenizer] = MarkdownTokenizer
+        # classes of the compacted markup used by the document, for its stylesheet
+        self.style_classes: set[str] = set()
 
     def get_thread_document_filename(self, thread_id) -> str:
         """
@@ -44,13 +85,24 @@ class ChannelExporter:
         """
         return f"thread_{thread_id}_index.html"
 
-    def create_output_dirs(self) -> None:
-        if not os.path.isdir(self.output_dir):
-            os.mkdir(f"{self.output_dir}")
-        if not os.path.isdir(f"{self.output_dir}/assets/"):
-            os.mkdir(f"{self.output_dir}/assets/")
+    def get_chunk_dir(self) -> str:
+        """
+        Viewer chunks are kept in a folder per document so the channel and each of its threads can be paged
+        independently
+        :return: the chunk folder relative to the output dir
+        """
+        return f"chunks/{self.document_filename.rsplit('.', 1)[0]}"
 
-    def copy_asset_locally(self, asset_id: str, url: str, alt_url: str = None) -> str:
+    def get_stylesheet_path(self) -> str:
+        """
+        :return: the stylesheet of the compacted markup of the document, relative to the output dir
+        """
+        return f"assets/styles/{self.document_filename.rsplit('.', 1)[0]}.css"
+
+    async def create_output_dirs(self) -> None:
+        await self.context.io.makedirs(f"{self.output_dir}/assets")
+
+    async def copy_asset_locally(self, asset_id: str, url: str, alt_url: str = None, size: int | None = None) -> str:
         ext: str = ""
         parsed_url = urllib.parse.urlparse(url)
         filename = parsed_url.path.split("/")[-1]
@@ -59,21 +111,9 @@ class ChannelExporter:
 
         local_filename = f"{self.output_dir}/assets/{asset_id}{ext}"
         html_relative_filename = f"./assets/{asset_id}{ext}"
-        if not os.path.isfile(local_filename):
-            headers = {
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-                "Accept-Encoding": "gzip, deflate, br",
-            }
-            for url in [url, alt_url]:
-                if url is not None:
-                    try:
-                        response = requests.get(url, headers=headers)
-                        if response.status_code == 200:
-                            with open(local_filename, "wb") as f:
-                                f.write(response.content)
-                                break
-                    except Exception as e:
-                        logger.error(f"error downloading file: {url}: {e}")
+        if local_filename not in self.context.downloaded_assets and not await self.context.io.isfile(local_filename):
+            await self.context.downloader.download([url, alt_url], local_filename, size)
+        self.context.downloaded_assets.add(local_filename)
 
         return html_relative_filename
 
@@ -94,40 +134,192 @@ class ChannelExporter:
         markdown = re.sub(r"\[(?P<text>[^\]]+)\]\((?P<link>[^\)]+)\)", '<a href="\g<2>">\g<1></a>', markdown)
         return markdown
 
+    async def crawl_history(self, after: int, before: int | None) -> list[discord.Message]:
+        """
+        :param after: snowflake to crawl after, exclusive
+        :param before: snowflake to crawl before, exclusive, None for up to now
+        :return: the messages, oldest first
+        """
+        if before is None:
+            before = discord.utils.time_snowflake(discord.utils.utcnow(), high=True)
+        if self.context.crawl_concurrency > 1:
+            crawler = ParallelHistoryCrawler(
+                self.channel, self.context.crawl_concurrency, memory=self.memory, progress=self.context.progress
+            )
+            return await crawler.crawl(after, before)
+        messages: list[discord.Message] = []
+        async for message in self.channel.history(
+            limit=None, after=discord.Object(after), before=discord.Object(before), oldest_first=True
+        ):
+            messages.append(message)
+            await self.hold_message(message)
+            if len(messages) % 100 == 0:
+                logger.info(f"loaded {len(messages)} messages")
+        return messages
+
+    async def hold_message(self, message: discord.Message) -> None:
+        """
+        Counts a fetched message against the memory budget, pausing the fetch while the export is short on memory
+        """
+        self.memory.add("messages", estimate_message_size(message))
+        self.context.progress.add_fetched()
+        await self.memory.wait_for_room()
+
+    def release_messages(self) -> None:
+        """
+        Every renderer is done with the messages once the document is rendered, letting go of them leaves the
+        memory to the documents that are still to come
+        """
+        self.messages = []
+        self.memory.release("messages")
+        self.memory.release("render")
+
+    async def get_messages_from_store(self) -> None:
+        """
+        Loads the messages from the local message store, only fetching the parts of the history the mirror hasn't
+        seen: everything before the mirror started watching the channel, stretches when the bot was disconnected,
+        and everything since the last message if the bot has reconnected since.  Only the part of those within the
+        range of the export filter is fetched, and a part the range cuts short isn't recorded in the store.
+        """
+        store: MessageStore = self.context.message_store
+        await store.flush()
+        coverage: MessageCoverage | None = await asyncio.to_thread(store.get_coverage, self.channel.id)
+        # a channel's id is its creation time, none of its messages can be older
+        crawls: list[tuple[int, int | None]] = []
+        if coverage is None:
+            crawls.append((self.channel.id - 1, None))
+        else:
+            if coverage.first_id > self.channel.id - 1:
+                crawls.append((self.channel.id - 1, coverage.first_id + 1))
+            crawls.extend(await asyncio.to_thread(store.get_gaps, self.channel.id))
+            if coverage.epoch != store.epoch:
+                crawls.append((coverage.last_id, None))
+
+        backfilled: int = 0
+        fetched: dict[int, discord.Message] = {}
+        for after, before in crawls:
+            clamped: tuple[int, int | None] | None = self.export_filter.clamp(after, before)
+            if clamped is None:
+                continue
+            crawl_after, crawl_before = clamped
+            if crawl_before is None:
+                # the crawl stops here, messages the mirror stores while it runs are newer
+                crawl_before = discord.utils.time_snowflake(discord.utils.utcnow(), high=True)
+            messages: list[discord.Message] = await self.crawl_history(crawl_after, crawl_before)
+            backfilled += len(messages)
+            if clamped == (after, before):
+                logger.info(f"backfilled {len(messages)} messages into the message store")
+                store.backfill(self.channel.id, messages, after, crawl_before, open_ended=before is None)
+                self.memory.release("messages")
+            else:
+                # only part of the missing range was fetched, the store only takes whole ranges
+                fetched.update((message.id, message) for message in messages)
+        await store.flush()
+
+        payloads: list[dict] = await asyncio.to_thread(
+            store.load_payloads, self.channel.id, self.export_filter.after or 0, self.export_filter.before
+        )
+        stored: list[discord.Message] = [
+            discord.Message(state=self.bot._connection, channel=self.channel, data=payload)
+            for payload in payloads
+            if int(payload["id"]) not in fetched
+        ]
+        self.messages = sorted(stored + list(fetched.values()), key=lambda message: message.id)
+        self.memory.release("messages")
+        self.memory.add("messages", sum(estimate_message_size(message) for message in self.messages))
+        # the backfilled messages were counted as they were fetched
+        self.context.progress.add_fetched(max(len(self.messages) - backfilled, 0))
+        logger.info(f"All {len(self.messages)} messages loaded, {len(crawls)} ranges fetched from history")
+
+    async def fetch_message(self, message_id: int) -> discord.Message:
+        if self.context.message_store:
+            payload: dict | None = await asyncio.to_thread(self.context.message_store.get_payload, message_id)
+            if payload:
+                return discord.Message(state=self.bot._connection, channel=self.channel, data=payload)
+        return await self.channel.fetch_message(message_id)
+
     async def get_all_messages(self) -> None:
+        """
+        Loads the messages of the channel within the range of the export filter, and keeps the ones that match the
+        rest of the filter
+        """
+        self.context.progress.set_stage(f"fetching #{self.channel.name}")
+        await self.fetch_messages()
+        self.filter_messages()
+
+    def filter_messages(self) -> None:
+        if not self.export_filter.filters_messages:
+            return
+        fetched: int = len(self.messages)
+        self.messages = [message for message in self.messages if self.export_filter.matches(message)]
+        self.memory.release("messages")
+        self.memory.add("messages", sum(estimate_message_size(message) for message in self.messages))
+        logger.info(f"{len(self.messages)} of {fetched} messages match the export filter")
+
+    async def fetch_messages(self) -> None:
+        if self.context.message_store:
+            await self.get_messages_from_store()
+            return
+
+        if self.context.crawl_concurrency > 1:
+            crawler = ParallelHistoryCrawler(
+                self.channel, self.context.crawl_concurrency, memory=self.memory, progress=self.context.progress
+            )
+            # a channel's id is its creation time, none of its messages can be older
+            after: int = max(self.channel.id - 1, self.export_filter.after or 0)
+            before: int = self.export_filter.before or discord.utils.time_snowflake(discord.utils.utcnow(), high=True)
+            self.messages = await crawler.crawl(after, before) if before > after + 1 else []
+            logger.info(f"All {len(self.messages)} messages loaded")
+            return
+
         count: int = 0
-        async for message in self.channel.history(limit=None):
+        async for message in self.channel.history(
+            limit=None,
+            after=discord.Object(self.export_filter.after) if self.export_filter.after else None,
+            before=discord.Object(self.export_filter.before) if self.export_filter.before else None,
+            oldest_first=False,
+        ):
             self.messages.append(message)
+            await self.hold_message(message)
             count += 1
             if count % 100 == 0:
                 logger.info(f"loaded {count} messages")
         self.messages.reverse()
         logger.info(f"All {count} messages loaded")
 
-    def at_user_markdown_to_username(self, markdown: str) -> str:
+    async def at_user_markdown_to_username(self, markdown: str) -> str:
         match: re.Match = re.search("<@(?P<userid>\d+)>", markdown)
-        user: discord.User = self.bot.get_user(int(match.groups()[0]))
-        if user:
-            return user.display_name
+        user_name: str | None = await self.context.resolver.fetch_user_name(int(match.groups()[0]))
+        if user_name:
+            return user_name
         else:
             return "unknown user"
 
     def at_role_markdown_to_name(self, markdown: str) -> str:
         match: re.Match = re.search("<@&(?P<role_id>\d+)>", markdown)
-        role: any = self.channel.guild.get_role(int(match.groups()[0]))
-        if role:
-            return role.name
+        role_name: str | None = self.context.resolver.get_role_name(self.channel.guild, int(match.groups()[0]))
+        if role_name:
+            return role_name
         else:
             return "unknown role"
 
     def channel_link_to_name(self, markdown: str) -> str:
         match: re.Match = re.search("<#(?P<channel>\d+)>", markdown)
-        channel: any = self.bot.get_channel(int(match.groups()[0]))
-        if channel:
-            return channel.name
+        channel_name: str | None = self.context.resolver.get_channel_name(int(match.groups()[0]))
+        if channel_name:
+            return channel_name
         else:
             return "unknown channel"
 
+    def channel_link_to_html(self, markdown: str) -> str:
+        channel_id: int = int(markdown[2:-1])
+        if channel_id in self.context.channel_documents:
+            return (
+                f'<a class="atText subtleLink" href="./{self.context.channel_documents[channel_id]}">'
+                f"#{self.channel_link_to_name(markdown)}</a>"
+            )
+        return f'<span class="atText">#{self.channel_link_to_name(markdown)}</span>'
+
     async def emoji_markdown_to_html(self, markdown: str) -> str:
         """
         Limitation: Can't load emoji from a server that this bot is not a member of
@@ -138,17 +330,20 @@ class ChannelExporter:
         result = ""
         if match:
             emoji_id = match["emoji_id"]
-            emoji: str | None | discord.Emoji | discord.PartialEmoji = self.bot.get_emoji(int(emoji_id))
+            if self.context.emoji_atlas and not markdown.startswith("<a:"):
+                if await self.context.emoji_atlas.add(self.context.io, self.context.downloader, int(emoji_id)):
+                    return self.context.emoji_atlas.emoji_to_html(int(emoji_id))
+            emoji: str | None | discord.Emoji | discord.PartialEmoji = self.context.resolver.get_emoji(int(emoji_id))
             asset_filename: str | None = None
             if type(emoji) == discord.Emoji or type(emoji) == discord.PartialEmoji:
-                asset_filename = self.copy_asset_locally(str(emoji.id), emoji.url)
+                asset_filename = await self.copy_asset_locally(str(emoji.id), emoji.url)
             elif emoji is None:
-                asset_filename = self.copy_asset_locally(
+                asset_filename = await self.copy_asset_locally(
                     emoji_id, f"https://cdn.discordapp.com/emojis/{emoji_id}.webp?size=96&quality=lossless"
                 )  # download directly to get emoji for other servers
 
             if asset_filename:
-                result = f'<img src="{asset_filename}">'
+                result = f'<img src="{asset_filename}" loading="lazy" decoding="async">'
             else:
                 result = markdown
         return result
@@ -188,52 +383,77 @@ class ChannelExporter:
                 </ul>
                 """
 
+    async def token_to_html(self, token: Token) -> str:
+        match token.token_type:
+            case MarkdownTokenType.HEADER1:
+                return f"<h1>{self.markdown_to_html(token.value)}</h1>"
+            case MarkdownTokenType.HEADER2:
+                return f"<h2>{self.markdown_to_html(token.value)}</h2>"
+            case MarkdownTokenType.HEADER3:
+                return f"<h3>{self.markdown_to_html(token.value)}</h3>"
+            case MarkdownTokenType.AT_USER:
+                return f'<span class="atText">@{await self.at_user_markdown_to_username(token.value)}</span>'
+            case MarkdownTokenType.AT_ROLE:
+                return f'<span class="atRole">@{self.at_role_markdown_to_name(token.value)}</span>'
+            case MarkdownTokenType.CHANNEL_LINK:
+                return self.channel_link_to_html(token.value)
+            case MarkdownTokenType.EMOJI:
+                return f'<span class="emoji">{await self.emoji_markdown_to_html(token.value)}</span>'
+            case MarkdownTokenType.CODE_TEXT:
+                return f'<span class="codeText">{self.escape_html(token.value)}</span>'
+            case MarkdownTokenType.CODE_BLOCK:
+                return self.code_block_to_html(token.value)
+            case MarkdownTokenType.TEXT:
+                return self.newline_to_break(self.markdown_to_html(token.value))
+            case MarkdownTokenType.LINK:
+                return f'<a href="{token.value}">{token.value}</a>'
+            case MarkdownTokenType.MASKED_LINK:
+                (text, link) = await self.parse_masked_link(token.value)
+                return f'<a href="{link}">{text}</a>'
+            case MarkdownTokenType.BLOCKQUOTE:
+                return f'<blockquote>{token.value}</blockquote>'
+            case MarkdownTokenType.UNORDERED_LIST_ITEM:
+                return self.unordered_list_item_to_html(token.value)
+        return ""
+
     async def message_content_to_html(self, message_content: str) -> str:
         """
-        Tokenizes and parses message content into HTML.
+        Tokenizes and parses message content into HTML.  Content rendered before is taken from the render memo,
+        unless the render profiler is timing the rendering.
         :param message:
         :return:
         """
-        markdown_tokenizer = MarkdownTokenizer(message_content)
-        markdown_tokenizer.tokenize()
+        profiler: RenderProfiler | None = self.context.profiler
+        memo: RenderMemo | None = self.context.render_memo if profiler is None else None
+        entry: RenderMemoEntry | None = memo.get(message_content, self.context.memo_scope) if memo else None
+        if entry and entry.is_valid_in(self.context.memo_scope):
+            return entry.html
+
+        if entry:
+            tokens: list[Token] = entry.tokens
+        else:
+            started_at: float = time.perf_counter() if profiler else 0.0
+            markdown_tokenizer = self.tokenizer_class(message_content)
+            markdown_tokenizer.tokenize()
+            tokens = markdown_tokenizer.tokens
+            if profiler:
+                profiler.add_tokenize(time.perf_counter() - started_at)
 
         html: str = ""
-        for token in markdown_tokenizer.tokens:
-            match token.token_type:
-                case MarkdownTokenType.HEADER1:
-                    html += f"<h1>{self.markdown_to_html(token.value)}</h1>"
-                case MarkdownTokenType.HEADER2:
-                    html += f"<h2>{self.markdown_to_html(token.value)}</h2>"
-                case MarkdownTokenType.HEADER3:
-                    html += f"<h3>{self.markdown_to_html(token.value)}</h3>"
-                case MarkdownTokenType.AT_USER:
-                    html += f'<span class="atText">@{self.at_user_markdown_to_username(token.value)}</span>'
-                case MarkdownTokenType.AT_ROLE:
-                    html += f'<span class="atRole">@{self.at_role_markdown_to_name(token.value)}</span>'
-                case MarkdownTokenType.CHANNEL_LINK:
-                    html += f'<span class="atText">#{self.channel_link_to_name(token.value)}</span>'
-                case MarkdownTokenType.EMOJI:
-                    html += f'<span class="emoji">{await self.emoji_markdown_to_html(token.value)}</span>'
-                case MarkdownTokenType.CODE_TEXT:
-                    html += f'<span class="codeText">{self.escape_html(token.value)}</span>'
-                case MarkdownTokenType.CODE_BLOCK:
-                    html += self.code_block_to_html(token.value)
-                case MarkdownTokenType.TEXT:
-                    html += self.newline_to_break(self.markdown_to_html(token.value))
-                case MarkdownTokenType.LINK:
-                    html += f'<a href="{token.value}">{token.value}</a>'
-                case MarkdownTokenType.MASKED_LINK:
-                    (text, link) = await self.parse_masked_link(token.value)
-                    html += f'<a href="{link}">{text}</a>'
-                case MarkdownTokenType.BLOCKQUOTE:
-                    html += f'<blockquote>{token.value}</blockquote>'
-                case MarkdownTokenType.UNORDERED_LIST_ITEM:
-                    html += self.unordered_list_item_to_html(token.value)
+        for token in tokens:
+            if profiler:
+                started_at = time.perf_counter()
+                html += await self.token_to_html(token)
+                profiler.add_token(token.token_type, time.perf_counter() - started_at)
+            else:
+                html += await self.token_to_html(token)
+        if memo:
+            memo.put(message_content, self.context.memo_scope, tokens, html)
         return html
 
     def get_author_avatar(self, author: discord.User | None) -> str:
         avatar_url = author.avatar.url if author and author.avatar else "https://cdn.discordapp.com/embed/avatars/0.png"
-        return f'<img src="{avatar_url}">'
+        return f'<img src="{avatar_url}" loading="lazy" decoding="async">'
 
     def author_name_to_html(self, author: discord.Member):
         bot_html: str = ""
@@ -332,17 +552,49 @@ class ChannelExporter:
              </div>
              """
 
-    def image_attachment_to_html(self, local_filename: str) -> str:
-        return f'<a href="{local_filename}"><img class="attachment" src="{local_filename}"></a>'
+    async def get_thumbnail(
+        self, asset_id: str, local_filename: str, width: int | None, height: int | None
+    ) -> Thumbnail | None:
+        if not self.context.thumbnail_generator:
+            return None
+        return await self.context.thumbnail_generator.thumbnail(
+            self.context.io, self.output_dir, asset_id, local_filename, width, height
+        )
+
+    def image_size_attributes(self, width: int | None, height: int | None) -> str:
+        """
+        width and height let the browser reserve the space for an image before it loads, so the page doesn't
+        jump around while scrolling
+        """
+        if not width or not height:
+            return ""
+        return f'width="{width}" height="{height}"'
+
+    def image_attachment_to_html(
+        self,
+        local_filename: str,
+        thumbnail: Thumbnail | None = None,
+        width: int | None = None,
+        height: int | None = None,
+    ) -> str:
+        src: str = local_filename
+        if thumbnail:
+            src, width, height = thumbnail.filename, thumbnail.width, thumbnail.height
+        return (
+            f'<a href="{local_filename}">'
+            f'<img class="attachment" src="{src}" {self.image_size_attributes(width, height)} '
+            f'loading="lazy" decoding="async">'
+            f"</a>"
+        )
 
     def video_attachment_to_html(self, local_filename: str) -> str:
-        return f'<video width="400" controls><source src="{local_filename}"></video>'
+        return f'<video width="400" controls preload="none"><source src="{local_filename}"></video>'
 
     def download_attachment_to_html(self, original_filename: str, local_filename: str, size: str) -> str:
         return f"""
             <div class="flex flex-row darkBox darkBorder rounded p15 gap8">
                 <div>
-                    <img src="./assets/download.png"/>
+                    <img src="./assets/download.png" loading="lazy"/>
                 </div>
                 <div class="flex flex-col justify-center">
                     <a class="subtleLink" href="{local_filename}">{original_filename}</a>
@@ -351,11 +603,18 @@ class ChannelExporter:
             </div>
             """
 
-    def attachment_to_html(self, attachment: discord.Attachment) -> str:
-        local_filename = self.copy_asset_locally(str(attachment.id), attachment.proxy_url, attachment.url)
+    async def attachment_to_html(self, attachment: discord.Attachment) -> str:
+        local_filename = await self.copy_asset_locally(
+            str(attachment.id), attachment.proxy_url, attachment.url, attachment.size
+        )
         match attachment.filename.split(".")[-1]:
-            case "png" | "jpg" | "jpeg" | "gif":
-                attachment_html = self.image_attachment_to_html(local_filename)
+            case "png" | "jpg" | "jpeg" | "gif" | "webp":
+                thumbnail: Thumbnail | None = await self.get_thumbnail(
+                    str(attachment.id), local_filename, attachment.width, attachment.height
+                )
+                attachment_html = self.image_attachment_to_html(
+                    local_filename, thumbnail, attachment.width, attachment.height
+                )
             case "mp4":
                 attachment_html = self.video_attachment_to_html(local_filename)
             case _:
@@ -366,21 +625,26 @@ class ChannelExporter:
              </div>
              """
 
-    def attachments_to_html(self, message: discord.Message) -> str:
+    async def attachments_to_html(self, message: discord.Message) -> str:
         result: str = ""
         for attachment in message.attachments:
-            result += self.attachment_to_html(attachment)
+            result += await self.attachment_to_html(attachment)
         return result
 
-    def reaction_to_html(self, reaction: discord.Reaction) -> str:
+    async def reaction_to_html(self, reaction: discord.Reaction) -> str:
         emoji: str | discord.Emoji | discord.PartialEmoji = reaction.emoji
         if type(emoji) is str:
             # if it's an emoji str reference, decode it
             match = re.search("<:[^:]+:(?P<emoji_id>.+)>", emoji)
             if match:
                 emoji = self.bot.get_emoji(match[0])
+        atlas: EmojiAtlas | None = self.context.emoji_atlas
         if type(emoji) is discord.Emoji or type(emoji) is discord.PartialEmoji:
-            emoji = f'<img src="{self.copy_asset_locally(str(emoji.id), emoji.url)}">'
+            if atlas and not emoji.animated and await atlas.add(self.context.io, self.context.downloader, emoji.id):
+                emoji = atlas.emoji_to_html(emoji.id)
+            else:
+                local_filename: str = await self.copy_asset_locally(str(emoji.id), emoji.url)
+                emoji = f'<img src="{local_filename}" loading="lazy" decoding="async">'
 
         return f"""
                 <div class="reaction">
@@ -389,10 +653,10 @@ class ChannelExporter:
                 </div>
                 """
 
-    def reactions_to_html(self, message: discord.Message) -> str:
+    async def reactions_to_html(self, message: discord.Message) -> str:
         reactions: str = ""
         for reaction in message.reactions:
-            reactions += self.reaction_to_html(reaction)
+            reactions += await self.reaction_to_html(reaction)
         return f"""
             <div class="reactions">
               {reactions}
@@ -412,7 +676,7 @@ class ChannelExporter:
         if embed.author:
             result += (
                 f'<div class="embedAuthor">'
-                f'  <img src="{embed.author.icon_url}">'
+                f'  <img src="{embed.author.icon_url}" loading="lazy" decoding="async">'
                 f'  <a href="{embed.author.url}">{embed.author.name}</a>'
                 f"</div>"
             )
@@ -435,12 +699,22 @@ class ChannelExporter:
                     f'<span class="fieldName">{name_html}</span> <span class="fieldValue">{value_html}</span></div>'
                 )
         if embed.thumbnail.url:
-            result += f'  <div class="embedThumbnail"><img src="{embed.thumbnail.url}"></div>'
+            result += (
+                f'  <div class="embedThumbnail"><img src="{embed.thumbnail.url}" loading="lazy" decoding="async"></div>'
+            )
         if embed.image.url:
-            local_filename = self.copy_asset_locally(
-                self.get_id_from_url(embed.image.url), embed.image.url, embed.image.proxy_url
+            asset_id: str = self.get_id_from_url(embed.image.url)
+            local_filename = await self.copy_asset_locally(asset_id, embed.image.url, embed.image.proxy_url)
+            width, height = embed.image.width, embed.image.height
+            thumbnail: Thumbnail | None = await self.get_thumbnail(asset_id, local_filename, width, height)
+            src: str = local_filename
+            if thumbnail:
+                src, width, height = thumbnail.filename, thumbnail.width, thumbnail.height
+            result += (
+                f'  <div class="embedImage"><a href="{local_filename}">'
+                f'<img src="{src}" {self.image_size_attributes(width, height)} loading="lazy" decoding="async">'
+                f"</a></div>"
             )
-            result += f'  <div class="embedImage"><img src="{local_filename}"></div>'
         result += "</div>"
         result += "</div>"
         return result
@@ -467,11 +741,11 @@ class ChannelExporter:
 
         reactions_content: str = ""
         if message.reactions and len(message.reactions) > 0:
-            reactions_content = self.reactions_to_html(message)
+            reactions_content = await self.reactions_to_html(message)
 
         attachment_content: str = ""
         if message.attachments and len(message.attachments) > 0:
-            attachment_content = self.attachments_to_html(message)
+            attachment_content = await self.attachments_to_html(message)
 
         embeds: str = ""
         if message.embeds and len(message.embeds) > 0:
@@ -549,7 +823,7 @@ class ChannelExporter:
             """
 
     async def reply_message_to_html(self, message: discord.Message) -> str:
-        ref_message = await self.channel.fetch_message(message.reference.message_id)
+        ref_message = await self.fetch_message(message.reference.message_id)
         return f"""
              <div class="messageBlock flex-col mt20">
                 <div class="flex flex-row mb4">
@@ -610,91 +884,157 @@ class ChannelExporter:
             return False
         return True
 
-    async def messages_to_html(self) -> str:
-        message_html: str = ""
+    async def messages_to_html_blocks(self) -> list[str]:
+        """
+        Renders every message into its own block of HTML, including the day divider that precedes it, so the
+        blocks can either be joined into a single page or split into viewer chunks
+        :return: one HTML block per message
+        """
+        blocks: list[str] = []
         last_message: discord.Message | None = None
         for message in self.messages:
             coalesce: bool = self.should_coalesce_messages(last_message, message)
+            message_html: str = ""
             if last_message is None or last_message.created_at.day != message.created_at.day:
                 message_html += self.day_divider_to_html(message.created_at)
             message_html += await self.message_to_html(message, coalesce)
+            if self.context.compactor:
+                message_html = self.context.compactor.compact(message_html, self.style_classes)
+            if self.context.search_index:
+                chunk: int = len(blocks) // self.context.viewer_chunk_size if self.context.viewer_mode else -1
+                self.context.search_index.add_message(message, self.document_filename, chunk)
+            blocks.append(message_html)
+            self.memory.add("render", len(message_html))
+            self.context.progress.add_rendered()
             last_message = message
+        return blocks
+
+    def search_box_to_html(self) -> str:
+        if not self.context.search_index:
+            return ""
+        return """
+             <form class="searchBox" onsubmit="exportSearch.search(); return false;">
+                 <input id="searchQuery" type="search" placeholder="Search messages">
+                 <select id="searchAuthor"><option value="">Any author</option></select>
+                 <input id="searchFrom" type="date">
+                 <input id="searchTo" type="date">
+                 <button type="submit">Search</button>
+             </form>
+             <div id="searchResults" class="searchResults"></div>
+             <script src="./assets/search/meta.js"></script>
+             """
+
+    def page_to_html(self, message_html: str, container_attributes: str = "") -> str:
+        stylesheet: str = ""
+        if self.context.emoji_atlas:
+            stylesheet = '<link rel="stylesheet" href="./assets/emoji/emoji.css">'
+        if self.context.compactor:
+            stylesheet += f'<link rel="stylesheet" href="./{self.get_stylesheet_path()}">'
         return f"""
+             {stylesheet}
              <div class="pageHeader">
                  <h2>{self.channel.guild.name} - {self.channel.name}</h2>
+                 {self.search_box_to_html()}
              </div>
-             <div class="messageContainer">
+             <div class="messageContainer" {container_attributes}>
                  {message_html}
              </div>
              """
 
-    def write_document_file(self, html):
-        doc: str = self.doc_template.replace("{body}", html)
-        with open(f"{self.output_dir}/{self.document_filename}", "w") as f:
-            f.write(doc)
-
-    def copy_fonts(self) -> None:
-        for file in os.listdir('./modules/exporter/fonts'):
-            shutil.copy(f"./modules/exporter/fonts/{file}", f"{self.output_dir}/assets/{file}")
-
-    def copy_images(self) -> None:
-        for file in os.listdir('./modules/exporter/images'):
-            shutil.copy(f"./modules/exporter/images/{file}", f"{self.output_dir}/assets/{file}")
-
-    def zip_contents(self) -> None:
-        max_upload_size = self.channel.guild.filesize_limit
-        split_count: int = 0
-        zipfile = ZipFile(f"{self.output_dir}/{self.channel.id}_{split_count}.zip", "w", compresslevel=ZIP_BZIP2)
-        for file in os.listdir(f"{self.output_dir}"):
-            if file.split(".")[-1] == "html":
-                zipfile.write(f"{self.output_dir}/{file}", f"{file}")
-                if os.path.getsize(f"{self.output_dir}/{self.channel.id}_{split_count}.zip") > max_upload_size:
-                    split_count += 1
-                    zipfile = ZipFile(
-                        f"{self.output_dir}/{self.channel.id}_{split_count}.zip", "w", compresslevel=ZIP_BZIP2
-                    )
-
-        zipfile.write(f"{self.output_dir}/assets/", "assets/")
-        for file in os.listdir(f"{self.output_dir}/assets/"):
-            zip_size: int = os.path.getsize(f"{self.output_dir}/{self.channel.id}_{split_count}.zip")
-            file_size: int = os.path.getsize(f"{self.output_dir}/assets/{file}")
-            if zip_size + file_size > max_upload_size:  # assume it won't compress
-                split_count += 1
-                zipfile = ZipFile(
-                    f"{self.output_dir}/{self.channel.id}_{split_count:02}.zip", "w", compresslevel=ZIP_BZIP2
-                )
-            zipfile.write(f"{self.output_dir}/assets/{file}", f"assets/{file}")
+    async def messages_to_html(self) -> str:
+        return self.page_to_html("".join(await self.messages_to_html_blocks()))
 
-    async def send_zips_to_output_channel(self) -> None:
-        if self.output_channel_id == -1:
-            return
+    def viewer_to_html(self) -> str:
+        """
+        The viewer page only holds an empty container, the message chunks are pulled in by the viewer script
+        in the template as the reader scrolls
+        :return:
+        """
+        page_html: str = self.page_to_html("", 'id="viewer"')
+        return page_html + f'<script src="./{self.get_chunk_dir()}/index.js"></script>'
 
-        channel: discord.TextChannel = self.bot.get_channel(self.output_channel_id)
-        if channel:
-            await channel.send(f"A backup of {channel.name} has been created.")
-            try:
-                sorted_files = [f for f in os.listdir(f"{self.output_dir}") if f.split(".")[-1] == "zip"]
-                sorted_files.sort()
-                for idx, file in enumerate(sorted_files):
-                    logger.info(f"uploading file {self.output_dir + '/' + file} to channel {channel.name}")
-                    discord_file = discord.File(
-                        self.output_dir + "/" + file,
-                        filename=f"{self.channel.name} backup {idx+1} of {len(sorted_files)}.zip",
-                    )
-                    await channel.send(file=discord_file)
-            except Exception as ex:
-                logging.error(f"error uploading to discord: {ex}")
-                await channel.send("An error was encountered uploading files to discord")
+    async def write_viewer_chunks(self, blocks: list[str]) -> None:
+        """
+        Chunks are written as small scripts rather than JSON so the viewer can load them with a script tag,
+        which keeps the export browsable straight from disk where fetch() is blocked for file:// urls
+        :param blocks: the rendered message blocks of this document
+        :return:
+        """
+        chunk_dir: str = f"{self.output_dir}/{self.get_chunk_dir()}"
+        await self.context.io.makedirs(chunk_dir)
+        first_ids: list[str] = []
+        chunk_size: int = self.context.viewer_chunk_size
+        for chunk_idx, start in enumerate(range(0, len(blocks), chunk_size)):
+            first_ids.append(str(self.messages[start].id))
+            chunk: list[str] = blocks[start : start + chunk_size]
+            for block in chunk:
+                self.context.static_assets.add_text(block)
+            chunk_js: str = f"exportViewer.addChunk({chunk_idx}, {json.dumps(chunk)});"
+            await self.context.io.write_later(f"{chunk_dir}/chunk_{chunk_idx:05}.js", chunk_js)
+        index = {"base": f"./{self.get_chunk_dir()}/", "firstIds": first_ids, "messageCount": len(blocks)}
+        await self.context.io.write_later(f"{chunk_dir}/index.js", f"exportViewer.init({json.dumps(index)});")
+        await self.context.io.flush()
+
+    async def write_document(self) -> None:
+        """
+        Renders the loaded messages and writes them out as either a single page or a chunked viewer page
+        :return:
+        """
+        if self.context.viewer_mode:
+            await self.write_viewer_chunks(await self.messages_to_html_blocks())
+            await self.write_document_file(self.viewer_to_html())
+        else:
+            await self.write_document_file(await self.messages_to_html())
+
+    async def render_document(self) -> None:
+        """
+        Hands the loaded messages to each of the export's renderers
+        :return:
+        """
+        self.context.progress.set_stage(f"rendering #{self.channel.name}")
+        for renderer in self.context.renderers:
+            await renderer.render(self)
+
+    async def write_document_file(self, html):
+        self.context.static_assets.add_text(html)
+        doc: str = self.doc_template.replace("{body}", html)
+        await self.context.io.write_text(f"{self.output_dir}/{self.document_filename}", doc)
+        if self.context.compactor:
+            stylesheet_path: str = f"{self.output_dir}/{self.get_stylesheet_path()}"
+            await self.context.io.makedirs(os.path.dirname(stylesheet_path))
+            await self.context.io.write_text(stylesheet_path, self.context.compactor.stylesheet(self.style_classes))
+
+    async def can_skip_thread(self, thread_id: int) -> bool:
+        """
+        A thread that hasn't had any messages since it was last exported into this output dir doesn't need to be
+        exported again.  The search index and the record outputs are built from the messages of every document,
+        so nothing is skipped while they are enabled.
+        """
+        if self.context.search_index or not all(renderer.incremental for renderer in self.context.renderers):
+            return False
+        if not self.thread_catalog.is_unchanged(thread_id, self.output_dir):
+            return False
+        return await self.context.io.isfile(f"{self.output_dir}/{self.get_thread_document_filename(thread_id)}")
 
     async def export_threads(self) -> None:
-        for thread_id in self.thread_id_map.keys():
-            thread = self.thread_id_map[thread_id]
+        skipped: int = 0
+        for thread_id in list(self.thread_id_map.keys()):
+            if await self.can_skip_thread(thread_id):
+                skipped += 1
+                continue
+            thread = await self.thread_catalog.get_thread(self.bot, thread_id)
+            if thread is None:
+                continue
             thread_channel = thread
-            converter = ChannelExporter(self.bot, thread_channel, self.output_dir, -1)
+            converter = ChannelExporter(self.bot, thread_channel, self.output_dir, -1, self.context)
             converter.document_filename = self.get_thread_document_filename(thread.id)
             await converter.get_all_messages()
-            html_document = await converter.messages_to_html()
-            converter.write_document_file(html_document)
+            await converter.render_document()
+            converter.release_messages()
+            self.thread_catalog.mark_exported(thread_id, self.output_dir)
+        if skipped > 0:
+            logger.info(f"skipped {skipped} unchanged threads")
+        await self.context.io.run(self.thread_catalog.save)
 
     async def cache_thread_message_ids(self) -> None:
         """
@@ -702,31 +1042,94 @@ class ChannelExporter:
         message id matches a thread id.  We'll cache this upfront to avoid costly API calls to look this up
         per message being exported.
 
-        We need to get a superset of both archived and current threads to cover everything
+        We need to get a superset of both archived and current threads to cover everything, the thread catalog
+        takes care of that and only looks at the archives that changed since the last export
         :return: nothing
         """
         logger.info("building thread cache")
-        async for thread in self.channel.archived_threads(limit=None):
-            self.thread_id_map[thread.id] = thread
-
-        for thread in self.channel.threads:
-            self.thread_id_map[thread.id] = thread
+        await self.thread_catalog.refresh(self.channel, self.export_filter.archived_after)
+        self.thread_id_map = {
+            thread_id: record
+            for thread_id, record in self.thread_catalog.records.items()
+            if self.export_filter.includes_thread(thread_id, record.last_message_id)
+        }
         logger.info(f"{len(self.thread_id_map.keys())} threads cached")
 
-    async def export(self) -> None:
-        logger.info(f'Starting export of "{self.channel.name}" channel on "{self.channel.guild.name}"')
-        self.create_output_dirs()
+    async def forum_to_html(self) -> str:
+        """
+        Forum channels have no messages of their own, their page lists the posts
+        :return:
+        """
+        posts_html: str = ""
+        for thread in sorted(self.thread_id_map.values(), key=lambda thread: thread.id, reverse=True):
+            posts_html += f"""
+                <div class="messageBlock flex-row mt20">
+                    <div class="gutter"><span><i>#</i></span></div>
+                    <div class="content">{self.thread_link_to_html(thread)}</div>
+                </div>
+                """
+        return self.page_to_html(posts_html)
+
+    async def export_documents(self) -> None:
+        """
+        Writes the pages of the channel and its threads, without packaging them up
+        :return:
+        """
+        await self.create_output_dirs()
         await self.cache_thread_message_ids()
-        await self.get_all_messages()
-        html_document = await self.messages_to_html()
-        self.write_document_file(html_document)
+        if isinstance(self.channel, discord.ForumChannel):
+            await self.write_document_file(await self.forum_to_html())
+        else:
+            await self.get_all_messages()
+            await self.render_document()
+            self.release_messages()
         await self.export_threads()
-        self.copy_fonts()
-        self.copy_images()
-        self.zip_contents()
-        await self.send_zips_to_output_channel()
+
+    async def package(self) -> None:
+        """
+        Writes the assets shared by the documents once they are all written, and packages up the archive
+        :return:
+        """
+        self.context.progress.set_stage("packaging")
+        await self.context.finish(self.output_dir)
+        packager = ExportPackager(
+            self.bot,
+            self.output_dir,
+            self.output_channel_id,
+            str(self.channel.id),
+            self.channel.name,
+            self.channel.guild.filesize_limit,
+            self.context.io,
+            self.context.storage,
+        )
+        await packager.package()
+
+    async def export(self) -> None:
+        logger.info(f'Starting export of "{self.channel.name}" channel on "{self.channel.guild.name}"')
+        self.context.io.start_lag_monitor()
+        await self.export_documents()
+        await self.package()
         logger.info("Export completed")
 
+    async def profile(self, first_message_id: int, last_message_id: int, profiler: RenderProfiler) -> None:
+        """
+        Renders the messages between two ids, both included, under the profiler.  Nothing but the assets of the
+        messages is written to the output dir.
+        :param first_message_id:
+        :param last_message_id:
+        :param profiler:
+        :return:
+        """
+        await self.create_output_dirs()
+        self.messages = await self.crawl_history(first_message_id - 1, last_message_id + 1)
+        self.context.profiler = profiler
+        profiler.start()
+        try:
+            await self.messages_to_html_blocks()
+        finally:
+            profiler.stop(len(self.messages))
+            self.context.profiler = None
+
     async def debug(self, message_id):
         message = await self.channel.fetch_message(message_id)
         html = await self.message_to_html(message)
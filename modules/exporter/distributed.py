@@ -0,0 +1,359 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+
+import discord
+
+from .channel_exporter import ChannelExporter
+from .export_context import ExportContext
+from .export_filter import ExportFilter
+from .guild_exporter import GuildExporter
+from .memory_governor import estimate_message_size
+from .message_store import message_to_payload
+from .progress import ExportProgress
+from .work_queue import JobStatus, WorkQueue, WorkUnit
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+# stages of a job, every unit of a stage is done before the next stage starts
+HISTORY_STAGE: int = 0
+DOCUMENT_STAGE: int = 1
+PACKAGE_STAGE: int = 2
+
+
+def distributed_settings(settings: dict) -> dict:
+    """
+    The search index, the record outputs and the emoji atlas are built from every document of the export in one
+    process, which a distributed export doesn't have
+    :param settings: the EXPORT section of the config
+    :return: the settings with those turned off
+    """
+    settings = dict(settings)
+    for key, value in (("search_index", False), ("emoji_atlas", False), ("renderers", ["html"])):
+        if settings.get(key, value) != value:
+            logger.warning(f"{key} is not supported by distributed exports and is turned off")
+        settings[key] = value
+    return settings
+
+
+def create_work_queue(settings: dict) -> WorkQueue:
+    distributed: dict = settings.get("distributed", {})
+    path: str = distributed.get("queue", "output/queue.db")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return WorkQueue(path, distributed.get("lease_seconds", 120), distributed.get("max_attempts", 3))
+
+
+def write_json(path: str, data) -> None:
+    # written under another name and renamed, a worker that dies halfway leaves no half written file behind
+    with open(f"{path}.part", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.part", path)
+
+
+def read_json(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class ExportCoordinator:
+    """
+    Splits the exports the bot is asked for into units of work in the work queue, for export workers on any node to
+    pick up, and waits for them to be done.  Workers write into the same output root, which has to be on storage
+    every node shares, the queue database included.
+
+    A channel's history is split into snowflake ranges fetched by different workers, then one worker renders the
+    channel page from them and hands each thread out as a unit of its own, and once every page is written one
+    worker writes the shared assets and packages the archive.  A guild export renders each of its channels as a
+    separate unit.
+    """
+
+    def __init__(self, bot: discord.Client, settings: dict):
+        self.bot: discord.Client = bot
+        distributed: dict = settings.get("distributed", {})
+        self.queue: WorkQueue = create_work_queue(settings)
+        self.output_root: str = distributed.get("output_root", "output")
+        self.history_units: int = distributed.get("history_units", 8)
+
+    def get_work_dir(self, job_id: int) -> str:
+        return f"{self.output_root}/.work/job_{job_id}"
+
+    def plan_channel(
+        self,
+        channel: discord.TextChannel | discord.ForumChannel,
+        output_channel_id: int,
+        export_filter: ExportFilter | None = None,
+    ) -> int:
+        export_filter = export_filter or ExportFilter()
+        job_id: int = self.queue.create_job(f"channel {channel.id}")
+        output_dir: str = export_filter.output_dir(f"{self.output_root}/{channel.id}")
+        work_dir: str = self.get_work_dir(job_id)
+        units: list[tuple[int, str, dict]] = []
+        history_files: list[str] | None = None
+        if not isinstance(channel, discord.ForumChannel):
+            history_files = []
+            # a channel's id is its creation time, none of its messages can be older, and only the filter's range
+            # is fetched
+            history_range: tuple[int, int | None] | None = export_filter.clamp(
+                channel.id - 1, discord.utils.time_snowflake(discord.utils.utcnow(), high=True)
+            )
+            if history_range:
+                after, before = history_range
+                step: int = max((before - after) // self.history_units, 1)
+                bounds: list[int] = list(range(after, before, step))[: self.history_units] + [before]
+                for start, end in zip(bounds, bounds[1:]):
+                    history_file: str = f"{work_dir}/history_{start}.json"
+                    history_files.append(history_file)
+                    # both bounds are exclusive, a message right on a split point belongs to the range before it
+                    payload: dict = {
+                        "channel_id": channel.id,
+                        "after": start,
+                        "before": end if end == before else end + 1,
+                        "file": history_file,
+                    }
+                    units.append((HISTORY_STAGE, "history", payload))
+        document: dict = {
+            "channel_id": channel.id,
+            "output_dir": output_dir,
+            "document_filename": "index.html",
+            "history_files": history_files,
+            "channel_documents": {},
+            "filter": export_filter.to_dict(),
+        }
+        units.append((DOCUMENT_STAGE, "document", document))
+        package: dict = {
+            "export_id": channel.id,
+            "guild": False,
+            "output_dir": output_dir,
+            "output_channel_id": output_channel_id,
+            "work_dir": work_dir,
+        }
+        units.append((PACKAGE_STAGE, "package", package))
+        self.queue.publish(job_id, units)
+        logger.info(f"planned the export of {channel.name} as job {job_id}, {len(units)} work units")
+        return job_id
+
+    def plan_guild(
+        self, guild: discord.Guild, output_channel_id: int, export_filter: ExportFilter | None = None
+    ) -> int:
+        export_filter = export_filter or ExportFilter()
+        job_id: int = self.queue.create_job(f"guild {guild.id}")
+        output_dir: str = export_filter.output_dir(f"{self.output_root}/guild_{guild.id}")
+        channels: list[discord.TextChannel | discord.ForumChannel] = GuildExporter.get_channels(guild)
+        channel_documents: dict[str, str] = {
+            str(channel.id): GuildExporter.get_channel_document_filename(channel.id) for channel in channels
+        }
+        units: list[tuple[int, str, dict]] = []
+        # the channels that have been active the longest go first, like they do in a guild export
+        for channel in sorted(channels, key=GuildExporter.estimate_size, reverse=True):
+            document: dict = {
+                "channel_id": channel.id,
+                "output_dir": output_dir,
+                "document_filename": channel_documents[str(channel.id)],
+                "history_files": None,
+                "channel_documents": channel_documents,
+                "filter": export_filter.to_dict(),
+            }
+            units.append((DOCUMENT_STAGE, "document", document))
+        package: dict = {
+            "export_id": guild.id,
+            "guild": True,
+            "output_dir": output_dir,
+            "output_channel_id": output_channel_id,
+            "work_dir": self.get_work_dir(job_id),
+        }
+        units.append((PACKAGE_STAGE, "package", package))
+        self.queue.publish(job_id, units)
+        logger.info(f"planned the export of {guild.name} as job {job_id}, {len(units)} work units")
+        return job_id
+
+    async def wait(self, job_id: int, poll_seconds: float = 2.0, progress: ExportProgress | None = None) -> None:
+        """
+        :param job_id:
+        :param poll_seconds:
+        :param progress: the progress of the export, its stage is the number of units done
+        :return: once the job is done, raises if it failed
+        """
+        units_done: int = -1
+        while True:
+            status: JobStatus = await asyncio.to_thread(self.queue.get_job, job_id)
+            if status.units_done != units_done:
+                units_done = status.units_done
+                logger.info(f"export job {job_id}: {status.units_done} of {status.units_total} work units done")
+                if progress:
+                    progress.set_stage(f"{status.units_done} of {status.units_total} work units done")
+            if status.state == "done":
+                return
+            if status.state == "failed":
+                raise RuntimeError(status.error)
+            await asyncio.sleep(poll_seconds)
+
+    def close(self) -> None:
+        self.queue.close()
+
+
+class DistributedWorker:
+    """
+    Claims units of work from the work queue and runs them, over a REST only client like the worker processes.
+    Run as many as needed on as many nodes as needed, with python -m modules.exporter --work.  The lease of the
+    unit being worked on is renewed in the background, a worker that stops renewing it has its unit handed out
+    again, and a worker that has lost its lease drops the unit.
+    """
+
+    def __init__(self, client: discord.Client, settings: dict):
+        self.client: discord.Client = client
+        self.settings: dict = distributed_settings(settings)
+        self.queue: WorkQueue = create_work_queue(settings)
+        self.name: str = f"{socket.gethostname()}:{os.getpid()}"
+
+    def create_context(self, unit: WorkUnit) -> ExportContext:
+        context: ExportContext = ExportContext.from_settings(self.client, self.settings)
+        # history units fetch their range as planned, the filter is applied to it by the document
+        context.export_filter = ExportFilter.from_dict(unit.payload.get("filter", {}))
+        return context
+
+    async def export_history(self, unit: WorkUnit) -> None:
+        channel = await self.client.load_channel(unit.payload["channel_id"])
+        context: ExportContext = self.create_context(unit)
+        try:
+            exporter = ChannelExporter(self.client, channel, "", -1, context)
+            messages: list[discord.Message] = await exporter.crawl_history(
+                unit.payload["after"], unit.payload["before"]
+            )
+            os.makedirs(os.path.dirname(unit.payload["file"]), exist_ok=True)
+            await asyncio.to_thread(write_json, unit.payload["file"], [message_to_payload(m) for m in messages])
+            logger.info(f"fetched {len(messages)} messages of {channel.name}")
+        finally:
+            context.close()
+
+    async def load_history(self, exporter: ChannelExporter, history_files: list[str]) -> None:
+        for history_file in history_files:
+            payloads: list[dict] = await asyncio.to_thread(read_json, history_file)
+            exporter.messages.extend(
+                discord.Message(state=self.client._connection, channel=exporter.channel, data=payload)
+                for payload in payloads
+            )
+        exporter.messages.sort(key=lambda message: message.id)
+        exporter.memory.add("messages", sum(estimate_message_size(message) for message in exporter.messages))
+        logger.info(f"All {len(exporter.messages)} messages loaded from {len(history_files)} history ranges")
+        exporter.filter_messages()
+
+    async def finish_documents(self, context: ExportContext) -> None:
+        if context.thumbnail_generator:
+            await context.thumbnail_generator.wait(context.io)
+        await context.io.flush()
+
+    async def export_document(self, unit: WorkUnit) -> None:
+        channel = await self.client.load_channel(unit.payload["channel_id"])
+        context: ExportContext = self.create_context(unit)
+        context.channel_documents = {int(key): value for key, value in unit.payload["channel_documents"].items()}
+        try:
+            exporter = ChannelExporter(self.client, channel, unit.payload["output_dir"], -1, context)
+            exporter.document_filename = unit.payload["document_filename"]
+            await exporter.create_output_dirs()
+            await exporter.cache_thread_message_ids()
+            if isinstance(channel, discord.ForumChannel):
+                await exporter.write_document_file(await exporter.forum_to_html())
+            else:
+                if unit.payload["history_files"] is None:
+                    await exporter.get_all_messages()
+                else:
+                    await self.load_history(exporter, unit.payload["history_files"])
+                await exporter.render_document()
+                exporter.release_messages()
+            threads: list[tuple[int, str, dict]] = []
+            for thread_id in exporter.thread_id_map:
+                thread: dict = dict(unit.payload, channel_id=thread_id, history_files=None)
+                thread["document_filename"] = exporter.get_thread_document_filename(thread_id)
+                threads.append((DOCUMENT_STAGE, "thread", thread))
+            await context.io.run(exporter.thread_catalog.save)
+            await self.finish_documents(context)
+            # last, a retry of a unit that failed before this point would publish its threads twice
+            await asyncio.to_thread(self.queue.publish, unit.job_id, threads)
+        finally:
+            context.close()
+
+    async def export_thread(self, unit: WorkUnit) -> None:
+        try:
+            thread: discord.Thread = await self.client.load_channel(unit.payload["channel_id"])
+        except discord.NotFound:
+            logger.info(f"thread {unit.payload['channel_id']} no longer exists")
+            return
+        context: ExportContext = self.create_context(unit)
+        context.channel_documents = {int(key): value for key, value in unit.payload["channel_documents"].items()}
+        try:
+            exporter = ChannelExporter(self.client, thread, unit.payload["output_dir"], -1, context)
+            exporter.document_filename = unit.payload["document_filename"]
+            await exporter.get_all_messages()
+            await exporter.render_document()
+            exporter.release_messages()
+            await self.finish_documents(context)
+        finally:
+            context.close()
+
+    async def package(self, unit: WorkUnit) -> None:
+        output_dir: str = unit.payload["output_dir"]
+        output_channel_id: int = unit.payload["output_channel_id"]
+        if output_channel_id != -1:
+            await self.client.load_channel(output_channel_id)
+        context: ExportContext = self.create_context(unit)
+        try:
+            if unit.payload["guild"]:
+                guild: discord.Guild = await self.client.load_guild(unit.payload["export_id"])
+                guild_exporter = GuildExporter(self.client, guild, output_dir, output_channel_id, context)
+                guild_exporter.create_exporters()
+                await guild_exporter.package()
+            else:
+                channel = await self.client.load_channel(unit.payload["export_id"])
+                await ChannelExporter(self.client, channel, output_dir, output_channel_id, context).package()
+        finally:
+            context.close()
+        await asyncio.to_thread(shutil.rmtree, unit.payload["work_dir"], True)
+
+    async def run_unit(self, unit: WorkUnit) -> None:
+        logger.info(f"running {unit.kind} unit {unit.unit_id} of job {unit.job_id}, attempt {unit.attempts}")
+        match unit.kind:
+            case "history":
+                await self.export_history(unit)
+            case "document":
+                await self.export_document(unit)
+            case "thread":
+                await self.export_thread(unit)
+            case "package":
+                await self.package(unit)
+            case _:
+                raise ValueError(f"unknown work unit kind {unit.kind}")
+
+    async def work_on(self, unit: WorkUnit) -> None:
+        task: asyncio.Task = asyncio.create_task(self.run_unit(unit))
+        while True:
+            done, pending = await asyncio.wait({task}, timeout=self.queue.lease_seconds / 3)
+            if done:
+                break
+            if not await asyncio.to_thread(self.queue.renew, unit, self.name):
+                logger.warning(f"lost the lease of work unit {unit.unit_id}, dropping it")
+                task.cancel()
+                return
+        try:
+            task.result()
+        except Exception as ex:
+            logger.exception(f"{unit.kind} unit {unit.unit_id} of job {unit.job_id} failed")
+            await asyncio.to_thread(self.queue.fail, unit, self.name, str(ex))
+            return
+        await asyncio.to_thread(self.queue.complete, unit, self.name)
+
+    async def run(self, poll_seconds: float = 2.0) -> None:
+        logger.info(f"export worker {self.name} waiting for work on {self.queue.path}")
+        try:
+            while True:
+                unit: WorkUnit | None = await asyncio.to_thread(self.queue.claim, self.name)
+                if unit is None:
+                    await asyncio.sleep(poll_seconds)
+                    continue
+                await self.work_on(unit)
+        finally:
+            self.queue.close()
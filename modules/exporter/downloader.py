@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+
+from .lazy_import import lazy_import
+from .memory_governor import MemoryAccount
+
+
+requests = lazy_import("requests")
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class AssetDownloader:
+    """
+    Downloads the assets of an export straight to disk in chunks, so memory use doesn't depend on how big the
+    attachments are.  A download is written to a .part file that is renamed into place once it's complete and, if
+    the size is known, has the right size, so an interrupted export never leaves a truncated asset behind.  A
+    dropped connection resumes the .part file with a Range request instead of starting over, and so does the next
+    export if the download never finished.
+
+    Downloads run in threads, and the bytes they can have in flight across the export are capped, so a guild export
+    downloading a pile of videos at once doesn't swamp the connection and the disk.  The same asset requested by two
+    channels at the same time is downloaded once.  Given a memory account, each running download is counted as the
+    chunk it buffers, and while the export is short on memory only one download runs at a time.
+    """
+
+    CHUNK_SIZE: int = 1024 * 1024
+    HEADERS: dict[str, str] = {
+        "Accept": (
+            "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,"
+            "application/signed-exchange;v=b3;q=0.7"
+        ),
+        # compressed responses would make Range offsets and the size check meaningless, media is compressed anyway
+        "Accept-Encoding": "identity",
+    }
+
+    def __init__(
+        self,
+        max_bytes_in_flight: int = 64 * 1024 * 1024,
+        max_attempts: int = 4,
+        timeout: float = 30.0,
+        memory: MemoryAccount | None = None,
+    ):
+        self.max_bytes_in_flight: int = max_bytes_in_flight
+        self.max_attempts: int = max_attempts
+        self.timeout: float = timeout
+        self.bytes_in_flight: int = 0
+        self.condition: asyncio.Condition = asyncio.Condition()
+        self.downloads: dict[str, asyncio.Task] = {}
+        self.memory: MemoryAccount | None = memory
+
+    def fetch(self, url: str, destination: str, expected_size: int | None) -> bool:
+        """
+        Downloads url to destination, resuming from where earlier attempts got to
+        :param url:
+        :param destination:
+        :param expected_size: the size discord reports for the file, if known
+        :return: whether destination was downloaded completely
+        """
+        part_filename: str = f"{destination}.part"
+        for attempt in range(self.max_attempts):
+            offset: int = os.path.getsize(part_filename) if os.path.isfile(part_filename) else 0
+            headers: dict[str, str] = dict(self.HEADERS)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 416 and offset and offset == expected_size:
+                        pass  # finished by an earlier attempt, it just wasn't renamed yet
+                    elif response.status_code in (200, 206):
+                        resumed: bool = response.status_code == 206 and response.headers.get(
+                            "Content-Range", ""
+                        ).startswith(f"bytes {offset}-")
+                        with open(part_filename, "ab" if resumed else "wb") as f:
+                            for chunk in response.iter_content(self.CHUNK_SIZE):
+                                f.write(chunk)
+                    else:
+                        logger.warning(f"error downloading file: {url}: HTTP {response.status_code}")
+                        if os.path.isfile(part_filename):
+                            os.remove(part_filename)
+                        return False
+            except (requests.RequestException, OSError) as ex:
+                logger.warning(f"download of {url} interrupted (attempt {attempt + 1}), resuming: {ex}")
+                continue
+
+            size: int = os.path.getsize(part_filename)
+            if expected_size is not None and size != expected_size:
+                logger.warning(f"downloaded {size} bytes of {url}, expected {expected_size}, starting over")
+                os.remove(part_filename)
+                continue
+            os.replace(part_filename, destination)
+            return True
+        logger.error(f"error downloading file: {url}: giving up after {self.max_attempts} attempts")
+        return False
+
+    async def reserve(self, size: int) -> None:
+        async with self.condition:
+            # a file bigger than the cap is let through once nothing else is in flight
+            await self.condition.wait_for(lambda: self.bytes_in_flight == 0 or self.has_room(size))
+            self.bytes_in_flight += size
+        if self.memory:
+            self.memory.add("downloads", self.CHUNK_SIZE)
+
+    def has_room(self, size: int) -> bool:
+        if self.memory and self.memory.governor.under_pressure:
+            return False
+        return self.bytes_in_flight + size <= self.max_bytes_in_flight
+
+    async def release(self, size: int) -> None:
+        if self.memory:
+            self.memory.release("downloads", self.CHUNK_SIZE)
+        async with self.condition:
+            self.bytes_in_flight -= size
+            self.condition.notify_all()
+
+    async def download_file(self, urls: list[str | None], destination: str, expected_size: int | None) -> bool:
+        size: int = expected_size or self.CHUNK_SIZE
+        await self.reserve(size)
+        try:
+            for url in urls:
+                if url is not None and await asyncio.to_thread(self.fetch, url, destination, expected_size):
+                    return True
+            return False
+        finally:
+            await self.release(size)
+
+    async def download(self, urls: list[str | None], destination: str, expected_size: int | None = None) -> bool:
+        """
+        :param urls: urls to try in order, None entries are skipped
+        :param destination:
+        :param expected_size:
+        :return: whether the file was downloaded
+        """
+        if destination not in self.downloads:
+            self.downloads[destination] = asyncio.create_task(self.download_file(urls, destination, expected_size))
+        try:
+            return await asyncio.shield(self.downloads[destination])
+        finally:
+            if self.downloads.get(destination) and self.downloads[destination].done():
+                del self.downloads[destination]
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+
+from .downloader import AssetDownloader
+from .io_executor import IOExecutor
+from .lazy_import import lazy_import
+
+
+Image = lazy_import("PIL.Image")
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class EmojiAtlas:
+    """
+    Packs the custom emoji of an export into a few sprite sheets, so a page full of emoji loads a handful of images
+    instead of one per emoji, and the archive holds a handful of files instead of thousands.  The HTML references
+    an emoji by CSS class, and the stylesheet generated next to the sheets maps every class to its cell.  Cell
+    positions are given in percent, so the same cell scales to the message and the reaction size.
+
+    The originals are downloaded into the cache dir rather than the export.  Each emoji keeps its cell across
+    exports into the same output dir, so a re-export only draws the emoji that are new onto the sheets that have
+    room for them.  Animated emoji can't go on a sheet and stay separate images.
+    """
+
+    CELL_SIZE: int = 48
+    COLUMNS: int = 16
+    ROWS: int = 16
+
+    def __init__(self, cache_dir: str):
+        self.source_dir: str = f"{cache_dir}/emoji"
+        self.used: set[int] = set()
+
+    @staticmethod
+    def is_available() -> bool:
+        return Image is not None
+
+    def get_source_path(self, emoji_id: int) -> str:
+        return f"{self.source_dir}/{emoji_id}.webp"
+
+    async def add(self, io: IOExecutor, downloader: AssetDownloader, emoji_id: int) -> bool:
+        """
+        :param io: the file operations of the export
+        :param downloader:
+        :param emoji_id:
+        :return: whether the emoji will be on the sheets
+        """
+        if emoji_id in self.used:
+            return True
+        source_path: str = self.get_source_path(emoji_id)
+        if not await io.isfile(source_path):
+            await io.makedirs(self.source_dir)
+            url: str = f"https://cdn.discordapp.com/emojis/{emoji_id}.webp?size=96&quality=lossless"
+            if not await downloader.download([url], source_path):
+                return False
+        self.used.add(emoji_id)
+        return True
+
+    def emoji_to_html(self, emoji_id: int) -> str:
+        return f'<span class="emojiSprite e{emoji_id}"></span>'
+
+    def load_manifest(self, atlas_dir: str) -> dict[str, int]:
+        manifest_path: str = f"{atlas_dir}/manifest.json"
+        if not os.path.isfile(manifest_path):
+            return {}
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def draw_cell(self, sheet, cell: int, emoji_id: int) -> None:
+        with Image.open(self.get_source_path(emoji_id)) as image:
+            image = image.convert("RGBA")
+            image.thumbnail((self.CELL_SIZE, self.CELL_SIZE), Image.LANCZOS)
+            column, row = cell % self.COLUMNS, cell // self.COLUMNS
+            # centered, so emoji that aren't square keep their aspect ratio
+            x: int = column * self.CELL_SIZE + (self.CELL_SIZE - image.width) // 2
+            y: int = row * self.CELL_SIZE + (self.CELL_SIZE - image.height) // 2
+            sheet.paste(image, (x, y))
+
+    def stylesheet(self, positions: dict[str, int]) -> str:
+        cells_per_sheet: int = self.COLUMNS * self.ROWS
+        css: list[str] = [
+            ".emojiSprite { display: inline-block; width: 30px; height: 30px; vertical-align: middle; "
+            f"background-repeat: no-repeat; background-size: {self.COLUMNS * 100}% {self.ROWS * 100}%; }}",
+            ".reaction .emojiSprite { width: 16px; height: 16px; }",
+        ]
+        for emoji_id, position in positions.items():
+            sheet, cell = divmod(position, cells_per_sheet)
+            x: float = (cell % self.COLUMNS) * 100 / (self.COLUMNS - 1)
+            y: float = (cell // self.COLUMNS) * 100 / (self.ROWS - 1)
+            css.append(
+                f'.e{emoji_id} {{ background-image: url("sheet_{sheet:03}.webp"); '
+                f"background-position: {x:g}% {y:g}%; }}"
+            )
+        return "\n".join(css)
+
+    def build(self, output_dir: str) -> None:
+        """
+        Draws the emoji used by the export onto the sheets, and writes the stylesheet and the manifest
+        :param output_dir:
+        :return:
+        """
+        atlas_dir: str = f"{output_dir}/assets/emoji"
+        os.makedirs(atlas_dir, exist_ok=True)
+        positions: dict[str, int] = self.load_manifest(atlas_dir)
+        new_ids: list[int] = sorted(emoji_id for emoji_id in self.used if str(emoji_id) not in positions)
+        cells_per_sheet: int = self.COLUMNS * self.ROWS
+
+        changed_sheets: dict[int, list[int]] = {}
+        for emoji_id in new_ids:
+            position: int = len(positions)
+            positions[str(emoji_id)] = position
+            changed_sheets.setdefault(position // cells_per_sheet, []).append(emoji_id)
+
+        for sheet_idx, emoji_ids in changed_sheets.items():
+            sheet_path: str = f"{atlas_dir}/sheet_{sheet_idx:03}.webp"
+            if os.path.isfile(sheet_path):
+                with Image.open(sheet_path) as existing:
+                    sheet = existing.convert("RGBA")
+            else:
+                sheet = Image.new("RGBA", (self.COLUMNS * self.CELL_SIZE, self.ROWS * self.CELL_SIZE))
+            for emoji_id in emoji_ids:
+                try:
+                    self.draw_cell(sheet, positions[str(emoji_id)] % cells_per_sheet, emoji_id)
+                except OSError as ex:
+                    logger.warning(f"unable to add emoji {emoji_id} to the atlas: {ex}")
+            sheet.save(f"{sheet_path}.part", "WEBP", lossless=True)
+            os.replace(f"{sheet_path}.part", sheet_path)
+
+        with open(f"{atlas_dir}/emoji.css", "w") as f:
+            f.write(self.stylesheet(positions))
+        with open(f"{atlas_dir}/manifest.json", "w") as f:
+            json.dump(positions, f)
+        logger.info(f"emoji atlas: {len(new_ids)} new emoji drawn, {len(positions)} emoji on the sheets")
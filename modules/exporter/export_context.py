@@ -0,0 +1,170 @@
+import logging
+
+import discord
+
+from .downloader import AssetDownloader
+from .emoji_atlas import EmojiAtlas
+from .export_filter import ExportFilter
+from .html_compactor import HtmlCompactor
+from .io_executor import IOExecutor
+from .memory_governor import MemoryGovernor
+from .message_store import MessageStore
+from .object_storage import ObjectStorageSink
+from .progress import ExportProgress
+from .render_memo import RenderMemo, get_shared_memo, new_scope
+from .render_profiler import RenderProfiler
+from .renderers import HtmlRenderer, Renderer, create_renderers
+from .resolver import ResolverCache
+from .search_index import SearchIndex
+from .static_assets import StaticAssets
+from .thumbnails import ThumbnailGenerator
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ExportContext:
+    """
+    The settings of an export and the state shared by everything it exports.  A channel export hands its context
+    to the exporters of its threads, and a guild export hands one context to every channel, so caches, the search
+    index and the set of downloaded assets are shared between them.
+    """
+
+    def __init__(
+        self,
+        bot: discord.Client,
+        viewer_mode: bool = False,
+        viewer_chunk_size: int = 200,
+        search_index: SearchIndex | None = None,
+        thumbnail_generator: ThumbnailGenerator | None = None,
+        cache_dir: str | None = None,
+        crawl_concurrency: int = 1,
+        message_store: MessageStore | None = None,
+        download_bytes_in_flight: int = 64 * 1024 * 1024,
+        renderers: list[Renderer] | None = None,
+        emoji_atlas: EmojiAtlas | None = None,
+        subset_fonts: bool = False,
+        memory_budget: int = 0,
+        storage: ObjectStorageSink | None = None,
+        render_memo: RenderMemo | None = None,
+        compact_html: bool = False,
+        export_filter: ExportFilter | None = None,
+    ):
+        self.viewer_mode: bool = viewer_mode
+        self.viewer_chunk_size: int = viewer_chunk_size
+        self.search_index: SearchIndex | None = search_index
+        self.thumbnail_generator: ThumbnailGenerator | None = thumbnail_generator
+        self.cache_dir: str | None = cache_dir
+        self.crawl_concurrency: int = crawl_concurrency
+        # the local mirror of the channel history, fed by gateway events
+        self.message_store: MessageStore | None = message_store
+        self.resolver: ResolverCache = ResolverCache(bot)
+        # rough count of the memory held by the export, 0 for no budget
+        self.memory: MemoryGovernor = MemoryGovernor(memory_budget)
+        self.downloader: AssetDownloader = AssetDownloader(
+            download_bytes_in_flight, memory=self.memory.account("downloads")
+        )
+        self.renderers: list[Renderer] = renderers or [HtmlRenderer()]
+        self.emoji_atlas: EmojiAtlas | None = emoji_atlas
+        self.static_assets: StaticAssets = StaticAssets(cache_dir, subset_fonts)
+        self.io: IOExecutor = IOExecutor()
+        # where finished exports are delivered instead of zips in the output channel
+        self.storage: ObjectStorageSink | None = storage
+        # rendered message content, possibly shared with other exports, and this export's scope in it
+        self.render_memo: RenderMemo | None = render_memo
+        self.memo_scope: int = new_scope()
+        self.compactor: HtmlCompactor | None = HtmlCompactor() if compact_html else None
+        # the part of each channel that is exported, set by whoever runs the export
+        self.export_filter: ExportFilter = export_filter or ExportFilter()
+        # counts fetched and rendered messages, replaced by whoever runs the export to report them
+        self.progress: ExportProgress = ExportProgress("export")
+        # set while the render profiler command is running
+        self.profiler: RenderProfiler | None = None
+        self.downloaded_assets: set[str] = set()
+        # document filenames of the other channels in the archive, so channel mentions can link to them
+        self.channel_documents: dict[int, str] = {}
+
+    @classmethod
+    def from_settings(
+        cls, bot: discord.Client, settings: dict, message_store: MessageStore | None = None
+    ) -> "ExportContext":
+        """
+        :param bot:
+        :param settings: the EXPORT section of the config
+        :param message_store:
+        :return:
+        """
+        thumbnail_generator: ThumbnailGenerator | None = None
+        if settings.get("thumbnails", False):
+            thumbnail_generator = ThumbnailGenerator(
+                settings.get("thumbnail_size", 600), settings.get("thumbnail_format", "webp")
+            )
+        emoji_atlas: EmojiAtlas | None = None
+        if settings.get("emoji_atlas", False):
+            if EmojiAtlas.is_available():
+                emoji_atlas = EmojiAtlas(settings.get("cache_dir", "output/cache"))
+            else:
+                logger.warning("Pillow is not installed, emoji will be exported as separate images")
+        render_memo: RenderMemo | None = None
+        render_memo_size: int = settings.get("render_memo_size", 20000)
+        if render_memo_size > 0:
+            if settings.get("render_memo_shared", False):
+                render_memo = get_shared_memo(render_memo_size)
+            else:
+                render_memo = RenderMemo(render_memo_size)
+        return cls(
+            bot,
+            viewer_mode=settings.get("viewer", False),
+            viewer_chunk_size=settings.get("viewer_chunk_size", 200),
+            search_index=SearchIndex() if settings.get("search_index", False) else None,
+            thumbnail_generator=thumbnail_generator,
+            cache_dir=settings.get("cache_dir", "output/cache"),
+            crawl_concurrency=settings.get("crawl_concurrency", 1),
+            message_store=message_store,
+            download_bytes_in_flight=settings.get("download_mb_in_flight", 64) * 1024 * 1024,
+            renderers=create_renderers(settings.get("renderers", ["html"])),
+            emoji_atlas=emoji_atlas,
+            subset_fonts=settings.get("subset_fonts", False),
+            memory_budget=settings.get("memory_budget_mb", 1024) * 1024 * 1024,
+            storage=ObjectStorageSink.from_settings(settings.get("storage", {})),
+            render_memo=render_memo,
+            compact_html=settings.get("compact_html", False),
+        )
+
+    def close(self) -> None:
+        if self.thumbnail_generator:
+            self.thumbnail_generator.close()
+        self.io.close()
+
+    async def prepare(self, output_dir: str) -> None:
+        """
+        Sets up the outputs shared by every document of the export before the first one is written
+        :param output_dir:
+        :return:
+        """
+        for renderer in self.renderers:
+            await self.io.run(renderer.prepare, output_dir)
+
+    async def finish(self, output_dir: str) -> None:
+        """
+        Completes the work shared by every document of the export once they have all been written
+        :param output_dir:
+        :return:
+        """
+        if self.thumbnail_generator:
+            await self.thumbnail_generator.wait(self.io)
+        for renderer in self.renderers:
+            await self.io.run(renderer.finish)
+        if self.emoji_atlas:
+            await self.io.run(self.emoji_atlas.build, output_dir)
+        # pages kept from an earlier export, or written by other workers, weren't rendered here but need their glyphs
+        await self.io.run(self.static_assets.add_files, output_dir)
+        await self.io.run(self.static_assets.materialize, output_dir)
+        if self.search_index:
+            await self.io.run(self.search_index.write, f"{output_dir}/assets/search")
+        logger.info(self.io.stats())
+        logger.info(self.memory.summary())
+        if self.render_memo:
+            logger.info(self.render_memo.summary())
+        if self.compactor:
+            logger.info(self.compactor.summary())
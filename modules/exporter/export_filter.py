@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+import json
+import re
+
+import discord
+
+
+URL_PATTERN: re.Pattern = re.compile(r"https?://\S")
+
+
+def parse_bound(value: str) -> int:
+    """
+    :param value: a snowflake, or a date or time in ISO format (2024-01-31, 2024-01-31T12:00), UTC unless it says
+    otherwise
+    :return: the snowflake of the value, raises ValueError if it's neither
+    """
+    value = value.strip()
+    # the shortest snowflakes of today are 17 digits, a compact date is 8
+    if value.isdigit() and len(value) > 12:
+        return int(value)
+    moment: datetime.datetime = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return discord.utils.time_snowflake(moment)
+
+
+class ExportFilter:
+    """
+    Limits an export to part of a channel: a stretch of time, the messages of some authors, messages with
+    attachments or links, and some of its threads.
+
+    The range is pushed down to wherever messages come from, so an export of last week fetches last week and not
+    the years before it: history is fetched between the bounds, the message store only backfills and loads the
+    range, threads that were archived before the range aren't paged through, and threads that started after it or
+    went quiet before it are left out.  The other filters can only be applied to messages once they're fetched.
+
+    An empty filter exports everything.  A filtered export has an output dir of its own, so it never mixes pages
+    with the full export of the channel, and it doesn't touch the thread catalog kept for incremental exports.
+    """
+
+    def __init__(
+        self,
+        after: int | None = None,
+        before: int | None = None,
+        authors: set[int] | None = None,
+        attachments_only: bool = False,
+        links_only: bool = False,
+        threads: set[int] | None = None,
+        skip_threads: set[int] | None = None,
+    ):
+        # snowflakes, both exclusive
+        self.after: int | None = after
+        self.before: int | None = before
+        self.authors: set[int] = authors or set()
+        self.attachments_only: bool = attachments_only
+        self.links_only: bool = links_only
+        # only these threads, every thread if empty
+        self.threads: set[int] = threads or set()
+        self.skip_threads: set[int] = skip_threads or set()
+
+    @property
+    def is_empty(self) -> bool:
+        return self.to_dict() == ExportFilter().to_dict()
+
+    @property
+    def filters_messages(self) -> bool:
+        """
+        :return: whether fetched messages still have to be filtered, the range is taken care of by the fetch
+        """
+        return bool(self.authors) or self.attachments_only or self.links_only
+
+    def in_range(self, snowflake: int) -> bool:
+        return (self.after is None or snowflake > self.after) and (self.before is None or snowflake < self.before)
+
+    def clamp(self, after: int, before: int | None) -> tuple[int, int | None] | None:
+        """
+        :param after: snowflake, exclusive
+        :param before: snowflake, exclusive, None for up to now
+        :return: the part of the range within the filter's, None if they don't overlap
+        """
+        if self.after is not None:
+            after = max(after, self.after)
+        if self.before is not None:
+            before = self.before if before is None else min(before, self.before)
+        if before is not None and before <= after + 1:
+            return None
+        return after, before
+
+    def matches(self, message: discord.Message) -> bool:
+        if not self.in_range(message.id):
+            return False
+        if self.authors and message.author.id not in self.authors:
+            return False
+        if self.attachments_only and not message.attachments:
+            return False
+        if self.links_only and not (URL_PATTERN.search(message.content) or any(embed.url for embed in message.embeds)):
+            return False
+        return True
+
+    def includes_thread(self, thread_id: int, last_message_id: int | None) -> bool:
+        """
+        :param thread_id: a thread's id is when it started
+        :param last_message_id:
+        :return: whether the thread is exported
+        """
+        if thread_id in self.skip_threads or (self.threads and thread_id not in self.threads):
+            return False
+        if self.before is not None and thread_id >= self.before:
+            return False
+        if self.after is not None and last_message_id is not None and last_message_id <= self.after:
+            return False
+        return True
+
+    @property
+    def archived_after(self) -> datetime.datetime | None:
+        """
+        :return: threads archived before this have no messages in the range
+        """
+        return discord.utils.snowflake_time(self.after) if self.after is not None else None
+
+    def output_dir(self, output_dir: str) -> str:
+        """
+        :param output_dir: the output dir of the full export
+        :return: the output dir of the filtered export, the same for the same filter
+        """
+        if self.is_empty:
+            return output_dir
+        digest: str = hashlib.blake2b(json.dumps(self.to_dict()).encode(), digest_size=4).hexdigest()
+        return f"{output_dir}_{digest}"
+
+    def to_dict(self) -> dict:
+        return {
+            "after": self.after,
+            "before": self.before,
+            "authors": sorted(self.authors),
+            "attachments_only": self.attachments_only,
+            "links_only": self.links_only,
+            "threads": sorted(self.threads),
+            "skip_threads": sorted(self.skip_threads),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExportFilter":
+        return cls(
+            data.get("after"),
+            data.get("before"),
+            set(data.get("authors", [])),
+            data.get("attachments_only", False),
+            data.get("links_only", False),
+            set(data.get("threads", [])),
+            set(data.get("skip_threads", [])),
+        )
+
+    def summary(self) -> str:
+        parts: list[str] = []
+        if self.after is not None:
+            parts.append(f"after {discord.utils.snowflake_time(self.after):%Y-%m-%d %H:%M}")
+        if self.before is not None:
+            parts.append(f"before {discord.utils.snowflake_time(self.before):%Y-%m-%d %H:%M}")
+        if self.authors:
+            parts.append(f"by {len(self.authors)} authors")
+        if self.attachments_only:
+            parts.append("with attachments")
+        if self.links_only:
+            parts.append("with links")
+        if self.threads:
+            parts.append(f"only {len(self.threads)} threads")
+        if self.skip_threads:
+            parts.append(f"without {len(self.skip_threads)} threads")
+        return ", ".join(parts) if parts else "everything"
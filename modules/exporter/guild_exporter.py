@@ -0,0 +1,156 @@
+import asyncio
+import logging
+
+import discord
+
+from .channel_exporter import ChannelExporter, load_template
+from .export_context import ExportContext
+from .packaging import ExportPackager
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class GuildExporter:
+    """
+    Exports every text and forum channel of a guild into a single archive.  All channels share one output dir, so
+    avatars, emoji and attachments are only downloaded once, and one export context, so name lookups, the search
+    index and thumbnails are shared too.  Threads are exported along with the channel they belong to.
+
+    A few channels are exported at the same time, which is the rate limit budget of the export.  The channels that
+    have been active the longest go first, so the biggest channels don't end up running on their own at the end.
+    """
+
+    def __init__(
+        self,
+        bot: discord.Client,
+        guild: discord.Guild,
+        output_dir: str,
+        output_channel_id: int,
+        context: ExportContext | None = None,
+        concurrency: int = 3,
+    ):
+        self.bot: discord.Client = bot
+        self.guild: discord.Guild = guild
+        self.output_dir: str = output_dir
+        self.output_channel_id: int = output_channel_id
+        self.context: ExportContext = context or ExportContext(bot)
+        self.concurrency: int = concurrency
+        self.exporters: list[ChannelExporter] = []
+        self.doc_template: str = load_template("export_doc.html")
+
+    @staticmethod
+    def get_channel_document_filename(channel_id: int) -> str:
+        return f"channel_{channel_id}_index.html"
+
+    @staticmethod
+    def get_channels(guild: discord.Guild) -> list[discord.TextChannel | discord.ForumChannel]:
+        """
+        :param guild:
+        :return: the channels of the guild that are exported, the ones the bot can read the history of
+        """
+        channels: list[discord.TextChannel | discord.ForumChannel] = []
+        for channel in guild.text_channels + guild.forums:
+            permissions: discord.Permissions = channel.permissions_for(guild.me)
+            if permissions.read_messages and permissions.read_message_history:
+                channels.append(channel)
+            else:
+                logger.info(f"skipping {channel.name}, no access to its history")
+        return channels
+
+    @staticmethod
+    def estimate_size(channel: discord.TextChannel | discord.ForumChannel) -> int:
+        """
+        Snowflakes start with a timestamp, so the gap between the channel id and its last message id is how long
+        the channel has been in use.  It's a rough but free estimate of how long the channel will take to export.
+        """
+        last_message_id: int = channel.last_message_id or channel.id
+        return (last_message_id >> 22) - (channel.id >> 22)
+
+    async def export_channels(self) -> None:
+        queue: asyncio.Queue[ChannelExporter] = asyncio.Queue()
+        for exporter in sorted(self.exporters, key=lambda e: self.estimate_size(e.channel), reverse=True):
+            queue.put_nowait(exporter)
+
+        async def worker() -> None:
+            while not queue.empty():
+                exporter: ChannelExporter = queue.get_nowait()
+                logger.info(f'exporting "{exporter.channel.name}", {queue.qsize()} channels left')
+                try:
+                    await exporter.export_documents()
+                except Exception as ex:
+                    logger.error(f"error exporting {exporter.channel.name}: {ex}")
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def index_to_html(self) -> str:
+        categories: dict[str, str] = {}
+        for exporter in sorted(self.exporters, key=lambda e: (e.channel.category_id or 0, e.channel.position)):
+            category: str = exporter.channel.category.name if exporter.channel.category else ""
+            categories.setdefault(category, "")
+            categories[category] += f"""
+                <div class="messageBlock flex-row">
+                    <div class="gutter"><span><i>#</i></span></div>
+                    <div class="content threadLink">
+                        <a class="subtleLink" href="./{exporter.document_filename}">{exporter.channel.name}</a>
+                    </div>
+                </div>
+                """
+        channels_html: str = ""
+        for category, category_html in categories.items():
+            if category:
+                channels_html += f'<div class="dayDivider"><div class="dayDividerText">{category}</div></div>'
+            channels_html += category_html
+        return f"""
+             <div class="pageHeader">
+                 <h2>{self.guild.name}</h2>
+             </div>
+             <div class="messageContainer">
+                 {channels_html}
+             </div>
+             """
+
+    async def write_index(self) -> None:
+        index_html: str = self.index_to_html()
+        self.context.static_assets.add_text(index_html)
+        await self.context.io.write_text(
+            f"{self.output_dir}/index.html", self.doc_template.replace("{body}", index_html)
+        )
+
+    def create_exporters(self) -> None:
+        for channel in self.get_channels(self.guild):
+            exporter = ChannelExporter(self.bot, channel, self.output_dir, -1, self.context)
+            exporter.document_filename = self.get_channel_document_filename(channel.id)
+            self.context.channel_documents[channel.id] = exporter.document_filename
+            self.exporters.append(exporter)
+
+    async def package(self) -> None:
+        """
+        Writes the index page and the shared assets once every channel is written, and packages up the archive
+        :return:
+        """
+        self.context.progress.set_stage("packaging")
+        await self.write_index()
+        await self.context.finish(self.output_dir)
+        packager = ExportPackager(
+            self.bot,
+            self.output_dir,
+            self.output_channel_id,
+            str(self.guild.id),
+            self.guild.name,
+            self.guild.filesize_limit,
+            self.context.io,
+            self.context.storage,
+        )
+        await packager.package()
+
+    async def export(self) -> None:
+        logger.info(f'Starting export of all channels on "{self.guild.name}"')
+        self.context.io.start_lag_monitor()
+        await self.context.io.makedirs(self.output_dir)
+        # the channels share the renderers, they're prepared before any of them can start writing
+        await self.context.prepare(self.output_dir)
+        self.create_exporters()
+        await self.export_channels()
+        await self.package()
+        logger.info("Guild export completed")
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+
+import discord
+
+from .memory_governor import MemoryAccount, estimate_message_size
+from .progress import ExportProgress
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class HistoryRange:
+    """
+    A slice of a channel's history between two snowflakes, both exclusive.  before can be moved down while the
+    range is being crawled, when another worker takes over the second half of it.
+    """
+
+    def __init__(self, after: int, before: int):
+        self.after: int = after
+        self.before: int = before
+        self.cursor: int = after
+        self.messages: list[discord.Message] = []
+
+    @property
+    def remaining(self) -> int:
+        return self.before - self.cursor
+
+
+class ParallelHistoryCrawler:
+    """
+    Fetches the history of a channel with several cursors at once.  Paging through history with a single cursor
+    means one request at a time, so on big channels the round trip time rather than the rate limit decides how
+    long fetching takes.
+
+    The lifetime of the channel, from its creation to now, is split into snowflake ranges which are crawled
+    concurrently.  A worker that runs out of ranges splits the busiest remaining range in half and takes over the
+    second half, so empty stretches of history finish quickly and dense ones get shared between the workers.
+    discord.py still queues requests on the channel's rate limit bucket, the concurrency just keeps it busy.
+
+    Given a memory account, the fetched messages are counted against it and the workers pause while the export is
+    short on memory.  Given the progress of the export, the fetched messages are counted in it as they come in.
+    """
+
+    # don't split ranges that cover less than an hour, the overlap in fetched pages isn't worth it
+    MIN_SPLIT: int = (60 * 60 * 1000) << 22
+
+    def __init__(
+        self,
+        channel: discord.abc.Messageable,
+        concurrency: int = 4,
+        ranges_per_worker: int = 2,
+        memory: MemoryAccount | None = None,
+        progress: ExportProgress | None = None,
+    ):
+        self.channel: discord.abc.Messageable = channel
+        self.concurrency: int = concurrency
+        self.ranges_per_worker: int = ranges_per_worker
+        self.ranges: list[HistoryRange] = []
+        self.pending: list[HistoryRange] = []
+        self.active: list[HistoryRange] = []
+        self.count: int = 0
+        self.memory: MemoryAccount | None = memory
+        self.progress: ExportProgress | None = progress
+
+    def create_ranges(self, after: int, before: int) -> None:
+        range_count: int = self.concurrency * self.ranges_per_worker
+        step: int = max((before - after) // range_count, 1)
+        bounds: list[int] = sorted({min(after + step * idx, before) for idx in range(range_count)} | {before})
+        for lower, upper in zip(bounds, bounds[1:]):
+            # both bounds are exclusive, a message right on a split point belongs to the range before it
+            self.ranges.append(HistoryRange(lower, upper if upper == before else upper + 1))
+        self.pending = list(self.ranges)
+
+    def split_busiest_range(self) -> HistoryRange | None:
+        candidates: list[HistoryRange] = [r for r in self.active if r.remaining > self.MIN_SPLIT]
+        if not candidates:
+            return None
+        busiest: HistoryRange = max(candidates, key=lambda r: r.remaining)
+        middle: int = busiest.cursor + busiest.remaining // 2
+        second_half = HistoryRange(middle - 1, busiest.before)
+        busiest.before = middle
+        self.ranges.append(second_half)
+        return second_half
+
+    async def crawl_range(self, history_range: HistoryRange) -> None:
+        async for message in self.channel.history(
+            limit=None,
+            after=discord.Object(history_range.cursor),
+            before=discord.Object(history_range.before),
+            oldest_first=True,
+        ):
+            if message.id >= history_range.before:
+                break  # the rest of this range was handed to another worker
+            history_range.messages.append(message)
+            history_range.cursor = message.id
+            self.count += 1
+            if self.progress:
+                self.progress.add_fetched()
+            if self.count % 1000 == 0:
+                logger.info(f"loaded {self.count} messages")
+            if self.memory:
+                self.memory.add("messages", estimate_message_size(message))
+                await self.memory.wait_for_room()
+        history_range.cursor = history_range.before
+
+    async def worker(self) -> None:
+        while True:
+            if self.pending:
+                history_range: HistoryRange = self.pending.pop(0)
+            else:
+                history_range = self.split_busiest_range()
+                if history_range is None:
+                    return
+            self.active.append(history_range)
+            try:
+                await self.crawl_range(history_range)
+            finally:
+                self.active.remove(history_range)
+
+    async def crawl(self, after: int, before: int) -> list[discord.Message]:
+        """
+        :param after: snowflake to crawl after, exclusive
+        :param before: snowflake to crawl before, exclusive
+        :return: the messages, oldest first
+        """
+        self.create_ranges(after, before)
+        await asyncio.gather(*(self.worker() for _ in range(self.concurrency)))
+        logger.info(f"crawled {len(self.ranges)} ranges with {self.concurrency} workers")
+        messages: list[discord.Message] = []
+        for history_range in sorted(self.ranges, key=lambda r: r.after):
+            messages.extend(history_range.messages)
+        return messages
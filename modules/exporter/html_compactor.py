@@ -0,0 +1,96 @@
+import calendar
+import datetime
+import hashlib
+import re
+
+
+class HtmlCompactor:
+    """
+    Shrinks the HTML of rendered messages.  Most of a message block is markup repeated on every message: the layout
+    whitespace of the templates, the full avatar url, the role colour of the author as an inline style, and a script
+    per timestamp to show it in local time.  The compactor rewrites each block as it's rendered:
+
+      * role colours and avatars become classes, defined once in a stylesheet per document
+      * timestamps keep their time in a data attribute, converted by one script in the page template
+      * layout whitespace is collapsed, and dropped next to block tags where it's never shown, except in <pre>
+
+    Class names are derived from the colour and the url, so they're the same in every process of an export.
+    Avatars shown as backgrounds aren't lazy loaded, which costs little as a page shows the same few avatars over
+    and over.
+    """
+
+    USERNAME_PATTERN: re.Pattern = re.compile(r'<span class="username" style="color: #(?P<color>[0-9a-f]{6});">')
+    AVATAR_PATTERN: re.Pattern = re.compile(
+        r'(?P<gutter><div class="gutter">\s*)<img src="(?P<url>https://cdn\.discordapp\.com/[^"]*avatars/[^"]+)" '
+        r'loading="lazy" decoding="async">'
+    )
+    TIMESTAMP_PATTERN: re.Pattern = re.compile(
+        r'<span class="timestamp" id="ts_(?P<id>\d+)">\s*(?P<text>[^<]*?)\s*</span>\s*'
+        r"<script>(?P<function>utcToLocal\w*)\('ts_(?P=id)', (?P<time>\d+(?:, \d+){5})\);</script>"
+    )
+    PRE_PATTERN: re.Pattern = re.compile(r"(<pre>.*?</pre>)", re.DOTALL)
+    WHITESPACE_PATTERN: re.Pattern = re.compile(r"\s+")
+    BLOCK_TAG_PATTERN: re.Pattern = re.compile(r" ?(</?(?:div|ul|li|h[1-3]|blockquote|br|script)\b[^>]*>) ?")
+    TAG_END_PATTERN: re.Pattern = re.compile(r"(<[a-z][^<>]*?) >")
+
+    TIMESTAMP_KINDS: dict[str, str] = {"utcToLocal": "datetime", "utcToLocalTime": "time", "utcToLocalDate": "date"}
+
+    def __init__(self):
+        self.rules: dict[str, str] = {}
+        self.bytes_before: int = 0
+        self.bytes_after: int = 0
+        self.blocks: int = 0
+
+    def color_class(self, match: re.Match, classes: set[str]) -> str:
+        name: str = f"c{match['color']}"
+        self.rules.setdefault(name, f".{name}{{color:#{match['color']}}}")
+        classes.add(name)
+        return f'<span class="username {name}">'
+
+    def avatar_class(self, match: re.Match, classes: set[str]) -> str:
+        name: str = "a" + hashlib.blake2b(match["url"].encode(), digest_size=6).hexdigest()
+        self.rules.setdefault(name, f'.{name}{{background-image:url("{match["url"]}")}}')
+        classes.add(name)
+        return f'{match["gutter"]}<i class="avatar {name}"></i>'
+
+    def timestamp(self, match: re.Match) -> str:
+        year, month, day, hour, minute, second = (int(value) for value in match["time"].split(", "))
+        # the month is zero based, for javascript
+        seconds: int = calendar.timegm(datetime.datetime(year, month + 1, day, hour, minute, second).timetuple())
+        kind: str = self.TIMESTAMP_KINDS[match["function"]]
+        return f'<span class="timestamp" data-{kind}="{seconds}">{match["text"]}</span>'
+
+    def minify(self, html: str) -> str:
+        parts: list[str] = self.PRE_PATTERN.split(html)
+        for i in range(0, len(parts), 2):
+            # whitespace is collapsed into a single space by the browser anyway, and not shown at all around blocks
+            part: str = self.WHITESPACE_PATTERN.sub(" ", parts[i])
+            part = self.TAG_END_PATTERN.sub(r"\1>", part)
+            parts[i] = self.BLOCK_TAG_PATTERN.sub(r"\1", part)
+        return "".join(parts).strip()
+
+    def compact(self, html: str, classes: set[str]) -> str:
+        """
+        :param html: a rendered message block
+        :param classes: the classes used by the document, the ones the block uses are added
+        :return: the compacted block
+        """
+        compacted: str = self.USERNAME_PATTERN.sub(lambda match: self.color_class(match, classes), html)
+        compacted = self.AVATAR_PATTERN.sub(lambda match: self.avatar_class(match, classes), compacted)
+        compacted = self.TIMESTAMP_PATTERN.sub(self.timestamp, compacted)
+        compacted = self.minify(compacted)
+        self.bytes_before += len(html.encode())
+        self.bytes_after += len(compacted.encode())
+        self.blocks += 1
+        return compacted
+
+    def stylesheet(self, classes: set[str]) -> str:
+        return "\n".join(self.rules[name] for name in sorted(classes))
+
+    def summary(self) -> str:
+        blocks: int = max(self.blocks, 1)
+        saved: float = 1 - self.bytes_after / self.bytes_before if self.bytes_before else 0.0
+        return (
+            f"compacted {self.blocks} messages from {self.bytes_before / blocks:.0f} to "
+            f"{self.bytes_after / blocks:.0f} bytes per message, {saved * 100:.0f}% smaller"
+        )
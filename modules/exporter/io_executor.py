@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class IOExecutor:
+    """
+    Runs the file operations of an export on a small thread pool, so a slow disk stalls the export rather than the
+    bot's event loop.  The number of operations waiting for the pool is bounded, an export that writes faster
+    than the disk keeps up waits for room instead of queueing up writes in memory.
+
+    Small files, such as viewer chunks, can be queued with write_later() and are written in batches, one pool job
+    per batch.  Queue depths, operation counts and the time spent in the pool are kept for the export summary,
+    along with the worst event loop lag seen while the export was running.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queued: int = 64, batch_size: int = 32):
+        self.max_workers: int = max_workers
+        self.batch_size: int = batch_size
+        self.pool: ThreadPoolExecutor | None = None
+        self.slots: asyncio.Semaphore = asyncio.Semaphore(max_queued)
+        self.pending_writes: list[tuple[str, str]] = []
+        self.queued: int = 0
+        self.max_queue_depth: int = 0
+        self.operations: int = 0
+        self.io_seconds: float = 0.0
+        self.io_seconds_lock: threading.Lock = threading.Lock()
+        self.max_loop_lag: float = 0.0
+        self.lag_monitor: asyncio.Task | None = None
+
+    def get_pool(self) -> ThreadPoolExecutor:
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="export-io")
+        return self.pool
+
+    def timed(self, func: Callable, *args) -> Any:
+        started_at: float = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            with self.io_seconds_lock:
+                self.io_seconds += time.perf_counter() - started_at
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Runs a blocking file operation on the pool
+        :param func:
+        :param args:
+        :return: what func returned
+        """
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        try:
+            async with self.slots:
+                return await asyncio.get_running_loop().run_in_executor(self.get_pool(), self.timed, func, *args)
+        finally:
+            self.queued -= 1
+            self.operations += 1
+
+    @staticmethod
+    def write_files(files: list[tuple[str, str]]) -> None:
+        for path, text in files:
+            with open(path, "w") as f:
+                f.write(text)
+
+    async def write_text(self, path: str, text: str) -> None:
+        await self.run(self.write_files, [(path, text)])
+
+    async def write_later(self, path: str, text: str) -> None:
+        """
+        Queues a small file to be written with the next batch, flush() writes whatever is left
+        """
+        self.pending_writes.append((path, text))
+        if len(self.pending_writes) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        files, self.pending_writes = self.pending_writes, []
+        if files:
+            await self.run(self.write_files, files)
+
+    async def makedirs(self, path: str) -> None:
+        await self.run(os.makedirs, path, 0o777, True)
+
+    async def isfile(self, path: str) -> bool:
+        return await self.run(os.path.isfile, path)
+
+    async def monitor_loop_lag(self, interval: float = 0.1) -> None:
+        while True:
+            started_at: float = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.max_loop_lag = max(self.max_loop_lag, time.perf_counter() - started_at - interval)
+
+    def start_lag_monitor(self) -> None:
+        if self.lag_monitor is None:
+            self.lag_monitor = asyncio.create_task(self.monitor_loop_lag())
+
+    def stats(self) -> str:
+        return (
+            f"{self.operations} io operations taking {self.io_seconds:.1f}s, max queue depth {self.max_queue_depth}, "
+            f"max event loop lag {self.max_loop_lag * 1000:.0f}ms"
+        )
+
+    def close(self) -> None:
+        if self.lag_monitor:
+            self.lag_monitor.cancel()
+            self.lag_monitor = None
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
@@ -0,0 +1,32 @@
+import importlib
+import importlib.util
+from typing import Any
+
+
+class LazyModule:
+    """
+    Stands in for a module that is imported the first time one of its attributes is used.  The heavy optional
+    dependencies of the exporter (Pillow, pyarrow, boto3, fontTools...) take as long to import as the rest of the bot
+    together, and most exports never touch them.  The import goes through the import system every time, which makes
+    it safe from the threads the exporter runs file operations on.
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(importlib.import_module(self.name), attribute)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.name}>"
+
+
+def lazy_import(name: str) -> LazyModule | None:
+    """
+    Only the top level package is looked up, finding a submodule would import its parent
+    :param name: the module, submodules included, e.g. PIL.Image
+    :return: the stand in for the module, None if it isn't installed
+    """
+    if importlib.util.find_spec(name.partition(".")[0]) is None:
+        return None
+    return LazyModule(name)
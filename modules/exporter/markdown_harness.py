@@ -0,0 +1,440 @@
+"""
+A safety net for changes to the markdown tokenizer and the rendering of message content, run from the repo root:
+
+    python -m modules.exporter.markdown_harness golden --record markdown_golden.json
+    python -m modules.exporter.markdown_harness golden --check markdown_golden.json
+    python -m modules.exporter.markdown_harness diff --old git:HEAD --new modules.exporter.markdown_tokenizer
+    python -m modules.exporter.markdown_harness pathological
+
+The corpus is a curated list of discord markdown plus fuzzed messages built from markdown fragments, the fuzzed
+part is the same for the same seed.  golden records the tokens and the HTML of the corpus, record it before a
+change and check it after.  diff runs two tokenizers side by side over the corpus and reports the messages they
+disagree on and their throughput, an implementation is a module with a MarkdownTokenizer, given by import path or
+as git:<revision> for the tokenizer of a commit.  pathological times the tokenizer and the rendering on inputs
+of growing size and flags the ones whose time grows faster than their size.
+
+Nothing is looked up or downloaded, mentions render as unknown and emoji as the asset they would be saved as.
+"""
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import math
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+from typing import Callable
+
+import discord
+
+from .channel_exporter import ChannelExporter
+from .export_context import ExportContext
+from .markdown_tokenizer import MarkdownTokenType, Token
+
+
+CURATED: list[str] = [
+    "",
+    "plain text",
+    "**bold** *italic* __underline__ ~~strike~~",
+    "***bold italic*** **bold with *italic* inside**",
+    "__**underlined bold**__ and *half** open",
+    "# header\ntext after",
+    "## second\n### third\n#### not a header",
+    "#not a header",
+    "text # not a header either",
+    "- item\n- item two\n  - nested item\n* star item",
+    "-not a list\n- a list",
+    "> quote\nnot a quote",
+    "> quote one\n> quote two",
+    ">>> multi\nline\nquote",
+    "a > b and c < d & e",
+    "`code text` and `more code`",
+    "`unclosed code",
+    "```\ncode block\n```",
+    "```py\ndef f():\n    return '<b>'\n```",
+    "```unclosed block",
+    "before ```inline block``` after",
+    "https://example.com/path?query=1&b=2",
+    "HTTPS://EXAMPLE.COM and http://a.b/c) trailing",
+    "<https://example.com/odd>",
+    "[masked](https://example.com) link",
+    "[masked **bold**](https://example.com/a_b)",
+    "[not a link] (https://example.com)",
+    "<@123456789012345678> hello <@!123456789012345678>",
+    "<@&123456789012345678> role",
+    "<#123456789012345678> channel",
+    "<:emoji:123456789012345678> <a:animated:123456789012345678>",
+    "<:bad emoji:123> <@notanid>",
+    "||spoiler|| text",
+    "<t:1700000000:R> timestamp",
+    "\\*escaped\\* \\_underscores\\_",
+    "line one\nline two\n\nline four",
+    "\n\n\n",
+    "unicode héllo wörld ✨ 日本語 🙂",
+    "<script>alert(1)</script>",
+    'quotes " and \' in text',
+]
+
+FRAGMENTS: list[str] = [
+    "word",
+    "two words",
+    "**",
+    "*",
+    "__",
+    "~~",
+    "`",
+    "```",
+    "\n",
+    "\n\n",
+    "# ",
+    "## ",
+    "- ",
+    "* ",
+    "> ",
+    ">>> ",
+    "<@123>",
+    "<@&456>",
+    "<#789>",
+    "<:e:101>",
+    "<a:e:102>",
+    "<",
+    ">",
+    "[",
+    "]",
+    "(",
+    ")",
+    "[text](https://a.b)",
+    "https://example.com",
+    "<https://example.com>",
+    "&",
+    "'",
+    '"',
+    "\\",
+    "||",
+    "é",
+    "🙂",
+    " ",
+    "  ",
+]
+
+PATHOLOGICAL: dict[str, Callable[[int], str]] = {
+    "plain text": lambda n: "a" * n,
+    "spaces": lambda n: " " * n,
+    "newlines": lambda n: "\n" * n,
+    "open angle brackets": lambda n: "<" * n,
+    "open mentions": lambda n: "<@" * (n // 2),
+    "open brackets": lambda n: "[a](" * (n // 4),
+    "backticks": lambda n: "`" * n,
+    "unclosed code block": lambda n: "```" + "a" * n,
+    "stars": lambda n: "*" * n,
+    "unclosed bold": lambda n: "**a" * (n // 3),
+    "underscores": lambda n: "__a" * (n // 3),
+    "quote lines": lambda n: "> a\n" * (n // 4),
+    "list lines": lambda n: "- a\n" * (n // 4),
+    "header lines": lambda n: "# a\n" * (n // 4),
+    "links": lambda n: "http://a " * (n // 9),
+}
+
+
+def fuzz_corpus(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 16))) for _ in range(count)]
+
+
+def load_tokenizer(spec: str) -> type:
+    """
+    :param spec: import path of a module with a MarkdownTokenizer, or git:<revision> for the tokenizer of a commit
+    :return: the tokenizer class
+    """
+    if not spec.startswith("git:"):
+        return importlib.import_module(spec).MarkdownTokenizer
+    revision: str = spec.removeprefix("git:")
+    path: str = f"{revision}:modules/exporter/markdown_tokenizer.py"
+    source: str = subprocess.run(["git", "show", path], capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType(f"markdown_tokenizer_{revision}")
+    exec(compile(source, f"{revision}:markdown_tokenizer.py", "exec"), module.__dict__)
+    return module.MarkdownTokenizer
+
+
+def adapt_tokenizer(tokenizer_class: type) -> type:
+    """
+    A tokenizer loaded from another copy of the module has token types of its own enum, which the exporter doesn't
+    recognize, the adapter turns its tokens into ours
+    """
+
+    class AdaptedTokenizer:
+        def __init__(self, markdown: str):
+            self.tokenizer = tokenizer_class(markdown)
+            self.tokens: list[Token] = []
+
+        def tokenize(self) -> None:
+            self.tokenizer.tokenize()
+            self.tokens = [Token(MarkdownTokenType(t.token_type.value), t.value) for t in self.tokenizer.tokens]
+
+    return AdaptedTokenizer
+
+
+def tokenize(tokenizer_class: type, markdown: str) -> list[list[str]]:
+    tokenizer = tokenizer_class(markdown)
+    tokenizer.tokenize()
+    return [[token.token_type.value, token.value] for token in tokenizer.tokens]
+
+
+class HarnessClient(discord.Client):
+    def __init__(self):
+        super().__init__(intents=discord.Intents.none())
+
+    async def fetch_user(self, user_id: int, /) -> None:
+        return None
+
+
+class HarnessGuild:
+    id: int = 1
+    name: str = "harness"
+
+    def get_role(self, role_id: int) -> None:
+        return None
+
+
+class HarnessChannel:
+    id: int = 2
+    name: str = "harness"
+    guild: HarnessGuild = HarnessGuild()
+
+
+class HarnessExporter(ChannelExporter):
+    async def copy_asset_locally(self, asset_id: str, url: str, alt_url: str = None, size: int | None = None) -> str:
+        return f"./assets/{asset_id}"
+
+
+class Renderer:
+    """
+    Renders message content offline with a given tokenizer
+    """
+
+    def __init__(self, tokenizer_class: type | None = None):
+        self.client: HarnessClient = HarnessClient()
+        self.context: ExportContext = ExportContext(self.client)
+        self.exporter: HarnessExporter = HarnessExporter(self.client, HarnessChannel(), "", -1, self.context)
+        if tokenizer_class:
+            self.exporter.tokenizer_class = adapt_tokenizer(tokenizer_class)
+
+    async def render(self, markdown: str) -> str:
+        """
+        :return: the HTML, or the error rendering failed with so it shows up as a mismatch
+        """
+        try:
+            return await self.exporter.message_content_to_html(markdown)
+        except Exception as ex:
+            return f"!{type(ex).__name__}: {ex}"
+
+    def close(self) -> None:
+        self.context.close()
+
+
+def build_corpus(args: argparse.Namespace) -> list[str]:
+    return CURATED + fuzz_corpus(args.fuzz, args.seed)
+
+
+async def run_golden(args: argparse.Namespace) -> int:
+    tokenizer_class: type = load_tokenizer(args.tokenizer)
+    renderer = Renderer(tokenizer_class)
+    try:
+        if args.record:
+            cases: list[dict] = []
+            for markdown in build_corpus(args):
+                html: str = await renderer.render(markdown)
+                cases.append({"input": markdown, "tokens": tokenize(tokenizer_class, markdown), "html": html})
+            with open(args.record, "w", encoding="utf-8") as f:
+                json.dump(cases, f, ensure_ascii=False, indent=1)
+            print(f"recorded {len(cases)} cases to {args.record}")
+            return 0
+
+        with open(args.check, "r", encoding="utf-8") as f:
+            cases = json.load(f)
+        failures: int = 0
+        for case in cases:
+            tokens: list[list[str]] = tokenize(tokenizer_class, case["input"])
+            html = await renderer.render(case["input"])
+            if tokens != case["tokens"] or html != case["html"]:
+                failures += 1
+                if failures <= args.show:
+                    print(f"mismatch for {case['input']!r}")
+                    if tokens != case["tokens"]:
+                        print(f"  tokens   {case['tokens']}\n  now      {tokens}")
+                    if html != case["html"]:
+                        print(f"  html     {case['html']!r}\n  now      {html!r}")
+        print(f"{len(cases) - failures} of {len(cases)} cases match the golden outputs")
+        return 1 if failures else 0
+    finally:
+        renderer.close()
+
+
+def measure(function: Callable[[], None], min_seconds: float = 0.1) -> float:
+    """
+    :return: seconds per call, repeating the call until min_seconds have passed
+    """
+    # like timeit, without the garbage collector going off at random points of one measurement but not another,
+    # and in cpu time, which a busy or virtual machine disturbs much less than the wall clock
+    gc.collect()
+    gc.disable()
+    try:
+        calls: int = 0
+        started_at: float = time.process_time()
+        while (elapsed := time.process_time() - started_at) < min_seconds:
+            function()
+            calls += 1
+    finally:
+        gc.enable()
+    return elapsed / calls
+
+
+async def measure_render(renderer: Renderer, corpus: list[str], min_seconds: float = 0.1) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        calls: int = 0
+        started_at: float = time.process_time()
+        while (elapsed := time.process_time() - started_at) < min_seconds:
+            for markdown in corpus:
+                await renderer.render(markdown)
+            calls += 1
+    finally:
+        gc.enable()
+    return elapsed / calls
+
+
+async def run_diff(args: argparse.Namespace) -> int:
+    corpus: list[str] = build_corpus(args)
+    corpus_bytes: int = sum(len(markdown.encode()) for markdown in corpus)
+    implementations: dict[str, type] = {"old": load_tokenizer(args.old), "new": load_tokenizer(args.new)}
+    renderers: dict[str, Renderer] = {name: Renderer(cls) for name, cls in implementations.items()}
+    try:
+        mismatches: int = 0
+        for markdown in corpus:
+            old_tokens: list[list[str]] = tokenize(implementations["old"], markdown)
+            new_tokens: list[list[str]] = tokenize(implementations["new"], markdown)
+            old_html: str = await renderers["old"].render(markdown)
+            new_html: str = await renderers["new"].render(markdown)
+            if old_tokens != new_tokens or old_html != new_html:
+                mismatches += 1
+                if mismatches <= args.show:
+                    print(f"mismatch for {markdown!r}\n  old {old_tokens}\n  new {new_tokens}")
+        print(f"{mismatches} of {len(corpus)} messages differ")
+
+        # the implementations take turns over several rounds and report their median, so a noisy machine slows
+        # both of them down rather than whichever happened to run at the time
+        tokenize_seconds: dict[str, list[float]] = {name: [] for name in implementations}
+        render_seconds: dict[str, list[float]] = {name: [] for name in implementations}
+        for round_number in range(args.rounds):
+            # and swap who goes first, the second run of a round is often a little faster
+            order: list[tuple[str, type]] = list(implementations.items())[:: 1 if round_number % 2 else -1]
+            for name, tokenizer_class in order:
+                tokenize_seconds[name].append(
+                    measure(lambda: [tokenize(tokenizer_class, markdown) for markdown in corpus])
+                )
+                render_seconds[name].append(await measure_render(renderers[name], corpus))
+
+        rates: dict[str, tuple[float, float, float]] = {}
+        for name, tokenizer_class in implementations.items():
+            tokens: int = sum(len(tokenize(tokenizer_class, markdown)) for markdown in corpus)
+            seconds: float = statistics.median(tokenize_seconds[name])
+            rates[name] = (
+                tokens / seconds,
+                corpus_bytes / seconds,
+                corpus_bytes / statistics.median(render_seconds[name]),
+            )
+            print(
+                f"{name}: {rates[name][0]:,.0f} tokens/s, {rates[name][1] / 1e6:.2f} MB/s tokenizing, "
+                f"{rates[name][2] / 1e6:.2f} MB/s rendering"
+            )
+        old, new = rates["old"], rates["new"]
+        print(
+            f"new/old: {new[0] / old[0]:.2f}x tokens/s, {new[1] / old[1]:.2f}x bytes/s tokenizing, "
+            f"{new[2] / old[2]:.2f}x bytes/s rendering"
+        )
+        return 1 if mismatches else 0
+    finally:
+        for renderer in renderers.values():
+            renderer.close()
+
+
+async def run_pathological(args: argparse.Namespace) -> int:
+    tokenizer_class: type = load_tokenizer(args.tokenizer)
+    renderer = Renderer(tokenizer_class)
+    flagged: int = 0
+    try:
+        for name, generate in PATHOLOGICAL.items():
+            timings: list[tuple[int, float]] = []
+            size: int = args.start_size
+            while size <= args.max_size:
+                markdown: str = generate(size)
+                started_at: float = time.process_time()
+                tokenize(tokenizer_class, markdown)
+                await renderer.render(markdown)
+                timings.append((size, time.process_time() - started_at))
+                if timings[-1][1] > args.budget:
+                    break
+                size *= 2
+            # how the time grows with the size between the two biggest inputs, 1 is linear and 2 quadratic
+            big, big_seconds = timings[-1]
+            exponent: float = math.nan
+            if len(timings) > 1:
+                small, small_seconds = timings[-2]
+                exponent = math.log(max(big_seconds, 1e-6) / max(small_seconds, 1e-6)) / math.log(big / small)
+            slow: bool = exponent > args.max_exponent or big_seconds > args.budget
+            flagged += slow
+            print(
+                f"{'SLOW' if slow else 'ok':<5} {name:<20} {big:>8} chars in {big_seconds * 1000:>9.1f}ms, "
+                f"growth exponent {exponent:.2f}"
+            )
+        return 1 if flagged else 0
+    finally:
+        renderer.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m modules.exporter.markdown_harness", description=__doc__)
+    parser.add_argument("--fuzz", type=int, default=500, help="number of fuzzed messages added to the corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--show", type=int, default=10, help="mismatches to print")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    golden = commands.add_parser("golden", help="record or check the golden tokens and HTML of the corpus")
+    action = golden.add_mutually_exclusive_group(required=True)
+    action.add_argument("--record", metavar="FILE")
+    action.add_argument("--check", metavar="FILE")
+    golden.add_argument("--tokenizer", default="modules.exporter.markdown_tokenizer")
+
+    diff = commands.add_parser("diff", help="compare two tokenizers on the corpus")
+    diff.add_argument("--old", default="git:HEAD")
+    diff.add_argument("--new", default="modules.exporter.markdown_tokenizer")
+    diff.add_argument("--rounds", type=int, default=9, help="timing rounds, the median is reported")
+
+    pathological = commands.add_parser("pathological", help="look for inputs whose time grows faster than their size")
+    pathological.add_argument("--tokenizer", default="modules.exporter.markdown_tokenizer")
+    pathological.add_argument("--start-size", type=int, default=1000)
+    pathological.add_argument("--max-size", type=int, default=64000)
+    pathological.add_argument("--budget", type=float, default=2.0, help="seconds a single input may take")
+    pathological.add_argument("--max-exponent", type=float, default=1.5)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args: argparse.Namespace = parse_args()
+    match args.command:
+        case "golden":
+            status: int = asyncio.run(run_golden(args))
+        case "diff":
+            status = asyncio.run(run_diff(args))
+        case _:
+            status = asyncio.run(run_pathological(args))
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
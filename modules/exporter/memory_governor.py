@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+import discord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def estimate_message_size(message: discord.Message) -> int:
+    """
+    A rough guess at the memory a loaded message takes up, the discord.py objects behind it included
+    :param message:
+    :return: bytes
+    """
+    parts: int = len(message.attachments) + len(message.embeds) + len(message.reactions)
+    return 1024 + 2 * len(message.content) + 512 * parts
+
+
+class MemoryAccount:
+    """
+    The memory held by one part of an export, a channel or the asset downloads, split up by what holds it
+    """
+
+    def __init__(self, governor: "MemoryGovernor", name: str):
+        self.governor: MemoryGovernor = governor
+        self.name: str = name
+        self.usage: dict[str, int] = {}
+        self.high_water: dict[str, int] = {}
+        self.peak: int = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.usage.values())
+
+    def add(self, category: str, size: int) -> None:
+        self.usage[category] = self.usage.get(category, 0) + size
+        self.high_water[category] = max(self.high_water.get(category, 0), self.usage[category])
+        self.peak = max(self.peak, self.total)
+        self.governor.changed(size)
+
+    def release(self, category: str, size: int | None = None) -> None:
+        """
+        :param category:
+        :param size: bytes to release, everything held for the category if None
+        :return:
+        """
+        held: int = self.usage.get(category, 0)
+        size = held if size is None else min(size, held)
+        self.usage[category] = held - size
+        self.governor.changed(-size)
+
+    async def wait_for_room(self) -> None:
+        await self.governor.wait_for_room(self)
+
+
+class MemoryGovernor:
+    """
+    Keeps an approximate count of the memory an export holds in loaded messages, rendered HTML and downloads
+    against a budget.  The counts are estimates rather than measurements, they only need to be good enough to
+    tell a huge export from a small one.
+
+    Once the export gets close to the budget, history fetches pause in wait_for_room() until memory is released,
+    and the asset downloader stops starting more than one download at a time.  Only the channel holding the most
+    memory keeps fetching, so the export always makes progress: a single channel bigger than the budget is let
+    through with a warning rather than waiting forever.  High water marks end up in the export summary.
+    """
+
+    def __init__(self, budget: int, pressure_ratio: float = 0.9):
+        self.budget: int = budget
+        self.pressure_ratio: float = pressure_ratio
+        self.accounts: list[MemoryAccount] = []
+        self.total: int = 0
+        self.peak: int = 0
+        self.pauses: int = 0
+        self.released: asyncio.Event = asyncio.Event()
+        self.warned: set[str] = set()
+
+    def account(self, name: str) -> MemoryAccount:
+        account = MemoryAccount(self, name)
+        self.accounts.append(account)
+        return account
+
+    @property
+    def under_pressure(self) -> bool:
+        return self.budget > 0 and self.total >= self.budget * self.pressure_ratio
+
+    def changed(self, size: int) -> None:
+        self.total += size
+        self.peak = max(self.peak, self.total)
+        if size < 0:
+            self.released.set()
+
+    async def wait_for_room(self, account: MemoryAccount) -> None:
+        paused: bool = False
+        while self.under_pressure:
+            if not any(other.total > account.total for other in self.accounts if other is not account):
+                if self.total > self.budget and account.name not in self.warned:
+                    self.warned.add(account.name)
+                    logger.warning(f"{account.name} alone is over the memory budget, letting it continue")
+                break
+            if not paused:
+                paused = True
+                self.pauses += 1
+                logger.info(f"pausing {account.name}, {self.total / 1024 / 1024:.0f} MB of the memory budget in use")
+            self.released.clear()
+            try:
+                await asyncio.wait_for(self.released.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> str:
+        busiest: list[MemoryAccount] = sorted(self.accounts, key=lambda a: a.peak, reverse=True)[:3]
+        marks: str = ", ".join(
+            f"{account.name} {account.peak / 1024 / 1024:.1f} MB ("
+            + " ".join(f"{category} {size / 1024 / 1024:.1f}" for category, size in account.high_water.items())
+            + ")"
+            for account in busiest
+        )
+        return (
+            f"memory high water mark {self.peak / 1024 / 1024:.1f} of {self.budget / 1024 / 1024:.0f} MB, "
+            f"{self.pauses} pauses, busiest: {marks}"
+        )
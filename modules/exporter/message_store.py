@@ -0,0 +1,341 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+import discord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def emoji_to_payload(emoji: str | discord.Emoji | discord.PartialEmoji) -> dict:
+    if isinstance(emoji, str):
+        return {"id": None, "name": emoji}
+    return {"id": str(emoji.id) if emoji.id else None, "name": emoji.name, "animated": emoji.animated}
+
+
+def same_emoji(first: dict, second: dict) -> bool:
+    # custom emoji are identified by id, unicode emoji by the emoji itself
+    if first.get("id") or second.get("id"):
+        return str(first.get("id")) == str(second.get("id"))
+    return first.get("name") == second.get("name")
+
+
+def message_to_payload(message: discord.Message) -> dict:
+    """
+    Turns a message back into the payload discord sent for it, or at least the parts of it the exporter uses, so it
+    can be stored and turned into a discord.Message again later
+    :param message:
+    :return:
+    """
+    author: discord.User | discord.Member = message.author
+    payload: dict = {
+        "id": str(message.id),
+        "channel_id": str(message.channel.id),
+        "type": message.type.value,
+        "content": message.content,
+        "timestamp": message.created_at.isoformat(),
+        "edited_timestamp": message.edited_at.isoformat() if message.edited_at else None,
+        "author": {
+            "id": str(author.id),
+            "username": author.name,
+            "global_name": author.global_name,
+            "discriminator": author.discriminator,
+            "avatar": author.avatar.key if author.avatar else None,
+            "bot": author.bot,
+        },
+        "attachments": [attachment.to_dict() for attachment in message.attachments],
+        "embeds": [embed.to_dict() for embed in message.embeds],
+        "reactions": [
+            {"emoji": emoji_to_payload(reaction.emoji), "count": reaction.count, "me": reaction.me}
+            for reaction in message.reactions
+        ],
+        "mention_roles": [str(role_id) for role_id in message.raw_role_mentions],
+        "pinned": message.pinned,
+        "flags": message.flags.value,
+    }
+    if message.webhook_id:
+        payload["webhook_id"] = str(message.webhook_id)
+    if message.reference:
+        payload["message_reference"] = message.reference.to_dict()
+    return payload
+
+
+class MessageCoverage:
+    """
+    The stretch of a channel's history the store holds completely: every message after first_id up to and
+    including last_id, apart from the gaps recorded separately.  epoch is the gateway session that last extended it.
+    """
+
+    def __init__(self, channel_id: int, first_id: int, last_id: int, epoch: int):
+        self.channel_id: int = channel_id
+        self.first_id: int = first_id
+        self.last_id: int = last_id
+        self.epoch: int = epoch
+
+
+class MessageStore:
+    """
+    A local SQLite copy of the messages the bot has seen, kept up to date from gateway events by the message mirror
+    and filled in from history by the exporter where it has gaps.
+
+    Writes are queued and applied in batches from a worker thread, so the gateway event handlers never wait on the
+    disk.  The database runs in WAL mode so exports can read while the mirror writes.
+
+    Gaps are tracked with gateway sessions.  Every time the bot connects with a new session (rather than resuming
+    one, which replays the missed events) the epoch goes up, and the first message a channel sees in a new epoch
+    records the stretch since its previous message as a gap.  Edits and deletes that happened while the bot wasn't
+    connected are only picked up if they fall inside a gap.
+    """
+
+    FLUSH_THRESHOLD: int = 500
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self.connection: sqlite3.Connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, id);
+            CREATE TABLE IF NOT EXISTS coverage (
+                channel_id INTEGER PRIMARY KEY,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                epoch INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS gaps (
+                channel_id INTEGER NOT NULL,
+                after_id INTEGER NOT NULL,
+                before_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+        self.epoch: int = int(row[0]) if row else 0
+        self.lock: threading.Lock = threading.Lock()
+        self.pending: list[tuple] = []
+
+    def start_session(self) -> None:
+        self.epoch += 1
+        self.pending.append(("epoch", self.epoch))
+
+    def add_message(self, message: discord.Message) -> None:
+        self.pending.append(("live", message.channel.id, message.id, json.dumps(message_to_payload(message))))
+
+    def update_message(self, message_id: int, data: dict) -> None:
+        self.pending.append(("update", message_id, json.dumps(data)))
+
+    def delete_messages(self, message_ids: list[int]) -> None:
+        self.pending.append(("delete", list(message_ids)))
+
+    def add_reaction(self, message_id: int, emoji: discord.PartialEmoji, delta: int) -> None:
+        self.pending.append(("reaction", message_id, emoji_to_payload(emoji), delta))
+
+    def clear_reactions(self, message_id: int, emoji: discord.PartialEmoji | None = None) -> None:
+        self.pending.append(("clear_reactions", message_id, emoji_to_payload(emoji) if emoji else None))
+
+    def start_coverage(self, channel_id: int, after_id: int) -> None:
+        """
+        Marks a channel as completely mirrored from after_id on, used for threads the mirror saw being created
+        """
+        self.pending.append(("coverage", channel_id, after_id))
+
+    def backfill(
+        self, channel_id: int, messages: list[discord.Message], after_id: int, before_id: int, open_ended: bool = False
+    ) -> None:
+        """
+        :param channel_id:
+        :param messages: every message of the channel between after_id and before_id
+        :param after_id: exclusive
+        :param before_id: exclusive, where the crawl actually stopped
+        :param open_ended: whether the crawl was of everything up to now, which extends the coverage to before_id
+        :return:
+        """
+        payloads: list[tuple] = [(m.id, json.dumps(message_to_payload(m))) for m in messages]
+        self.pending.append(("backfill", channel_id, payloads, after_id, before_id, open_ended))
+
+    def apply_live(self, channel_id: int, message_id: int, payload: str) -> None:
+        self.upsert(channel_id, message_id, payload)
+        row = self.connection.execute(
+            "SELECT last_id, epoch FROM coverage WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        if row is None:
+            # everything before the first message the mirror sees has to come from history
+            self.connection.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)", (channel_id, message_id - 1, message_id, self.epoch)
+            )
+        elif row[1] != self.epoch:
+            self.connection.execute("INSERT INTO gaps VALUES (?, ?, ?)", (channel_id, row[0], message_id))
+            self.connection.execute(
+                "UPDATE coverage SET last_id = ?, epoch = ? WHERE channel_id = ?", (message_id, self.epoch, channel_id)
+            )
+        elif message_id > row[0]:
+            self.connection.execute("UPDATE coverage SET last_id = ? WHERE channel_id = ?", (message_id, channel_id))
+
+    def apply_backfill(
+        self, channel_id: int, payloads: list[tuple], after_id: int, before_id: int, open_ended: bool
+    ) -> None:
+        # anything stored in the range but no longer in history was deleted while nobody was watching
+        self.connection.execute(
+            "UPDATE messages SET deleted = 1 WHERE channel_id = ? AND id > ? AND id < ?",
+            (channel_id, after_id, before_id),
+        )
+        for message_id, payload in payloads:
+            self.upsert(channel_id, message_id, payload)
+
+        row = self.connection.execute(
+            "SELECT first_id, last_id FROM coverage WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        last_id: int = max([after_id] + [message_id for message_id, _ in payloads])
+        if row is None:
+            self.connection.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)", (channel_id, after_id, last_id, self.epoch)
+            )
+            return
+        # the mirror may have stored messages sent while the crawl ran, they're past where it stopped and the
+        # coverage already reaches them
+        newer = self.connection.execute(
+            "SELECT 1 FROM messages WHERE channel_id = ? AND id >= ? LIMIT 1", (channel_id, before_id)
+        ).fetchone()
+        if open_ended and newer is None:
+            self.connection.execute(
+                "UPDATE coverage SET last_id = ?, epoch = ? WHERE channel_id = ?",
+                (max(last_id, row[1]), self.epoch, channel_id),
+            )
+        if after_id < row[0]:
+            if before_id - 1 < row[0]:
+                # the mirror started watching after the crawl stopped, what was sent in between is still missing
+                self.connection.execute("INSERT INTO gaps VALUES (?, ?, ?)", (channel_id, before_id - 1, row[0] + 1))
+            self.connection.execute("UPDATE coverage SET first_id = ? WHERE channel_id = ?", (after_id, channel_id))
+        self.connection.execute(
+            "DELETE FROM gaps WHERE channel_id = ? AND after_id >= ? AND before_id <= ?",
+            (channel_id, after_id, before_id),
+        )
+        # a gap the crawl only covered the start of, the mirror recorded it when a message came in during the crawl
+        self.connection.execute(
+            "UPDATE gaps SET after_id = ? WHERE channel_id = ? AND after_id >= ? AND after_id < ? AND before_id > ?",
+            (before_id - 1, channel_id, after_id, before_id - 1, before_id),
+        )
+
+    def apply_reaction(self, message_id: int, emoji: dict | None, delta: int | None) -> None:
+        row = self.connection.execute("SELECT payload FROM messages WHERE id = ?", (message_id,)).fetchone()
+        if row is None:
+            return
+        payload: dict = json.loads(row[0])
+        reactions: list[dict] = payload.get("reactions", [])
+        if delta is None:
+            # a clear, of every reaction or of one emoji
+            reactions = [r for r in reactions if emoji is not None and not same_emoji(r["emoji"], emoji)]
+        else:
+            reaction: dict | None = next((r for r in reactions if same_emoji(r["emoji"], emoji)), None)
+            if reaction is None:
+                reaction = {"emoji": emoji, "count": 0, "me": False}
+                reactions.append(reaction)
+            reaction["count"] += delta
+            reactions = [r for r in reactions if r["count"] > 0]
+        payload["reactions"] = reactions
+        self.connection.execute("UPDATE messages SET payload = ? WHERE id = ?", (json.dumps(payload), message_id))
+
+    def upsert(self, channel_id: int, message_id: int, payload: str) -> None:
+        self.connection.execute(
+            "INSERT INTO messages (id, channel_id, payload, deleted) VALUES (?, ?, ?, 0) "
+            "ON CONFLICT (id) DO UPDATE SET payload = excluded.payload, deleted = 0",
+            (message_id, channel_id, payload),
+        )
+
+    def apply(self, operation: tuple) -> None:
+        match operation:
+            case ("live", channel_id, message_id, payload):
+                self.apply_live(channel_id, message_id, payload)
+            case ("update", message_id, data):
+                row = self.connection.execute("SELECT payload FROM messages WHERE id = ?", (message_id,)).fetchone()
+                if row:
+                    payload: dict = json.loads(row[0]) | json.loads(data)
+                    self.connection.execute(
+                        "UPDATE messages SET payload = ? WHERE id = ?", (json.dumps(payload), message_id)
+                    )
+            case ("delete", message_ids):
+                self.connection.executemany(
+                    "UPDATE messages SET deleted = 1 WHERE id = ?", [(message_id,) for message_id in message_ids]
+                )
+            case ("reaction", message_id, emoji, delta):
+                self.apply_reaction(message_id, emoji, delta)
+            case ("clear_reactions", message_id, emoji):
+                self.apply_reaction(message_id, emoji, None)
+            case ("coverage", channel_id, after_id):
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO coverage VALUES (?, ?, ?, ?)", (channel_id, after_id, after_id, self.epoch)
+                )
+            case ("backfill", channel_id, payloads, after_id, before_id, open_ended):
+                self.apply_backfill(channel_id, payloads, after_id, before_id, open_ended)
+            case ("epoch", epoch):
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('epoch', ?)", (str(epoch),))
+
+    def flush_pending(self) -> None:
+        with self.lock:
+            operations: list[tuple] = self.pending
+            self.pending = []
+            if not operations:
+                return
+            self.connection.execute("BEGIN")
+            try:
+                for operation in operations:
+                    self.apply(operation)
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self.flush_pending)
+
+    def get_coverage(self, channel_id: int) -> MessageCoverage | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT first_id, last_id, epoch FROM coverage WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+        return MessageCoverage(channel_id, *row) if row else None
+
+    def get_gaps(self, channel_id: int) -> list[tuple[int, int]]:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT after_id, before_id FROM gaps WHERE channel_id = ? ORDER BY after_id", (channel_id,)
+            ).fetchall()
+
+    def load_payloads(self, channel_id: int, after_id: int = 0, before_id: int | None = None) -> list[dict]:
+        """
+        :param channel_id:
+        :param after_id: exclusive
+        :param before_id: exclusive, None for every message after after_id
+        :return: the payloads of the channel's messages, oldest first
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT payload FROM messages WHERE channel_id = ? AND deleted = 0 AND id > ? AND id < ? ORDER BY id",
+                (channel_id, after_id, before_id or 2**63 - 1),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_payload(self, message_id: int) -> dict | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT payload FROM messages WHERE id = ? AND deleted = 0", (message_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self) -> None:
+        self.flush_pending()
+        self.connection.close()
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+
+from .lazy_import import lazy_import
+
+
+boto3 = lazy_import("boto3")
+s3_transfer = lazy_import("boto3.s3.transfer")
+boto_exceptions = lazy_import("botocore.exceptions")
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ObjectStorageSink:
+    """
+    Uploads a finished output dir to an S3 compatible bucket (AWS S3, MinIO, ...) file by file, so the archive can
+    be browsed straight from the bucket and there is nothing to zip or split however big it gets.  Several files go
+    up at once, and the big ones as multipart uploads with their parts sent in parallel.
+
+    Every object is tagged with the sha256 of its content and the hashes of an archive are kept in a manifest next
+    to it, so exporting into the same archive again only uploads the files that changed.  A file with the same
+    content as another file of the archive is copied inside the bucket instead of being uploaded twice.  Needs boto3.
+    """
+
+    MANIFEST: str = ".manifest.json"
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        access_key_id: str | None = None,
+        secret_access_key: str | None = None,
+        public_url: str | None = None,
+        part_size: int = 16 * 1024 * 1024,
+        concurrency: int = 4,
+    ):
+        self.bucket: str = bucket
+        self.prefix: str = prefix.strip("/")
+        self.public_url: str | None = public_url.rstrip("/") if public_url else None
+        self.concurrency: int = concurrency
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+        )
+        self.transfer_config = s3_transfer.TransferConfig(
+            multipart_threshold=part_size, multipart_chunksize=part_size
+        )
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "ObjectStorageSink | None":
+        """
+        :param settings: the EXPORT.storage section of the config
+        :return: None unless the storage is enabled and boto3 is installed
+        """
+        if not settings.get("enabled", False):
+            return None
+        if boto3 is None:
+            logger.warning("boto3 is not installed, exports will be uploaded to discord as zips")
+            return None
+        return cls(
+            settings["bucket"],
+            prefix=settings.get("prefix", ""),
+            endpoint_url=settings.get("endpoint_url"),
+            region=settings.get("region"),
+            access_key_id=settings.get("access_key_id"),
+            secret_access_key=settings.get("secret_access_key"),
+            public_url=settings.get("public_url"),
+            part_size=settings.get("part_size_mb", 16) * 1024 * 1024,
+            concurrency=settings.get("upload_concurrency", 4),
+        )
+
+    def get_key(self, archive_name: str, path: str) -> str:
+        return "/".join(part for part in (self.prefix, archive_name, path) if part)
+
+    def get_url(self, archive_name: str) -> str:
+        """
+        :param archive_name:
+        :return: link to the index page of the archive
+        """
+        key: str = self.get_key(archive_name, "index.html")
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return f"{self.client.meta.endpoint_url}/{self.bucket}/{key}"
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_manifest(self, archive_name: str) -> dict[str, str]:
+        """
+        :param archive_name:
+        :return: sha256 of every file uploaded by the last export of the archive, by path
+        """
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.get_key(archive_name, self.MANIFEST))
+        except boto_exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return {}
+            raise
+        return json.loads(response["Body"].read())
+
+    def save_manifest(self, archive_name: str, manifest: dict[str, str]) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.get_key(archive_name, self.MANIFEST),
+            Body=json.dumps(manifest).encode(),
+            ContentType="application/json",
+        )
+
+    def upload_file(self, path: str, key: str, digest: str) -> None:
+        content_type: str = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        self.client.upload_file(
+            path,
+            self.bucket,
+            key,
+            ExtraArgs={"ContentType": content_type, "Metadata": {"sha256": digest}},
+            Config=self.transfer_config,
+        )
+
+    def copy_object(self, source_key: str, key: str) -> None:
+        # the content type and the hash are copied along with the content
+        self.client.copy({"Bucket": self.bucket, "Key": source_key}, self.bucket, key, Config=self.transfer_config)
+
+    async def upload(self, output_dir: str, archive_name: str, files: list[str]) -> list[str]:
+        """
+        :param output_dir:
+        :param archive_name: the archive is uploaded under this name below the prefix
+        :param files: paths relative to the output dir
+        :return: the files that could not be uploaded
+        """
+        started_at: float = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        previous: dict[str, str] = await asyncio.to_thread(self.load_manifest, archive_name)
+
+        async def hash_file(file: str) -> str:
+            async with semaphore:
+                return await asyncio.to_thread(self.hash_file, f"{output_dir}/{file}")
+
+        hashes: list[str] = await asyncio.gather(*(hash_file(file) for file in files))
+        current: dict[str, str] = dict(zip(files, hashes))
+
+        # content that is already in the bucket, in unchanged files of the last export or earlier in the list
+        stored: dict[str, str] = {digest: path for path, digest in previous.items() if current.get(path) == digest}
+        uploads: list[tuple[str, str]] = []
+        copies: list[tuple[str, str, str]] = []
+        for file, digest in current.items():
+            if previous.get(file) == digest:
+                continue
+            if digest in stored:
+                copies.append((file, digest, stored[digest]))
+            else:
+                uploads.append((file, digest))
+                stored[digest] = file
+
+        manifest: dict[str, str] = {}
+        failed: list[str] = []
+
+        async def transfer(file: str, digest: str, source: str | None) -> None:
+            async with semaphore:
+                try:
+                    key: str = self.get_key(archive_name, file)
+                    if source is None:
+                        await asyncio.to_thread(self.upload_file, f"{output_dir}/{file}", key, digest)
+                    else:
+                        await asyncio.to_thread(self.copy_object, self.get_key(archive_name, source), key)
+                    manifest[file] = digest
+                except (boto_exceptions.BotoCoreError, boto_exceptions.ClientError, OSError) as ex:
+                    logger.warning(f"unable to upload {file}: {ex}")
+                    failed.append(file)
+
+        await asyncio.gather(*(transfer(file, digest, None) for file, digest in uploads))
+        # copies go after the uploads, their source may have been one of them
+        await asyncio.gather(
+            *(transfer(file, digest, source) for file, digest, source in copies if source not in failed)
+        )
+        failed.extend(file for file, digest, source in copies if source in failed)
+
+        # unchanged files keep their entries, failed ones are left out so the next export tries them again
+        for file, digest in current.items():
+            if previous.get(file) == digest:
+                manifest[file] = digest
+        await asyncio.to_thread(self.save_manifest, archive_name, manifest)
+
+        uploaded_bytes: int = sum(os.path.getsize(f"{output_dir}/{file}") for file, digest in uploads)
+        logger.info(
+            f"uploaded {len(uploads)} files ({uploaded_bytes / 1024 / 1024:.1f} MB) to {self.bucket} in "
+            f"{time.perf_counter() - started_at:.1f}s, copied {len(copies)}, {len(files) - len(uploads) - len(copies)} "
+            f"unchanged, {len(failed)} failed"
+        )
+        return failed
@@ -0,0 +1,144 @@
+import logging
+import os
+from zipfile import ZIP_BZIP2, ZipFile
+
+import discord
+
+from .io_executor import IOExecutor
+from .object_storage import ObjectStorageSink
+from .uploader import UploadManager, UploadPart
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ExportPackager:
+    """
+    Turns a finished output dir into an archive: zips everything into parts that fit the upload limit and uploads
+    them to the output channel.  The static assets the pages need are put in place by the export context.
+
+    With object storage configured the output dir is uploaded to the bucket as is instead, and the output channel
+    gets a link to the index page.
+    """
+
+    def __init__(
+        self,
+        bot: discord.Client,
+        output_dir: str,
+        output_channel_id: int,
+        archive_name: str,
+        archive_title: str,
+        max_upload_size: int,
+        io: IOExecutor | None = None,
+        storage: ObjectStorageSink | None = None,
+    ):
+        self.bot: discord.Client = bot
+        self.output_dir: str = output_dir
+        self.output_channel_id: int = output_channel_id
+        self.archive_name: str = archive_name
+        self.archive_title: str = archive_title
+        self.max_upload_size: int = max_upload_size
+        self.io: IOExecutor = io or IOExecutor()
+        self.storage: ObjectStorageSink | None = storage
+
+    def get_archive_files(self) -> list[str]:
+        """
+        Everything in the output dir that belongs in the archive, with the html documents first so the
+        first zip always holds the pages
+        :return: paths relative to the output dir
+        """
+        documents: list[str] = []
+        others: list[str] = []
+        for root, dirs, files in os.walk(self.output_dir):
+            dirs.sort()
+            for file in sorted(files):
+                relative_path: str = os.path.relpath(os.path.join(root, file), self.output_dir).replace(os.sep, "/")
+                if file.split(".")[-1] == "zip":
+                    continue
+                if "/" not in relative_path and file.split(".")[-1] == "html":
+                    documents.append(relative_path)
+                else:
+                    others.append(relative_path)
+        return documents + others
+
+    def remove_old_zips(self) -> None:
+        for file in os.listdir(self.output_dir):
+            if file.startswith(f"{self.archive_name}_") and file.split(".")[-1] == "zip":
+                os.remove(f"{self.output_dir}/{file}")
+
+    def zip_contents(self) -> None:
+        self.remove_old_zips()
+        split_count: int = 0
+        zip_size: int = 0
+        zipfile = ZipFile(f"{self.output_dir}/{self.archive_name}_{split_count:02}.zip", "w", compresslevel=ZIP_BZIP2)
+        for file in self.get_archive_files():
+            file_size: int = os.path.getsize(f"{self.output_dir}/{file}")
+            if zip_size > 0 and zip_size + file_size > self.max_upload_size:  # assume it won't compress
+                zipfile.close()
+                split_count += 1
+                zip_size = 0
+                zipfile = ZipFile(
+                    f"{self.output_dir}/{self.archive_name}_{split_count:02}.zip", "w", compresslevel=ZIP_BZIP2
+                )
+            zipfile.write(f"{self.output_dir}/{file}", file)
+            zip_size += file_size
+        zipfile.close()
+
+    def get_upload_parts(self) -> list[UploadPart]:
+        sorted_files = [f for f in os.listdir(f"{self.output_dir}") if f.split(".")[-1] == "zip"]
+        sorted_files.sort()
+        return [
+            UploadPart(
+                self.output_dir + "/" + file,
+                f"{self.archive_title} backup {idx+1} of {len(sorted_files)}.zip",
+            )
+            for idx, file in enumerate(sorted_files)
+        ]
+
+    async def send_zips_to_output_channel(self) -> None:
+        if self.output_channel_id == -1:
+            return
+
+        channel: discord.TextChannel = self.bot.get_channel(self.output_channel_id)
+        if channel:
+            await channel.send(f"A backup of {self.archive_title} has been created.")
+            try:
+                parts: list[UploadPart] = await self.io.run(self.get_upload_parts)
+                upload_manager = UploadManager(channel, self.max_upload_size)
+                failed_parts: list[UploadPart] = await upload_manager.upload(parts)
+                if failed_parts:
+                    await channel.send(
+                        f"{len(failed_parts)} of {len(parts)} backup files could not be uploaded: "
+                        f"{', '.join(part.filename for part in failed_parts)}"
+                    )
+            except Exception as ex:
+                logging.error(f"error uploading to discord: {ex}")
+                await channel.send("An error was encountered uploading files to discord")
+
+    async def send_to_storage(self) -> None:
+        files: list[str] = await self.io.run(self.get_archive_files)
+        try:
+            failed_files: list[str] = await self.storage.upload(self.output_dir, self.archive_name, files)
+        except Exception as ex:
+            logger.error(f"error uploading to object storage: {ex}")
+            failed_files = files
+        if self.output_channel_id == -1:
+            return
+
+        channel: discord.TextChannel = self.bot.get_channel(self.output_channel_id)
+        if channel:
+            if len(failed_files) == len(files):
+                await channel.send(f"The backup of {self.archive_title} could not be uploaded to object storage")
+                return
+            url: str = self.storage.get_url(self.archive_name)
+            message: str = f"A backup of {self.archive_title} has been created: {url}"
+            if failed_files:
+                message += f"\n{len(failed_files)} of {len(files)} files could not be uploaded, export again to retry"
+            await channel.send(message)
+
+    async def package(self) -> None:
+        if self.storage:
+            await self.send_to_storage()
+            return
+        await self.io.run(self.zip_contents)
+        await self.send_zips_to_output_channel()
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+
+import discord
+
+from .export_filter import ExportFilter
+from .thread_catalog import ThreadCatalog, ThreadRecord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+# rough costs of an export, measured on a few real channels, good for telling minutes from hours and no more
+HTML_BYTES_PER_MESSAGE: int = 800
+COMPACT_HTML_BYTES_PER_MESSAGE: int = 350
+HTML_ZIP_RATIO: float = 0.2  # html compresses well, attachments are mostly compressed already
+SECONDS_PER_HISTORY_PAGE: float = 0.3  # a page is 100 messages
+RENDERED_MESSAGES_PER_SECOND: float = 1500.0
+DOWNLOAD_BYTES_PER_SECOND: float = 20 * 1024 * 1024
+# an export that takes more zips than this is worth a warning, they flood the output channel
+MAX_UPLOAD_PARTS: int = 10
+
+
+def snowflake_time(snowflake: int) -> int:
+    """
+    :return: milliseconds since the discord epoch
+    """
+    return snowflake >> 22
+
+
+class ExportEstimate:
+    """
+    What an export is expected to fetch and write, from a small sample of the channel
+    """
+
+    def __init__(
+        self,
+        messages: int = 0,
+        threads: int = 0,
+        thread_messages: int = 0,
+        attachment_bytes: int = 0,
+        compact_html: bool = False,
+        crawl_concurrency: int = 1,
+    ):
+        self.messages: int = messages
+        self.threads: int = threads
+        self.thread_messages: int = thread_messages
+        self.attachment_bytes: int = attachment_bytes
+        self.compact_html: bool = compact_html
+        self.crawl_concurrency: int = crawl_concurrency
+
+    @property
+    def total_messages(self) -> int:
+        return self.messages + self.thread_messages
+
+    @property
+    def html_bytes(self) -> int:
+        per_message: int = COMPACT_HTML_BYTES_PER_MESSAGE if self.compact_html else HTML_BYTES_PER_MESSAGE
+        return self.total_messages * per_message
+
+    @property
+    def output_bytes(self) -> int:
+        return self.html_bytes + self.attachment_bytes
+
+    @property
+    def archive_bytes(self) -> int:
+        return int(self.html_bytes * HTML_ZIP_RATIO) + self.attachment_bytes
+
+    @property
+    def seconds(self) -> float:
+        # every thread is at least one page of history, however few messages it has
+        pages: int = math.ceil(self.messages / 100) + self.threads + math.ceil(self.thread_messages / 100)
+        return (
+            pages * SECONDS_PER_HISTORY_PAGE / max(self.crawl_concurrency, 1)
+            + self.total_messages / RENDERED_MESSAGES_PER_SECOND
+            + self.attachment_bytes / DOWNLOAD_BYTES_PER_SECOND
+        )
+
+    def add(self, other: "ExportEstimate") -> None:
+        self.messages += other.messages
+        self.threads += other.threads
+        self.thread_messages += other.thread_messages
+        self.attachment_bytes += other.attachment_bytes
+
+    def summary(self) -> str:
+        return (
+            f"about {self.messages:,} messages and {self.thread_messages:,} more in {self.threads:,} threads, "
+            f"{format_bytes(self.attachment_bytes)} of attachments, {format_bytes(self.output_bytes)} written, "
+            f"{format_bytes(self.archive_bytes)} packaged, roughly {format_duration(self.seconds)}"
+        )
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 60 * 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+
+class PreflightSampler:
+    """
+    Estimates the size of an export without fetching its history.  A snowflake starts with its creation time, so
+    the channel id and its last message id give how long the channel has been in use, and a few pages of history
+    sampled at points spread over that time give how many messages it sees per hour and how big their attachments
+    are.  Threads know their own message count, the threads seen by earlier exports are in the thread catalog,
+    and the newest archived threads are listed on top of that.  A filtered export only samples the range of its
+    filter and counts the threads it includes, the rest of the filter isn't taken into account.
+
+    Each channel costs samples + 1 requests.
+    """
+
+    def __init__(
+        self,
+        samples: int = 4,
+        sample_size: int = 50,
+        cache_dir: str | None = None,
+        export_filter: ExportFilter | None = None,
+    ):
+        self.samples: int = samples
+        self.sample_size: int = sample_size
+        self.cache_dir: str | None = cache_dir
+        self.export_filter: ExportFilter = export_filter or ExportFilter()
+
+    async def sample_history(self, channel: discord.abc.Messageable, after: int, end: int) -> tuple[float, int, int]:
+        """
+        :param channel:
+        :param after: the snowflake to sample after
+        :param end: the snowflake the sampled range ends at, exclusive
+        :return: the messages per millisecond after the snowflake, the sampled messages and their attachment bytes
+        """
+        messages: list[discord.Message] = [
+            message
+            async for message in channel.history(
+                limit=self.sample_size, after=discord.Object(after), before=discord.Object(end), oldest_first=True
+            )
+        ]
+        attachment_bytes: int = sum(attachment.size for message in messages for attachment in message.attachments)
+        if len(messages) == self.sample_size:
+            span: int = snowflake_time(messages[-1].id) - snowflake_time(after)
+        else:
+            span = snowflake_time(end) - snowflake_time(after)  # the sample reached the end of the history
+        return len(messages) / max(span, 1), len(messages), attachment_bytes
+
+    async def estimate_messages(self, channel: discord.abc.Messageable, estimate: ExportEstimate) -> None:
+        last_message_id: int | None = channel.last_message_id
+        if not last_message_id or last_message_id <= channel.id:
+            return
+        history_range: tuple[int, int | None] | None = self.export_filter.clamp(channel.id - 1, last_message_id + 1)
+        if history_range is None:
+            return
+        after, before = history_range
+        lifetime: int = snowflake_time(before) - snowflake_time(after)
+        step: int = (before - after) // self.samples
+        samples: list[tuple[float, int, int]] = await asyncio.gather(
+            *(self.sample_history(channel, after + step * idx, before) for idx in range(self.samples))
+        )
+        density: float = sum(sample[0] for sample in samples) / len(samples)
+        sampled_messages: int = sum(sample[1] for sample in samples)
+        sampled_bytes: int = sum(sample[2] for sample in samples)
+        estimate.messages = round(density * lifetime)
+        if sampled_messages:
+            estimate.attachment_bytes = round(sampled_bytes / sampled_messages * estimate.messages)
+
+    async def estimate_threads(self, channel: discord.TextChannel | discord.ForumChannel) -> dict[int, int]:
+        """
+        :return: the message count of each known thread
+        """
+        catalog = ThreadCatalog(channel.id, self.cache_dir)
+        await asyncio.to_thread(catalog.load)
+        threads: list[discord.Thread | ThreadRecord] = list(catalog.records.values())
+        try:
+            threads.extend([thread async for thread in channel.archived_threads(limit=100)])
+        except discord.Forbidden:
+            pass
+        threads.extend(channel.threads)
+        return {
+            thread.id: thread.message_count or 0
+            for thread in threads
+            if self.export_filter.includes_thread(thread.id, thread.last_message_id)
+        }
+
+    async def estimate_channel(self, channel: discord.abc.GuildChannel | discord.Thread) -> ExportEstimate:
+        """
+        :param channel:
+        :return: the estimate, as far as the sample got if sampling failed, an estimate never holds up an export
+        """
+        estimate = ExportEstimate()
+        try:
+            if not isinstance(channel, discord.ForumChannel):
+                await self.estimate_messages(channel, estimate)
+            if isinstance(channel, (discord.TextChannel, discord.ForumChannel)):
+                message_counts: dict[int, int] = await self.estimate_threads(channel)
+                estimate.threads = len(message_counts)
+                estimate.thread_messages = sum(message_counts.values())
+                if estimate.messages:
+                    # thread attachments are assumed to be like the channel's
+                    estimate.attachment_bytes += (
+                        estimate.attachment_bytes * estimate.thread_messages // estimate.messages
+                    )
+        except discord.HTTPException as ex:
+            logger.warning(f"could not sample {channel.name}: {ex}")
+        return estimate
+
+    async def estimate_guild(
+        self, channels: list[discord.TextChannel | discord.ForumChannel], concurrency: int = 3
+    ) -> ExportEstimate:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def estimate_one(channel: discord.TextChannel | discord.ForumChannel) -> ExportEstimate:
+            async with semaphore:
+                return await self.estimate_channel(channel)
+
+        estimate = ExportEstimate()
+        for channel_estimate in await asyncio.gather(*(estimate_one(channel) for channel in channels)):
+            estimate.add(channel_estimate)
+        return estimate
+
+
+def create_sampler(
+    settings: dict, guild_export: bool = False, export_filter: ExportFilter | None = None
+) -> PreflightSampler:
+    """
+    :param settings: the EXPORT section of the config
+    :param guild_export: a guild export samples each of its channels once rather than a few times
+    :param export_filter:
+    :return:
+    """
+    return PreflightSampler(
+        1 if guild_export else 4, cache_dir=settings.get("cache_dir", "output/cache"), export_filter=export_filter
+    )
+
+
+def apply_settings(estimate: ExportEstimate, settings: dict) -> ExportEstimate:
+    estimate.compact_html = settings.get("compact_html", False)
+    estimate.crawl_concurrency = settings.get("crawl_concurrency", 1)
+    return estimate
+
+
+def check_limits(estimate: ExportEstimate, output_dir: str, max_upload_size: int, uploads: bool = True) -> list[str]:
+    """
+    :param estimate:
+    :param output_dir: where the export is written
+    :param max_upload_size: the size limit of an upload to the output channel
+    :param uploads: whether the archive is uploaded to discord, rather than to object storage
+    :return: a warning for each limit the export is likely to run into
+    """
+    warnings: list[str] = []
+    # the export dir and its zips are on disk at the same time
+    needed: int = estimate.output_bytes + estimate.archive_bytes
+    existing_dir: str = output_dir
+    while not os.path.isdir(existing_dir) and os.path.dirname(existing_dir) != existing_dir:
+        existing_dir = os.path.dirname(existing_dir) or "."
+    free: int = shutil.disk_usage(existing_dir).free
+    if needed > free:
+        warnings.append(f"needs about {format_bytes(needed)} of disk space, only {format_bytes(free)} is free")
+    if uploads and max_upload_size > 0:
+        parts: int = math.ceil(estimate.archive_bytes / max_upload_size)
+        if parts > MAX_UPLOAD_PARTS:
+            warnings.append(
+                f"will be uploaded as about {parts} zips of at most {format_bytes(max_upload_size)}, "
+                f"consider object storage"
+            )
+    return warnings
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+from .preflight import ExportEstimate, format_duration
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ExportProgress:
+    """
+    Keeps one status message up to date while an export runs: what it's working on, how fast it's going and when
+    it should be done.  The exporters count the messages they fetch and render, and the estimate from the
+    pre-flight sample gives the total they're counted against.  Every message is fetched once and rendered once,
+    so the export is about done when both counts reach the total.  Once the export is a few percent in, the ETA
+    comes from the rate it's actually going at, until then from the estimate.
+
+    Without a status channel, or if the status message can't be posted, the status is logged instead.
+    """
+
+    def __init__(self, title: str, estimate: ExportEstimate | None = None, interval: float = 15.0):
+        self.title: str = title
+        self.estimate: ExportEstimate | None = estimate
+        self.interval: float = interval
+        self.stage: str = "starting"
+        self.fetched: int = 0
+        self.rendered: int = 0
+        self.started_at: float = time.monotonic()
+        self.status_message: discord.Message | None = None
+        self.task: asyncio.Task | None = None
+        self.finished: bool = False
+
+    def set_stage(self, stage: str) -> None:
+        self.stage = stage
+
+    def add_fetched(self, count: int = 1) -> None:
+        self.fetched += count
+
+    def add_rendered(self, count: int = 1) -> None:
+        self.rendered += count
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def fraction_done(self) -> float | None:
+        if self.estimate is None or self.estimate.total_messages == 0:
+            return None
+        total: int = max(self.estimate.total_messages, self.fetched)
+        return min((self.fetched + self.rendered) / (2 * total), 0.99)
+
+    @property
+    def eta(self) -> float | None:
+        """
+        :return: seconds until the export should be done, None if there's nothing to go on
+        """
+        fraction: float | None = self.fraction_done
+        if fraction is None:
+            return None
+        if fraction < 0.05:
+            return max(self.estimate.seconds - self.elapsed, 0)
+        return self.elapsed * (1 - fraction) / fraction
+
+    def status(self) -> str:
+        fetch_rate: float = self.fetched / max(self.elapsed, 1)
+        lines: list[str] = [
+            f"**{self.title}**: {self.stage}",
+            f"{self.fetched:,} messages fetched at {fetch_rate:.0f}/s, {self.rendered:,} rendered",
+        ]
+        fraction: float | None = self.fraction_done
+        eta: float | None = self.eta
+        if self.finished:
+            lines.append(f"finished in {format_duration(self.elapsed)}")
+        elif fraction is not None and eta is not None:
+            lines.append(
+                f"{fraction * 100:.0f}% done after {format_duration(self.elapsed)}, about {format_duration(eta)} to go"
+            )
+        else:
+            lines.append(f"running for {format_duration(self.elapsed)}")
+        return "\n".join(lines)
+
+    async def post(self, text: str) -> None:
+        try:
+            if self.status_message:
+                await self.status_message.edit(content=text)
+            else:
+                logger.info(text.replace("\n", ", ").replace("**", ""))
+        except discord.HTTPException as ex:
+            logger.warning(f"could not update the export status: {ex}")
+
+    async def update_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.post(self.status())
+
+    async def start(self, channel: discord.abc.Messageable | None = None) -> None:
+        """
+        :param channel: where to post the status message, None to log the status
+        :return:
+        """
+        self.started_at = time.monotonic()
+        if channel:
+            try:
+                self.status_message = await channel.send(self.status())
+            except discord.HTTPException as ex:
+                logger.warning(f"could not post the export status: {ex}")
+        self.task = asyncio.create_task(self.update_periodically())
+
+    async def stop(self, outcome: str) -> None:
+        """
+        :param outcome: the last stage shown, such as done or failed
+        :return:
+        """
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.stage = outcome
+        self.finished = True
+        await self.post(self.status())
@@ -0,0 +1,107 @@
+import itertools
+from collections import OrderedDict
+
+from .markdown_tokenizer import MarkdownTokenType, Token
+
+
+# tokens whose HTML depends on the export: names looked up by its resolver, links to its other documents, and
+# emoji downloaded into its output dir.  Masked links are in there because their text can hold any of these.
+EXPORT_TOKEN_TYPES: frozenset[MarkdownTokenType] = frozenset(
+    {
+        MarkdownTokenType.AT_USER,
+        MarkdownTokenType.AT_ROLE,
+        MarkdownTokenType.CHANNEL_LINK,
+        MarkdownTokenType.EMOJI,
+        MarkdownTokenType.MASKED_LINK,
+    }
+)
+
+scopes = itertools.count(1)
+
+
+def new_scope() -> int:
+    """
+    :return: an id for an export, the entries that depend on the export are only reused within it
+    """
+    return next(scopes)
+
+
+class RenderMemoEntry:
+    def __init__(self, tokens: list[Token], html: str, scope: int | None):
+        self.tokens: list[Token] = tokens
+        self.html: str = html
+        # the export the html belongs to, None if the html is the same in every export
+        self.scope: int | None = scope
+
+    def is_valid_in(self, scope: int) -> bool:
+        return self.scope is None or self.scope == scope
+
+
+class RenderMemo:
+    """
+    Remembers the tokens and the HTML of recently rendered message content, so content that keeps coming back (join
+    notices, bot command output, pasted templates) is only tokenized and rendered once.  The least recently used
+    content is forgotten once the memo holds max_entries.
+
+    Plain markdown renders the same everywhere and is reused across exports when the memo is shared between them.
+    Content with mentions, channel links or emoji is only reused within the export that rendered it, another export
+    reuses just its tokens: it may resolve the names differently, and it needs the emoji in its own output dir.
+    """
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict[str, RenderMemoEntry] = OrderedDict()
+        self.hits: int = 0
+        self.token_hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, content: str, scope: int) -> RenderMemoEntry | None:
+        """
+        :param content:
+        :param scope: the export rendering the content
+        :return: the entry of the content, check is_valid_in() before using its html
+        """
+        entry: RenderMemoEntry | None = self.entries.get(content)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(content)
+        if entry.is_valid_in(scope):
+            self.hits += 1
+        else:
+            self.token_hits += 1
+        return entry
+
+    def put(self, content: str, scope: int, tokens: list[Token], html: str) -> None:
+        depends_on_export: bool = any(token.token_type in EXPORT_TOKEN_TYPES for token in tokens)
+        self.entries[content] = RenderMemoEntry(tokens, html, scope if depends_on_export else None)
+        self.entries.move_to_end(content)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self) -> float:
+        lookups: int = self.hits + self.token_hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"render memo {self.hit_rate * 100:.1f}% hit rate, {self.hits} hits, {self.token_hits} token only hits, "
+            f"{self.misses} misses, {len(self.entries)} entries, {self.evictions} evicted"
+        )
+
+
+shared_memo: RenderMemo | None = None
+
+
+def get_shared_memo(max_entries: int) -> RenderMemo:
+    """
+    :param max_entries:
+    :return: the memo shared by every export of the process
+    """
+    global shared_memo
+    if shared_memo is None:
+        shared_memo = RenderMemo(max_entries)
+    return shared_memo
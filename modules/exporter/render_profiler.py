@@ -0,0 +1,141 @@
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from .markdown_tokenizer import MarkdownTokenType
+
+
+class RenderProfiler:
+    """
+    Profiles the rendering of messages.  The time spent turning each type of markdown token into HTML is added up
+    by the channel exporter, the token timings include whatever the token waited on such as user lookups, and
+    nested tokens (the text of a masked link) are counted in their parent as well.
+
+    The stack of the event loop is sampled every few milliseconds of CPU time, which is cheap enough to run on the
+    live bot and gives the functions taking the time and a stack file in the folded format flamegraph.pl and
+    speedscope read.  Samples are taken by a SIGPROF handler when the loop runs on the main thread, a sampling
+    thread would only get the GIL when the loop lets go of it and so only ever see it doing IO.  cProfile mode adds
+    exact per function timings, at a much higher overhead for everything running on the event loop while it's on.
+    """
+
+    def __init__(self, mode: str = "sample", interval: float = 0.005):
+        self.mode: str = mode
+        self.interval: float = interval
+        self.token_counts: Counter[MarkdownTokenType] = Counter()
+        self.token_seconds: Counter[MarkdownTokenType] = Counter()
+        self.tokenize_seconds: float = 0.0
+        self.stacks: Counter[str] = Counter()
+        self.samples: int = 0
+        self.messages: int = 0
+        self.wall_seconds: float = 0.0
+        self.started_at: float = 0.0
+        self.thread_id: int | None = None
+        self.stopped: threading.Event = threading.Event()
+        self.sampler: threading.Thread | None = None
+        self.previous_handler = None
+        self.profile: cProfile.Profile | None = None
+
+    def add_token(self, token_type: MarkdownTokenType, seconds: float) -> None:
+        self.token_counts[token_type] += 1
+        self.token_seconds[token_type] += seconds
+
+    def add_tokenize(self, seconds: float) -> None:
+        self.tokenize_seconds += seconds
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})"
+
+    def add_sample(self, frame) -> None:
+        stack: list[str] = []
+        while frame is not None:
+            stack.append(self.frame_name(frame))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def on_signal(self, signum, frame) -> None:
+        self.add_sample(frame)
+
+    def sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.add_sample(sys._current_frames().get(self.thread_id))
+
+    def start(self) -> None:
+        """
+        Starts profiling the calling thread, which should be the one running the event loop
+        """
+        self.thread_id = threading.get_ident()
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "setitimer"):
+            self.previous_handler = signal.signal(signal.SIGPROF, self.on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.stopped.clear()
+            self.sampler = threading.Thread(target=self.sample, name="render-profiler", daemon=True)
+            self.sampler.start()
+        if self.mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.started_at = time.perf_counter()
+
+    def stop(self, messages: int) -> None:
+        self.wall_seconds = time.perf_counter() - self.started_at
+        self.messages = messages
+        if self.profile:
+            self.profile.disable()
+        if self.sampler:
+            self.stopped.set()
+            self.sampler.join()
+        else:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def token_report(self) -> str:
+        lines: list[str] = [f"{'token type':<20} {'count':>8} {'total ms':>10} {'avg us':>8}"]
+        for token_type, seconds in self.token_seconds.most_common():
+            count: int = self.token_counts[token_type]
+            lines.append(f"{token_type.value:<20} {count:>8} {seconds * 1000:>10.1f} {seconds / count * 1e6:>8.1f}")
+        lines.append(f"{'(tokenizing)':<20} {'':>8} {self.tokenize_seconds * 1000:>10.1f}")
+        return "\n".join(lines)
+
+    def function_report(self, limit: int = 25) -> str:
+        if self.profile:
+            output = io.StringIO()
+            stats = pstats.Stats(self.profile, stream=output)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+            return output.getvalue()
+
+        own: Counter[str] = Counter()
+        total: Counter[str] = Counter()
+        for stack, count in self.stacks.items():
+            frames: list[str] = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples: int = max(self.samples, 1)
+        lines: list[str] = [f"{'self %':>7} {'total %':>7}  function"]
+        for frame, count in total.most_common(limit):
+            lines.append(f"{own[frame] * 100 / samples:>7.1f} {count * 100 / samples:>7.1f}  {frame}")
+        return "\n".join(lines)
+
+    def summary(self) -> str:
+        per_message: float = self.wall_seconds / max(self.messages, 1) * 1000
+        return (
+            f"rendered {self.messages} messages in {self.wall_seconds:.2f}s ({per_message:.2f}ms per message), "
+            f"{self.samples} samples"
+        )
+
+    def report(self) -> str:
+        return "\n\n".join([self.summary(), self.token_report(), self.function_report()])
+
+    def folded_stacks(self) -> str:
+        """
+        :return: one line per distinct stack, frames separated by semicolons and followed by the sample count
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
@@ -0,0 +1,218 @@
+import datetime
+import json
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+
+import discord
+
+from .lazy_import import lazy_import
+
+
+pyarrow = lazy_import("pyarrow")
+pyarrow_parquet = lazy_import("pyarrow.parquet")
+
+
+if TYPE_CHECKING:
+    from .channel_exporter import ChannelExporter
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def message_to_record(message: discord.Message) -> dict:
+    """
+    The data of a message as a flat record, for the machine readable outputs
+    :param message:
+    :return:
+    """
+    return {
+        "id": message.id,
+        "channel_id": message.channel.id,
+        "author_id": message.author.id,
+        "author_name": message.author.display_name,
+        "created_at": message.created_at,
+        "edited_at": message.edited_at,
+        "type": message.type.name,
+        "content": message.content,
+        "reply_to": message.reference.message_id if message.reference else None,
+        "attachments": [
+            {
+                "id": attachment.id,
+                "filename": attachment.filename,
+                "size": attachment.size,
+                "content_type": attachment.content_type,
+                "url": attachment.url,
+            }
+            for attachment in message.attachments
+        ],
+        "reactions": [{"emoji": str(reaction.emoji), "count": reaction.count} for reaction in message.reactions],
+    }
+
+
+class Renderer:
+    """
+    Writes the messages of the documents of an export in some format.  Every document of the export, the channel
+    and each of its threads, is passed to render() once its messages are loaded, so one fetch feeds every renderer.
+    """
+
+    name: str = ""
+    # whether the output of a document can be kept from an earlier export, so unchanged threads can be skipped
+    incremental: bool = False
+
+    def prepare(self, output_dir: str) -> None:
+        """
+        Called once before the first document is rendered
+        """
+
+    async def render(self, exporter: "ChannelExporter") -> None:
+        raise NotImplementedError
+
+    def finish(self) -> None:
+        """
+        Called once every document has been rendered
+        """
+
+
+class HtmlRenderer(Renderer):
+    name: str = "html"
+    incremental: bool = True
+
+    async def render(self, exporter: "ChannelExporter") -> None:
+        await exporter.write_document()
+
+
+class RecordRenderer(Renderer):
+    """
+    Base of the renderers that write one record per message for the whole export into a single file under data/,
+    the records are written in batches.  The channels of a guild export share the renderer and write their batches
+    from the io threads, so preparing the file and writing to it are done under a lock.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size: int = batch_size
+        self.records: list[dict] = []
+        self.path: str | None = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def get_path(self, output_dir: str) -> str:
+        raise NotImplementedError
+
+    def write_batch(self, records: list[dict]) -> None:
+        raise NotImplementedError
+
+    def write_records(self, records: list[dict]) -> None:
+        with self.lock:
+            self.write_batch(records)
+
+    def flush(self) -> None:
+        if self.records:
+            self.write_records(self.records)
+            self.records = []
+
+    def prepare(self, output_dir: str) -> None:
+        with self.lock:
+            if self.path is not None:
+                return
+            self.path = self.get_path(output_dir)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.isfile(self.path):
+                os.remove(self.path)  # left over from an earlier export
+
+    async def render(self, exporter: "ChannelExporter") -> None:
+        if self.path is None:
+            await exporter.context.io.run(self.prepare, exporter.output_dir)
+        for message in exporter.messages:
+            self.records.append(message_to_record(message))
+            if len(self.records) >= self.batch_size:
+                records, self.records = self.records, []
+                await exporter.context.io.run(self.write_records, records)
+
+    def finish(self) -> None:
+        self.flush()
+
+
+class NdjsonRenderer(RecordRenderer):
+    name: str = "ndjson"
+
+    def get_path(self, output_dir: str) -> str:
+        return f"{output_dir}/data/messages.ndjson"
+
+    def write_batch(self, records: list[dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, default=datetime.datetime.isoformat, ensure_ascii=False) + "\n")
+
+
+class ParquetRenderer(RecordRenderer):
+    """
+    Writes the messages as a parquet file, one row group per batch.  Needs pyarrow.
+    """
+
+    name: str = "parquet"
+
+    def __init__(self, batch_size: int = 10000):
+        super().__init__(batch_size)
+        self.writer = None
+
+    @staticmethod
+    def get_schema():
+        timestamp = pyarrow.timestamp("ms", tz="UTC")
+        attachment = pyarrow.struct(
+            [
+                ("id", pyarrow.int64()),
+                ("filename", pyarrow.string()),
+                ("size", pyarrow.int64()),
+                ("content_type", pyarrow.string()),
+                ("url", pyarrow.string()),
+            ]
+        )
+        reaction = pyarrow.struct([("emoji", pyarrow.string()), ("count", pyarrow.int64())])
+        return pyarrow.schema(
+            [
+                ("id", pyarrow.int64()),
+                ("channel_id", pyarrow.int64()),
+                ("author_id", pyarrow.int64()),
+                ("author_name", pyarrow.string()),
+                ("created_at", timestamp),
+                ("edited_at", timestamp),
+                ("type", pyarrow.string()),
+                ("content", pyarrow.string()),
+                ("reply_to", pyarrow.int64()),
+                ("attachments", pyarrow.list_(attachment)),
+                ("reactions", pyarrow.list_(reaction)),
+            ]
+        )
+
+    def get_path(self, output_dir: str) -> str:
+        return f"{output_dir}/data/messages.parquet"
+
+    def write_batch(self, records: list[dict]) -> None:
+        if self.writer is None:
+            self.writer = pyarrow_parquet.ParquetWriter(self.path, self.get_schema(), compression="zstd")
+        self.writer.write_table(pyarrow.Table.from_pylist(records, schema=self.writer.schema))
+
+    def finish(self) -> None:
+        super().finish()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+def create_renderers(names: list[str]) -> list[Renderer]:
+    renderers: list[Renderer] = []
+    for name in names:
+        match name:
+            case "html":
+                renderers.append(HtmlRenderer())
+            case "ndjson":
+                renderers.append(NdjsonRenderer())
+            case "parquet":
+                if pyarrow is None:
+                    logger.warning("pyarrow is not installed, skipping the parquet output")
+                else:
+                    renderers.append(ParquetRenderer())
+            case _:
+                logger.warning(f"unknown renderer {name}")
+    return renderers
@@ -0,0 +1,46 @@
+import discord
+
+
+class ResolverCache:
+    """
+    Caches the names that mentions in message content resolve to, and the emoji looked up for custom emoji.  One
+    cache is shared by every channel of an export, so each id is only looked up once.
+
+    Users the client hasn't cached are fetched when they are first mentioned.  A REST only client caches nobody,
+    and for the bot it picks up the names of users that have left the guild.
+    """
+
+    def __init__(self, bot: discord.Client):
+        self.bot: discord.Client = bot
+        self.user_names: dict[int, str | None] = {}
+        self.role_names: dict[int, str | None] = {}
+        self.channel_names: dict[int, str | None] = {}
+        self.emoji: dict[int, discord.Emoji | None] = {}
+
+    async def fetch_user_name(self, user_id: int) -> str | None:
+        if user_id not in self.user_names:
+            user: discord.User | None = self.bot.get_user(user_id)
+            if user is None:
+                try:
+                    user = await self.bot.fetch_user(user_id)
+                except discord.NotFound:
+                    pass
+            self.user_names[user_id] = user.display_name if user else None
+        return self.user_names[user_id]
+
+    def get_role_name(self, guild: discord.Guild, role_id: int) -> str | None:
+        if role_id not in self.role_names:
+            role: discord.Role | None = guild.get_role(role_id)
+            self.role_names[role_id] = role.name if role else None
+        return self.role_names[role_id]
+
+    def get_channel_name(self, channel_id: int) -> str | None:
+        if channel_id not in self.channel_names:
+            channel = self.bot.get_channel(channel_id)
+            self.channel_names[channel_id] = channel.name if channel else None
+        return self.channel_names[channel_id]
+
+    def get_emoji(self, emoji_id: int) -> discord.Emoji | None:
+        if emoji_id not in self.emoji:
+            self.emoji[emoji_id] = self.bot.get_emoji(emoji_id)
+        return self.emoji[emoji_id]
@@ -0,0 +1,41 @@
+import logging
+
+import discord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class RestClient(discord.Client):
+    """
+    A client that only logs in to the REST API and never connects to the gateway, for running exports away from
+    the bot.  Without the gateway nothing is cached up front, so the guild of an export, its channels, roles and
+    emoji, and the bot's own member are fetched when a channel of the guild is first asked for.
+    """
+
+    def __init__(self):
+        super().__init__(intents=discord.Intents.none())
+
+    async def load_guild(self, guild_id: int) -> discord.Guild:
+        guild: discord.Guild | None = self.get_guild(guild_id)
+        if guild:
+            return guild
+        # storing the guild in the connection state caches its roles and emoji, and makes its channels resolvable
+        guild = await self.fetch_guild(guild_id)
+        self._connection._add_guild(guild)
+        for channel in await guild.fetch_channels():
+            guild._add_channel(channel)
+        for thread in await guild.active_threads():
+            guild._add_thread(thread)
+        guild._add_member(await guild.fetch_member(self.user.id))
+        logger.info(f"loaded {guild.name} over REST, {len(guild.channels)} channels and {len(guild.roles)} roles")
+        return guild
+
+    async def load_channel(self, channel_id: int) -> discord.abc.GuildChannel | discord.Thread:
+        channel = self.get_channel(channel_id)
+        if channel:
+            return channel
+        channel = await self.fetch_channel(channel_id)
+        guild: discord.Guild = await self.load_guild(channel.guild.id)
+        # fetched again if it isn't in the guild's channels (archived threads), so it belongs to the loaded guild
+        return guild.get_channel_or_thread(channel_id) or await self.fetch_channel(channel_id)
@@ -0,0 +1,97 @@
+import json
+import os
+import re
+
+import discord
+
+
+class SearchIndex:
+    """
+    An inverted index of the exported messages that the search box in the export template can query without a
+    server.  Terms are sharded by their first characters so a query only loads the shards for the terms it contains,
+    and the per message data (page, author, day and a short snippet) is split into blocks so only the blocks for the
+    matching messages are loaded.
+
+    Everything is written as small scripts rather than JSON so the index can be loaded from file:// urls.
+    """
+
+    TERM_PATTERN: re.Pattern = re.compile(r"\w{2,}")
+    MAX_TERM_LENGTH: int = 32
+
+    def __init__(self, prefix_length: int = 2, documents_per_block: int = 5000, snippet_length: int = 80):
+        self.prefix_length: int = prefix_length
+        self.documents_per_block: int = documents_per_block
+        self.snippet_length: int = snippet_length
+        self.terms: dict[str, list[int]] = {}
+        self.documents: list[list] = []
+        self.pages: list[str] = []
+        self.page_ids: dict[str, int] = {}
+        self.authors: list[str] = []
+        self.author_ids: dict[int, int] = {}
+        self.days: list[str] = []
+        self.day_ids: dict[str, int] = {}
+
+    def get_facet_id(self, values: list[str], ids: dict, key, value: str) -> int:
+        if key not in ids:
+            ids[key] = len(values)
+            values.append(value)
+        return ids[key]
+
+    def add_message(self, message: discord.Message, page: str, chunk: int = -1) -> None:
+        """
+        Adds a message to the index.  Messages are numbered in the order they are added, which keeps every
+        posting list sorted without any extra work.
+        :param message:
+        :param page: the document filename the message is rendered into
+        :param chunk: the viewer chunk holding the message, or -1 when the page is not chunked
+        :return:
+        """
+        content: str = message.content or ""
+        document_id: int = len(self.documents)
+        page_id: int = self.get_facet_id(self.pages, self.page_ids, page, page)
+        author_id: int = self.get_facet_id(
+            self.authors, self.author_ids, message.author.id, message.author.display_name
+        )
+        day: str = message.created_at.strftime("%Y-%m-%d")
+        day_id: int = self.get_facet_id(self.days, self.day_ids, day, day)
+        snippet: str = content[: self.snippet_length].replace("\n", " ")
+        self.documents.append([str(message.id), page_id, chunk, author_id, day_id, snippet])
+
+        for term in set(self.TERM_PATTERN.findall(content.lower())):
+            if len(term) <= self.MAX_TERM_LENGTH:
+                self.terms.setdefault(term, []).append(document_id)
+
+    def get_shard_name(self, term: str) -> str:
+        return term[: self.prefix_length].encode("utf-8").hex()
+
+    def write(self, search_dir: str) -> None:
+        os.makedirs(search_dir, exist_ok=True)
+
+        shards: dict[str, dict[str, list[int]]] = {}
+        for term, postings in self.terms.items():
+            # postings are delta encoded to keep the shards small
+            deltas: list[int] = [postings[0]] + [b - a for a, b in zip(postings, postings[1:])]
+            shards.setdefault(self.get_shard_name(term), {})[term] = deltas
+        for shard_name, shard in shards.items():
+            with open(f"{search_dir}/terms_{shard_name}.js", "w") as f:
+                f.write(f"exportSearch.addShard({json.dumps(shard_name)}, {json.dumps(shard)});")
+
+        block_count: int = 0
+        for block_idx, start in enumerate(range(0, len(self.documents), self.documents_per_block)):
+            with open(f"{search_dir}/docs_{block_idx:05}.js", "w") as f:
+                block = self.documents[start : start + self.documents_per_block]
+                f.write(f"exportSearch.addDocuments({block_idx}, {json.dumps(block)});")
+            block_count += 1
+
+        meta = {
+            "prefixLength": self.prefix_length,
+            "documentsPerBlock": self.documents_per_block,
+            "documentCount": len(self.documents),
+            "blockCount": block_count,
+            "shards": sorted(shards.keys()),
+            "pages": self.pages,
+            "authors": self.authors,
+            "days": self.days,
+        }
+        with open(f"{search_dir}/meta.js", "w") as f:
+            f.write(f"exportSearch.init({json.dumps(meta)});")
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+from .lazy_import import lazy_import
+
+
+subset = lazy_import("fontTools.subset")
+brotli = lazy_import("brotli")
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+# a json string escape, characters outside the BMP are escaped as a surrogate pair
+JSON_ESCAPE_PATTERN: re.Pattern = re.compile(
+    r"\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}|\\u[0-9a-fA-F]{4}"
+)
+
+
+class StaticAssets:
+    """
+    Puts the fonts and images the pages need into the assets of an export.  They are hardlinked from where they
+    live rather than copied, so an export costs a directory entry per file instead of a copy of it.
+
+    With subsetting on, the fonts are cut down to the characters that actually appear in the written pages and
+    saved as WOFF2 (WOFF if brotli isn't installed), which needs fontTools.  Subsets are cached in the cache dir by
+    a hash of the font and the character set, so exports of the same text reuse them.  The template lists the WOFF2
+    file before the full WOFF, and a browser uses whichever of the two is in the archive.
+    """
+
+    FONT_DIR: str = os.path.join(os.path.dirname(__file__), "fonts")
+    IMAGE_DIR: str = os.path.join(os.path.dirname(__file__), "images")
+    # printable ascii is always kept, the search box and viewer placeholders don't go through add_text
+    BASE_CHARACTERS: str = "".join(chr(codepoint) for codepoint in range(0x20, 0x7F))
+
+    def __init__(self, cache_dir: str | None = None, subset_fonts: bool = False):
+        self.cache_dir: str | None = cache_dir
+        self.subset_fonts: bool = subset_fonts and subset is not None and cache_dir is not None
+        if subset_fonts and subset is None:
+            logger.warning("fontTools is not installed, fonts will be exported in full")
+        self.characters: set[str] = set(self.BASE_CHARACTERS)
+
+    def add_text(self, text: str) -> None:
+        if self.subset_fonts:
+            self.characters.update(text)
+
+    def add_files(self, output_dir: str) -> None:
+        """
+        Adds the text of the pages in the output dir, for documents that weren't rendered by this export: unchanged
+        threads kept from an earlier export and documents written by another process
+        :param output_dir:
+        :return:
+        """
+        if not self.subset_fonts:
+            return
+        for root, dirs, files in os.walk(output_dir):
+            for file in files:
+                if file.endswith((".html", ".js")):
+                    with open(os.path.join(root, file), "r", encoding="utf-8") as f:
+                        text: str = f.read()
+                    if file.endswith(".js"):
+                        # the viewer chunks are ascii json, everything else in them is escaped
+                        text = JSON_ESCAPE_PATTERN.sub(lambda match: json.loads(f'"{match.group()}"'), text)
+                    self.add_text(text)
+
+    @staticmethod
+    def link_file(source: str, destination: str) -> None:
+        if os.path.isfile(destination):
+            if os.path.samefile(source, destination):
+                return
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            # different file systems, or a file system without hardlinks
+            shutil.copy(source, destination)
+
+    def get_subset(self, font_path: str) -> str:
+        """
+        :param font_path:
+        :return: path of the cached subset of the font
+        """
+        flavor: str = "woff2" if brotli is not None else "woff"
+        digest = hashlib.sha256()
+        with open(font_path, "rb") as f:
+            digest.update(f.read())
+        digest.update(flavor.encode())
+        digest.update("".join(sorted(self.characters)).encode("utf-8", "surrogatepass"))
+        stem: str = os.path.splitext(os.path.basename(font_path))[0]
+        subset_path: str = f"{self.cache_dir}/fonts/{digest.hexdigest()[:16]}/{stem}.{flavor}"
+        if os.path.isfile(subset_path):
+            return subset_path
+
+        os.makedirs(os.path.dirname(subset_path), exist_ok=True)
+        options = subset.Options()
+        options.flavor = flavor
+        options.layout_features = ["*"]
+        font = subset.load_font(font_path, options)
+        subsetter = subset.Subsetter(options)
+        subsetter.populate(unicodes=[ord(character) for character in self.characters])
+        subsetter.subset(font)
+        subset.save_font(font, f"{subset_path}.part", options)
+        os.replace(f"{subset_path}.part", subset_path)
+        logger.info(f"subset {stem} to {len(self.characters)} characters, {os.path.getsize(subset_path)} bytes")
+        return subset_path
+
+    def materialize(self, output_dir: str) -> None:
+        asset_dir: str = f"{output_dir}/assets"
+        os.makedirs(asset_dir, exist_ok=True)
+        for file in os.listdir(self.FONT_DIR):
+            font_path: str = os.path.join(self.FONT_DIR, file)
+            if self.subset_fonts:
+                try:
+                    font_path = self.get_subset(font_path)
+                except Exception as ex:
+                    logger.warning(f"unable to subset {file}, exporting it in full: {ex}")
+            destination: str = f"{asset_dir}/{os.path.basename(font_path)}"
+            self.link_file(font_path, destination)
+            # a font of the other flavor left by an earlier export would be picked over, or instead of, this one
+            stem: str = os.path.splitext(file)[0]
+            for stale in (f"{asset_dir}/{stem}.woff", f"{asset_dir}/{stem}.woff2"):
+                if stale != destination and os.path.isfile(stale):
+                    os.remove(stale)
+        for file in os.listdir(self.IMAGE_DIR):
+            self.link_file(os.path.join(self.IMAGE_DIR, file), f"{asset_dir}/{file}")
@@ -0,0 +1,187 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+import discord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ThreadRecord:
+    """
+    What the exporter needs to know about a thread without holding on to the discord.Thread itself.  It has the
+    same id, name and message_count attributes, so it can be rendered as a thread link in its place.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        message_count: int | None,
+        last_message_id: int | None,
+        exported: dict[str, int] | None = None,
+    ):
+        self.id: int = id
+        self.name: str = name
+        self.message_count: int | None = message_count
+        self.last_message_id: int | None = last_message_id
+        # the last message of the thread when it was exported, by the output dir it was exported into
+        self.exported: dict[str, int] = exported or {}
+
+    @classmethod
+    def from_thread(cls, thread: discord.Thread, exported: dict[str, int] | None = None) -> "ThreadRecord":
+        return cls(thread.id, thread.name, thread.message_count, thread.last_message_id, exported)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ThreadRecord":
+        # catalogs saved before the marks were kept per output dir don't say where the thread went, it's exported
+        # again once
+        return cls(data["id"], data["name"], data["message_count"], data["last_message_id"], data.get("exported"))
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "message_count": self.message_count,
+            "last_message_id": self.last_message_id,
+            "exported": self.exported,
+        }
+
+
+class ThreadCatalog:
+    """
+    The threads of a channel, kept across exports.  Archived threads are listed newest archive first, so a refresh
+    only has to page through the archives until it reaches the newest archive time seen by the previous refresh.
+    A thread that gets a new message is unarchived, and gets a newer archive time when it is archived again, so it
+    is always picked up again.  The public and private archives are paged through concurrently.
+
+    The catalog also remembers the last message of each thread at the time it was exported into each output dir,
+    so incremental exports can skip threads that haven't changed since they last went into the same dir.
+    """
+
+    def __init__(self, channel_id: int, cache_dir: str | None = None):
+        self.channel_id: int = channel_id
+        self.path: str | None = f"{cache_dir}/threads_{channel_id}.json" if cache_dir else None
+        self.records: dict[int, ThreadRecord] = {}
+        self.archive_marks: dict[str, str] = {}
+        self.threads: dict[int, discord.Thread] = {}
+        # loaded from a thread by refresh(), every channel and thread of an export has a catalog
+        self.loaded: bool = False
+
+    def load(self) -> None:
+        self.loaded = True
+        if not self.path or not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as f:
+            data: dict = json.load(f)
+        self.archive_marks = data["archive_marks"]
+        for record in data["threads"]:
+            self.records[record["id"]] = ThreadRecord.from_dict(record)
+        logger.info(f"loaded {len(self.records)} threads from the thread catalog")
+
+    def save(self) -> None:
+        if not self.path or not self.loaded:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = {
+            "channel_id": self.channel_id,
+            "archive_marks": self.archive_marks,
+            "threads": [record.to_dict() for record in self.records.values()],
+        }
+        with open(f"{self.path}.part", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{self.path}.part", self.path)
+
+    def add_thread(self, thread: discord.Thread) -> None:
+        previous: ThreadRecord | None = self.records.get(thread.id)
+        self.records[thread.id] = ThreadRecord.from_thread(thread, previous.exported if previous else None)
+        self.threads[thread.id] = thread
+
+    async def refresh_archive(
+        self,
+        channel: discord.TextChannel | discord.ForumChannel,
+        private: bool,
+        archived_after: datetime.datetime | None = None,
+    ) -> None:
+        kind: str = "private" if private else "public"
+        mark: datetime.datetime | None = None
+        if kind in self.archive_marks:
+            mark = datetime.datetime.fromisoformat(self.archive_marks[kind])
+        newest: datetime.datetime | None = None
+        count: int = 0
+        try:
+            if private:
+                threads = channel.archived_threads(limit=None, private=True)
+            else:
+                threads = channel.archived_threads(limit=None)
+            async for thread in threads:
+                if newest is None or thread.archive_timestamp > newest:
+                    newest = thread.archive_timestamp
+                if mark and thread.archive_timestamp <= mark:
+                    break  # everything from here on was catalogued by an earlier refresh
+                if archived_after and thread.archive_timestamp < archived_after:
+                    break  # everything from here on went quiet before the range being exported
+                self.add_thread(thread)
+                count += 1
+        except discord.Forbidden:
+            logger.info(f"no access to the {kind} archived threads of {channel.name}")
+        if newest:
+            self.archive_marks[kind] = newest.isoformat()
+        logger.info(f"{count} new or changed {kind} archived threads")
+
+    async def refresh(
+        self, channel: discord.TextChannel | discord.ForumChannel, archived_after: datetime.datetime | None = None
+    ) -> None:
+        """
+        :param channel:
+        :param archived_after: stop at threads archived before this, for a catalog that isn't saved
+        :return:
+        """
+        if not self.loaded:
+            await asyncio.to_thread(self.load)
+        archives = [self.refresh_archive(channel, False, archived_after)]
+        if isinstance(channel, discord.TextChannel):
+            # forum posts are always public
+            archives.append(self.refresh_archive(channel, True, archived_after))
+        await asyncio.gather(*archives)
+
+        for thread in channel.threads:
+            self.add_thread(thread)
+
+    def is_unchanged(self, thread_id: int, output_dir: str) -> bool:
+        """
+        :param thread_id:
+        :param output_dir: a channel and a guild export of it keep their own copy of the thread's page
+        :return: whether the thread has had no messages since it was last exported into the output dir
+        """
+        record: ThreadRecord = self.records[thread_id]
+        exported: int | None = record.exported.get(os.path.normpath(output_dir))
+        return record.last_message_id is not None and exported == record.last_message_id
+
+    def mark_exported(self, thread_id: int, output_dir: str) -> None:
+        record: ThreadRecord = self.records[thread_id]
+        if record.last_message_id is not None:
+            record.exported[os.path.normpath(output_dir)] = record.last_message_id
+
+    async def get_thread(self, bot: discord.Client, thread_id: int) -> discord.Thread | None:
+        """
+        Threads that were catalogued by an earlier refresh are only known by id, so they are looked up on demand
+        :param bot:
+        :param thread_id:
+        :return:
+        """
+        if thread_id in self.threads:
+            return self.threads[thread_id]
+        thread = bot.get_channel(thread_id)
+        if thread is None:
+            try:
+                thread = await bot.fetch_channel(thread_id)
+            except (discord.NotFound, discord.Forbidden):
+                logger.warning(f"thread {thread_id} no longer exists, removing it from the catalog")
+                self.records.pop(thread_id, None)
+                return None
+        self.threads[thread_id] = thread
+        return thread
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from .io_executor import IOExecutor
+from .lazy_import import lazy_import
+
+
+Image = lazy_import("PIL.Image")
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def make_thumbnail(source: str, destination: str, size: tuple[int, int], image_format: str, quality: int) -> None:
+    """
+    Runs in a worker process, so it only takes plain arguments and writes its result straight to disk
+    """
+    with Image.open(source) as image:
+        image.draft("RGB", size)  # lets jpeg decode at a reduced scale
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        thumbnail = image.resize(size, Image.LANCZOS)
+        thumbnail.save(f"{destination}.part", image_format.upper(), quality=quality)
+    os.replace(f"{destination}.part", destination)
+
+
+class Thumbnail:
+    def __init__(self, filename: str, width: int, height: int):
+        self.filename: str = filename
+        self.width: int = width
+        self.height: int = height
+
+
+class ThumbnailGenerator:
+    """
+    Generates downscaled copies of image attachments and embed images for inline display, the original stays
+    behind the link.  Thumbnail sizes are worked out from the dimensions discord reports, so the HTML can be
+    written with width and height straight away while the actual resizing happens on a process pool in the
+    background.  wait() must be called before the output is packaged.
+
+    Thumbnails are cached on disk by asset id, so re-exporting into the same output dir only processes new images.
+    """
+
+    IMAGE_EXTENSIONS: tuple[str, ...] = ("png", "jpg", "jpeg", "webp")
+
+    def __init__(
+        self,
+        max_size: int = 600,
+        image_format: str = "webp",
+        quality: int = 80,
+        min_bytes: int = 64 * 1024,
+        processes: int | None = None,
+    ):
+        self.max_size: int = max_size
+        self.image_format: str = image_format.lower()
+        self.quality: int = quality
+        self.min_bytes: int = min_bytes
+        self.processes: int | None = processes
+        self.pool: ProcessPoolExecutor | None = None
+        self.pending: dict[str, tuple[str, asyncio.Future]] = {}
+        self.enabled: bool = Image is not None
+        if not self.enabled:
+            logger.warning("Pillow is not installed, images will be exported without thumbnails")
+        else:
+            Image.init()
+            if self.image_format.upper() not in Image.SAVE:
+                logger.warning(f"Pillow can't write {self.image_format} images, falling back to webp thumbnails")
+                self.image_format = "webp"
+
+    def scaled_size(self, width: int, height: int) -> tuple[int, int]:
+        scale: float = min(1.0, self.max_size / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn rather than fork, forking a process that is running the gateway connection isn't safe
+            self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    @staticmethod
+    def get_size(path: str) -> int | None:
+        return os.path.getsize(path) if os.path.isfile(path) else None
+
+    async def thumbnail(
+        self, io: IOExecutor, output_dir: str, asset_id: str, local_filename: str, width: int | None, height: int | None
+    ) -> Thumbnail | None:
+        """
+        :param io: the file operations of the export
+        :param output_dir:
+        :param asset_id:
+        :param local_filename: the html relative filename of the downloaded original
+        :param width: width of the original as reported by discord
+        :param height: height of the original as reported by discord
+        :return: the thumbnail to show inline, or None if the original should be shown as is
+        """
+        if not self.enabled or not width or not height:
+            return None
+        if local_filename.split(".")[-1].lower() not in self.IMAGE_EXTENSIONS:
+            return None
+        source: str = f"{output_dir}/{local_filename.removeprefix('./')}"
+        source_size: int | None = await io.run(self.get_size, source)
+        if source_size is None or source_size < self.min_bytes:
+            return None
+
+        thumb_width, thumb_height = self.scaled_size(width, height)
+        thumb_filename: str = f"./assets/thumbs/{asset_id}.{self.image_format}"
+        destination: str = f"{output_dir}/{thumb_filename.removeprefix('./')}"
+        if destination not in self.pending and not await io.isfile(destination):
+            await io.makedirs(os.path.dirname(destination))
+            # another document may have scheduled the same image while this one was waiting on the disk
+            if destination not in self.pending:
+                future: asyncio.Future = asyncio.get_running_loop().run_in_executor(
+                    self.get_pool(),
+                    make_thumbnail,
+                    source,
+                    destination,
+                    (thumb_width, thumb_height),
+                    self.image_format,
+                    self.quality,
+                )
+                self.pending[destination] = (source, future)
+        return Thumbnail(thumb_filename, thumb_width, thumb_height)
+
+    async def wait(self, io: IOExecutor) -> None:
+        """
+        Waits for all scheduled thumbnails.  A thumbnail that couldn't be generated is replaced with a copy of its
+        original so the page never references a missing file, browsers sniff the image type regardless of the
+        file extension.
+        :param io: the file operations of the export
+        :return:
+        """
+        if not self.pending:
+            return
+        logger.info(f"waiting for {len(self.pending)} thumbnails")
+        pending: dict[str, tuple[str, asyncio.Future]] = self.pending
+        self.pending = {}
+        results = await asyncio.gather(*(future for _, future in pending.values()), return_exceptions=True)
+        for (destination, (source, _)), result in zip(pending.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f"error creating thumbnail {destination}: {result}")
+                await io.run(shutil.copy, source, destination)
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
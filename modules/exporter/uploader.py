@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+
+import discord
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class UploadPart:
+    def __init__(self, path: str, filename: str):
+        self.path: str = path
+        self.filename: str = filename
+        self.size: int = os.path.getsize(path)
+
+
+class UploadManager:
+    """
+    Uploads a set of files to a channel, packing as many files into each message as discord allows (10 attachments,
+    and no more than the guild's upload limit in total).  Messages are sent a few at a time, every message is
+    retried with exponential backoff, and a message that keeps failing is split up so one bad part can't take the
+    rest of the backup down with it.
+
+    Files are handed to discord.py as paths, so they are streamed from disk rather than read into memory.
+    """
+
+    MAX_ATTACHMENTS_PER_MESSAGE: int = 10
+    PROGRESS_INTERVAL: float = 5.0
+
+    def __init__(
+        self,
+        channel: discord.abc.Messageable,
+        max_message_bytes: int,
+        concurrency: int = 2,
+        max_attempts: int = 4,
+        base_delay: float = 2.0,
+    ):
+        self.channel: discord.abc.Messageable = channel
+        self.max_message_bytes: int = max_message_bytes
+        self.concurrency: int = concurrency
+        self.max_attempts: int = max_attempts
+        self.base_delay: float = base_delay
+        self.total_parts: int = 0
+        self.total_bytes: int = 0
+        self.uploaded_parts: int = 0
+        self.uploaded_bytes: int = 0
+        self.started_at: float = 0.0
+        self.last_progress_at: float = 0.0
+        self.status_message: discord.Message | None = None
+
+    def batch_parts(self, parts: list[UploadPart]) -> list[list[UploadPart]]:
+        """
+        Groups the parts into messages, keeping them in order so the parts still arrive roughly in sequence
+        :param parts:
+        :return: the parts for each message
+        """
+        batches: list[list[UploadPart]] = []
+        batch: list[UploadPart] = []
+        batch_size: int = 0
+        for part in parts:
+            if batch and (
+                len(batch) == self.MAX_ATTACHMENTS_PER_MESSAGE or batch_size + part.size > self.max_message_bytes
+            ):
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append(part)
+            batch_size += part.size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def progress_text(self) -> str:
+        elapsed: float = max(time.perf_counter() - self.started_at, 0.001)
+        rate: float = self.uploaded_bytes / elapsed / 1024 / 1024
+        return (
+            f"Uploaded {self.uploaded_parts} of {self.total_parts} files "
+            f"({self.uploaded_bytes / 1024 / 1024:.1f} of {self.total_bytes / 1024 / 1024:.1f} MB, {rate:.2f} MB/s)"
+        )
+
+    async def report_progress(self, force: bool = False) -> None:
+        now: float = time.perf_counter()
+        if not force and now - self.last_progress_at < self.PROGRESS_INTERVAL:
+            return
+        self.last_progress_at = now
+        text: str = self.progress_text()
+        logger.info(text)
+        try:
+            if self.status_message:
+                await self.status_message.edit(content=text)
+            else:
+                self.status_message = await self.channel.send(text)
+        except discord.HTTPException as ex:
+            logger.warning(f"unable to update upload progress: {ex}")
+
+    async def send_batch(self, batch: list[UploadPart]) -> list[UploadPart]:
+        """
+        :param batch:
+        :return: the parts that could not be uploaded
+        """
+        for attempt in range(self.max_attempts):
+            files: list[discord.File] = [discord.File(part.path, filename=part.filename) for part in batch]
+            try:
+                await self.channel.send(files=files)
+                self.uploaded_parts += len(batch)
+                self.uploaded_bytes += sum(part.size for part in batch)
+                await self.report_progress()
+                return []
+            except discord.HTTPException as ex:
+                logger.warning(f"upload of {[part.filename for part in batch]} failed (attempt {attempt + 1}): {ex}")
+                if ex.status == 413:
+                    break  # too large as a whole, retrying as is won't help
+            except (OSError, asyncio.TimeoutError) as ex:
+                logger.warning(f"upload of {[part.filename for part in batch]} failed (attempt {attempt + 1}): {ex}")
+            finally:
+                for file in files:
+                    file.close()
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(self.base_delay * 2**attempt)
+
+        if len(batch) > 1:
+            middle: int = len(batch) // 2
+            return await self.send_batch(batch[:middle]) + await self.send_batch(batch[middle:])
+        logger.error(f"giving up on uploading {batch[0].filename}")
+        return batch
+
+    async def upload(self, parts: list[UploadPart]) -> list[UploadPart]:
+        """
+        :param parts:
+        :return: the parts that could not be uploaded
+        """
+        self.total_parts = len(parts)
+        self.total_bytes = sum(part.size for part in parts)
+        self.started_at = time.perf_counter()
+        batches: list[list[UploadPart]] = self.batch_parts(parts)
+        logger.info(f"uploading {len(parts)} files in {len(batches)} messages")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(batch: list[UploadPart]) -> list[UploadPart]:
+            async with semaphore:
+                return await self.send_batch(batch)
+
+        results: list[list[UploadPart]] = await asyncio.gather(*(send(batch) for batch in batches))
+        await self.report_progress(force=True)
+        return [part for failed in results for part in failed]
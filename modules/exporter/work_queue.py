@@ -0,0 +1,210 @@
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class WorkUnit:
+    def __init__(self, unit_id: int, job_id: int, stage: int, kind: str, payload: dict, attempts: int):
+        self.unit_id: int = unit_id
+        self.job_id: int = job_id
+        self.stage: int = stage
+        self.kind: str = kind
+        self.payload: dict = payload
+        self.attempts: int = attempts
+
+
+class JobStatus:
+    def __init__(self, job_id: int, state: str, units_done: int, units_total: int, error: str | None):
+        self.job_id: int = job_id
+        self.state: str = state  # running, done or failed
+        self.units_done: int = units_done
+        self.units_total: int = units_total
+        self.error: str | None = error
+
+
+class WorkQueue:
+    """
+    The export jobs of a distributed export and the units of work they are split into, in an SQLite database the
+    bot and every export worker open.  Workers on other machines reach it over a shared file system, which is why
+    the database keeps the rollback journal rather than WAL: WAL needs shared memory between the processes.
+
+    A worker claims a unit with a lease and renews it while it works.  A unit whose lease runs out, because its
+    worker died or lost the file system, is handed out again, and a unit that fails or times out max_attempts
+    times fails its job.  The units of a job are in stages, and a unit is only handed out once every unit of the
+    earlier stages of its job is done: a channel's page waits for its history, packing waits for every page.
+    Units can be added to a job while it runs, as long as they are added by a unit of the same or an earlier stage.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.path: str = path
+        self.lease_seconds: float = lease_seconds
+        self.max_attempts: int = max_attempts
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                description TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'running',
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS units (
+                unit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                stage INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'ready',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS units_state ON units (state, job_id, stage);
+            """
+        )
+        self.lock: threading.Lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # the lock keeps the threads of one process apart, the IMMEDIATE transaction the processes
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def create_job(self, description: str) -> int:
+        with self.transaction():
+            return self.connection.execute("INSERT INTO jobs (description) VALUES (?)", (description,)).lastrowid
+
+    def publish(self, job_id: int, units: list[tuple[int, str, dict]]) -> None:
+        """
+        :param job_id:
+        :param units: stage, kind and payload of each unit
+        :return:
+        """
+        with self.transaction():
+            self.connection.executemany(
+                "INSERT INTO units (job_id, stage, kind, payload) VALUES (?, ?, ?, ?)",
+                [(job_id, stage, kind, json.dumps(payload)) for stage, kind, payload in units],
+            )
+
+    def cancel_job(self, job_id: int, error: str) -> None:
+        """
+        Fails the job, must run in a transaction
+        """
+        self.connection.execute(
+            "UPDATE jobs SET state = 'failed', error = ? WHERE job_id = ? AND state = 'running'", (error, job_id)
+        )
+        self.connection.execute(
+            "UPDATE units SET state = 'cancelled' WHERE job_id = ? AND state IN ('ready', 'leased')", (job_id,)
+        )
+
+    def expire_leases(self, now: float) -> None:
+        """
+        Puts the units of workers that stopped renewing their lease back in the queue, must run in a transaction
+        """
+        expired = self.connection.execute(
+            "SELECT unit_id, job_id, attempts, worker FROM units WHERE state = 'leased' AND lease_expires < ?", (now,)
+        ).fetchall()
+        for unit_id, job_id, attempts, worker in expired:
+            logger.warning(f"lease of work unit {unit_id} held by {worker} expired")
+            if attempts >= self.max_attempts:
+                self.connection.execute("UPDATE units SET state = 'failed' WHERE unit_id = ?", (unit_id,))
+                self.cancel_job(job_id, f"work unit {unit_id} timed out {attempts} times")
+            else:
+                self.connection.execute(
+                    "UPDATE units SET state = 'ready', worker = NULL WHERE unit_id = ?", (unit_id,)
+                )
+
+    def claim(self, worker: str) -> WorkUnit | None:
+        """
+        :param worker: name of the claiming worker, unique across nodes
+        :return: the oldest unit that is ready to run, None if there is none
+        """
+        now: float = time.time()
+        with self.transaction():
+            self.expire_leases(now)
+            row = self.connection.execute(
+                """
+                SELECT unit_id, job_id, stage, kind, payload, attempts FROM units u
+                WHERE state = 'ready' AND NOT EXISTS (
+                    SELECT 1 FROM units p WHERE p.job_id = u.job_id AND p.stage < u.stage AND p.state != 'done'
+                )
+                ORDER BY job_id, stage, unit_id LIMIT 1
+                """
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "UPDATE units SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE unit_id = ?",
+                    (worker, now + self.lease_seconds, row[0]),
+                )
+        if row is None:
+            return None
+        return WorkUnit(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5] + 1)
+
+    def renew(self, unit: WorkUnit, worker: str) -> bool:
+        """
+        :return: whether the worker still holds the unit
+        """
+        with self.transaction():
+            cursor = self.connection.execute(
+                "UPDATE units SET lease_expires = ? WHERE unit_id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, unit.unit_id, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, unit: WorkUnit, worker: str) -> None:
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE units SET state = 'done' WHERE unit_id = ? AND worker = ? AND state = 'leased'",
+                (unit.unit_id, worker),
+            )
+            remaining = self.connection.execute(
+                "SELECT COUNT(*) FROM units WHERE job_id = ? AND state != 'done'", (unit.job_id,)
+            ).fetchone()[0]
+            if remaining == 0:
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'done' WHERE job_id = ? AND state = 'running'", (unit.job_id,)
+                )
+
+    def fail(self, unit: WorkUnit, worker: str, error: str) -> None:
+        with self.transaction():
+            if unit.attempts >= self.max_attempts:
+                self.connection.execute(
+                    "UPDATE units SET state = 'failed', error = ? WHERE unit_id = ? AND worker = ?",
+                    (error, unit.unit_id, worker),
+                )
+                self.cancel_job(unit.job_id, f"{unit.kind} unit {unit.unit_id} failed: {error}")
+            else:
+                self.connection.execute(
+                    "UPDATE units SET state = 'ready', worker = NULL, error = ? "
+                    "WHERE unit_id = ? AND worker = ? AND state = 'leased'",
+                    (error, unit.unit_id, worker),
+                )
+
+    def get_job(self, job_id: int) -> JobStatus:
+        with self.lock:
+            state, error = self.connection.execute(
+                "SELECT state, error FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            done, total = self.connection.execute(
+                "SELECT SUM(state = 'done'), COUNT(*) FROM units WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return JobStatus(job_id, state, done or 0, total, error)
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,277 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+
+import discord
+
+from .channel_exporter import ChannelExporter
+from .export_context import ExportContext
+from .export_filter import ExportFilter
+from .guild_exporter import GuildExporter
+from .message_store import MessageStore
+from .preflight import ExportEstimate, PreflightSampler, apply_settings, create_sampler
+from .progress import ExportProgress
+from .rest_client import RestClient
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class ExportJob:
+    def __init__(
+        self,
+        job_id: int,
+        export_channel_id: int,
+        output_channel_id: int,
+        guild_export: bool = False,
+        status_channel_id: int = -1,
+        estimate: ExportEstimate | None = None,
+        export_filter: ExportFilter | None = None,
+        message_store: str | None = None,
+    ):
+        self.job_id: int = job_id
+        self.export_channel_id: int = export_channel_id  # the guild id for guild exports
+        self.output_channel_id: int = output_channel_id
+        self.guild_export: bool = guild_export
+        # where the status message of the export is kept up to date, -1 to log it
+        self.status_channel_id: int = status_channel_id
+        # from the pre-flight sample, taken when the export is run if the job doesn't come with one
+        self.estimate: ExportEstimate | None = estimate
+        self.export_filter: ExportFilter = export_filter or ExportFilter()
+        # path of the bot's message store, None if the message mirror isn't running
+        self.message_store: str | None = message_store
+
+
+class ProgressHandler(logging.Handler):
+    """
+    Forwards the exporter's log messages to the bot as progress events of the job being worked on
+    """
+
+    def __init__(self, events: multiprocessing.Queue):
+        super().__init__(logging.INFO)
+        self.events: multiprocessing.Queue = events
+        self.job_id: int | None = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.job_id is not None:
+            self.events.put(("progress", self.job_id, record.getMessage()))
+
+
+async def run_export(client: RestClient, job: ExportJob, settings: dict) -> None:
+    message_store: MessageStore | None = None
+    if job.message_store:
+        # the bot flushes the mirror before handing out a job, so the store is up to date when it's opened
+        message_store = MessageStore(job.message_store)
+    context: ExportContext = ExportContext.from_settings(client, settings, message_store)
+    context.export_filter = job.export_filter
+    outcome: str = "failed"
+    try:
+        if job.output_channel_id != -1:
+            await client.load_channel(job.output_channel_id)
+        status_channel: discord.abc.Messageable | None = None
+        if job.status_channel_id != -1:
+            status_channel = await client.load_channel(job.status_channel_id)
+        estimate: ExportEstimate | None = job.estimate
+        if job.guild_export:
+            guild: discord.Guild = await client.load_guild(job.export_channel_id)
+            guild_exporter = GuildExporter(
+                client,
+                guild,
+                job.export_filter.output_dir(f"output/guild_{job.export_channel_id}"),
+                job.output_channel_id,
+                context,
+                settings.get("guild_concurrency", 3),
+            )
+            if estimate is None:
+                sampler: PreflightSampler = create_sampler(settings, True, job.export_filter)
+                estimate = await sampler.estimate_guild(GuildExporter.get_channels(guild))
+            context.progress = ExportProgress(f"export of {guild.name}", apply_settings(estimate, settings))
+            logger.info(f"pre-flight estimate: {estimate.summary()}")
+            await context.progress.start(status_channel)
+            await guild_exporter.export()
+        else:
+            channel = await client.load_channel(job.export_channel_id)
+            output_dir: str = job.export_filter.output_dir(f"output/{job.export_channel_id}")
+            channel_exporter = ChannelExporter(client, channel, output_dir, job.output_channel_id, context)
+            if estimate is None:
+                estimate = await create_sampler(settings, export_filter=job.export_filter).estimate_channel(channel)
+            context.progress = ExportProgress(f"export of #{channel.name}", apply_settings(estimate, settings))
+            logger.info(f"pre-flight estimate: {estimate.summary()}")
+            await context.progress.start(status_channel)
+            await channel_exporter.export()
+        outcome = "done"
+    finally:
+        await context.progress.stop(outcome)
+        context.close()
+        if message_store:
+            message_store.close()
+
+
+async def worker_main(token: str, settings: dict, jobs: multiprocessing.Queue, events: multiprocessing.Queue) -> None:
+    progress_handler = ProgressHandler(events)
+    logging.getLogger("modules.exporter").addHandler(progress_handler)
+    async with RestClient() as client:
+        await client.login(token)
+        while True:
+            job: ExportJob | None = await asyncio.to_thread(jobs.get)
+            if job is None:
+                return
+            events.put(("started", job.job_id, os.getpid()))
+            progress_handler.job_id = job.job_id
+            try:
+                await run_export(client, job, settings)
+                events.put(("done", job.job_id, None))
+            except Exception as ex:
+                logger.exception(f"export job {job.job_id} failed")
+                events.put(("failed", job.job_id, str(ex)))
+            finally:
+                progress_handler.job_id = None
+
+
+def run_worker(token: str, settings: dict, jobs: multiprocessing.Queue, events: multiprocessing.Queue) -> None:
+    """
+    The entry point of a worker process
+    """
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(worker_main(token, settings, jobs, events))
+    except KeyboardInterrupt:
+        pass
+
+
+class ExportWorkerPool:
+    """
+    Runs exports in worker processes, each with its own REST only client, so the rendering, downloads and
+    compression of an export never hold up the bot's event loop and its gateway heartbeat.
+
+    Jobs are handed out over one queue, and the workers report back over another: when they start a job, the
+    exporter's log messages as progress, and when the job is done or failed.  A worker that dies is replaced, and
+    the job it was working on is failed.
+    """
+
+    def __init__(self, token: str, settings: dict, processes: int = 1):
+        self.token: str = token
+        self.settings: dict = settings
+        self.processes: int = processes
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.jobs: multiprocessing.Queue = self.mp_context.Queue()
+        self.events: multiprocessing.Queue = self.mp_context.Queue()
+        self.workers: list[multiprocessing.Process] = []
+        self.pending: dict[int, asyncio.Future] = {}
+        self.job_pids: dict[int, int] = {}
+        self.job_ids = itertools.count(1)
+        self.event_reader: asyncio.Task | None = None
+        self.closing: bool = False
+
+    def start_worker(self) -> None:
+        # not a daemon, workers run process pools of their own for thumbnails
+        worker = self.mp_context.Process(
+            target=run_worker, args=(self.token, self.settings, self.jobs, self.events), name="export-worker"
+        )
+        worker.start()
+        self.workers.append(worker)
+        logger.info(f"started export worker {worker.pid}")
+
+    def start(self) -> None:
+        for _ in range(self.processes):
+            self.start_worker()
+        self.event_reader = asyncio.create_task(self.read_events())
+
+    @property
+    def busy(self) -> bool:
+        return len(self.pending) >= self.processes
+
+    def replace_dead_workers(self) -> None:
+        for worker in [w for w in self.workers if not w.is_alive()]:
+            logger.error(f"export worker {worker.pid} exited with {worker.exitcode}")
+            self.workers.remove(worker)
+            crashed_jobs: list[int] = [job_id for job_id, pid in self.job_pids.items() if pid == worker.pid]
+            for job_id in crashed_jobs:
+                self.finish_job(job_id, RuntimeError(f"the export worker exited with {worker.exitcode}"))
+            # a worker that dies without a job failed to start, most likely to log in, and would do so again
+            if crashed_jobs and not self.closing:
+                self.start_worker()
+        if not self.workers:
+            for job_id in list(self.pending):
+                self.finish_job(job_id, RuntimeError("no export workers are running"))
+
+    def finish_job(self, job_id: int, error: Exception | None = None) -> None:
+        self.job_pids.pop(job_id, None)
+        future: asyncio.Future | None = self.pending.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    async def read_events(self) -> None:
+        while not self.closing:
+            try:
+                kind, job_id, value = await asyncio.to_thread(self.events.get, True, 1.0)
+            except queue.Empty:
+                self.replace_dead_workers()
+                continue
+            match kind:
+                case "started":
+                    self.job_pids[job_id] = value
+                case "progress":
+                    logger.info(f"export job {job_id}: {value}")
+                case "done":
+                    self.finish_job(job_id)
+                case "failed":
+                    self.finish_job(job_id, RuntimeError(value))
+
+    async def run(
+        self,
+        export_channel_id: int,
+        output_channel_id: int,
+        guild_export: bool = False,
+        status_channel_id: int = -1,
+        estimate: ExportEstimate | None = None,
+        export_filter: ExportFilter | None = None,
+        message_store: str | None = None,
+    ) -> None:
+        """
+        Runs an export in one of the workers
+        :param export_channel_id: the channel to export, or the guild for guild exports
+        :param output_channel_id:
+        :param guild_export:
+        :param status_channel_id: where the worker keeps the status message of the export, -1 for none
+        :param estimate: the pre-flight estimate of the export
+        :param export_filter: the part of the channel or guild to export, everything if None
+        :param message_store: path of the message store to load the history from, None to fetch it all
+        :return: once the export is done, raises if it failed
+        """
+        if not self.workers:
+            raise RuntimeError("no export workers are running")
+        job = ExportJob(
+            next(self.job_ids),
+            export_channel_id,
+            output_channel_id,
+            guild_export,
+            status_channel_id,
+            estimate,
+            export_filter,
+            message_store,
+        )
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending[job.job_id] = future
+        self.jobs.put(job)
+        await future
+
+    async def close(self) -> None:
+        self.closing = True
+        for _ in self.workers:
+            self.jobs.put(None)
+        if self.event_reader:
+            await self.event_reader
+        for worker in self.workers:
+            await asyncio.to_thread(worker.join, 30)
+            if worker.is_alive():
+                worker.terminate()
+        for job_id in list(self.pending):
+            self.finish_job(job_id, RuntimeError("the export worker pool was closed"))
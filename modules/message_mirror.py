@@ -0,0 +1,111 @@
+import logging
+import os
+
+import discord
+from discord.ext import commands, tasks
+
+import core
+from modules.exporter.message_store import MessageStore
+
+
+try:
+    from .core import *
+except ImportError:
+    from core import *
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class MessageMirror(commands.Cog):
+    """
+    Keeps a local copy of the history of the mirrored channels from gateway events, so exports only have to fetch
+    what the bot missed while it wasn't connected instead of paging through the whole history every time.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self.bot: Bot = bot
+        database: str = core.config["MIRROR"].get("database", "output/cache/messages.db")
+        os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+        self.store: MessageStore = MessageStore(database)
+        self.channel_ids: set[int] = set(core.config["MIRROR"].get("channels", []))
+        self.flush_store.start()
+
+    async def cog_unload(self) -> None:
+        self.flush_store.cancel()
+        self.store.close()
+
+    def is_mirrored(self, channel_id: int, parent_id: int | None = None) -> bool:
+        if not self.channel_ids:
+            return True
+        return channel_id in self.channel_ids or parent_id in self.channel_ids
+
+    def is_mirrored_message(self, channel_id: int) -> bool:
+        if not self.channel_ids:
+            return True
+        channel = self.bot.get_channel(channel_id)
+        return self.is_mirrored(channel_id, getattr(channel, "parent_id", None))
+
+    @tasks.loop(seconds=1)
+    async def flush_store(self) -> None:
+        await self.store.flush()
+
+    async def flush_if_busy(self) -> None:
+        if len(self.store.pending) >= MessageStore.FLUSH_THRESHOLD:
+            await self.store.flush()
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        # a new session, events from while the bot was gone are lost and the next message of each channel marks a gap
+        self.store.start_session()
+
+    @commands.Cog.listener()
+    async def on_resumed(self) -> None:
+        logger.info("gateway session resumed, the message mirror missed nothing")
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        if message.guild is None or not self.is_mirrored_message(message.channel.id):
+            return
+        self.store.add_message(message)
+        await self.flush_if_busy()
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if self.is_mirrored_message(payload.channel_id):
+            self.store.update_message(payload.message_id, payload.data)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        self.store.delete_messages([payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        self.store.delete_messages(list(payload.message_ids))
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent) -> None:
+        self.store.add_reaction(payload.message_id, payload.emoji, 1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent) -> None:
+        self.store.add_reaction(payload.message_id, payload.emoji, -1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent) -> None:
+        self.store.clear_reactions(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent) -> None:
+        self.store.clear_reactions(payload.message_id, payload.emoji)
+
+    @commands.Cog.listener()
+    async def on_thread_create(self, thread: discord.Thread) -> None:
+        # the mirror has seen the thread from the start, nothing before its first message needs to be fetched
+        if self.is_mirrored(thread.id, thread.parent_id):
+            self.store.start_coverage(thread.id, thread.id - 1)
+
+
+async def setup(bot: Bot) -> None:
+    if core.config.get("MIRROR", {}).get("enabled", False):
+        await bot.add_cog(MessageMirror(bot))
@@ -1,4 +1,4 @@
-from typing import Literal, TypedDict
+from typing import Literal, NotRequired, TypedDict
 
 
 class TOKENS(TypedDict):
@@ -19,8 +19,62 @@ class TBOT(TypedDict):
     channels: list[str]
 
 
+class STORAGE(TypedDict):
+    enabled: bool
+    bucket: str
+    prefix: NotRequired[str]
+    endpoint_url: NotRequired[str]
+    region: NotRequired[str]
+    access_key_id: NotRequired[str]
+    secret_access_key: NotRequired[str]
+    public_url: NotRequired[str]
+    part_size_mb: NotRequired[int]
+    upload_concurrency: NotRequired[int]
+
+
+class DISTRIBUTED(TypedDict):
+    enabled: bool
+    queue: NotRequired[str]
+    output_root: NotRequired[str]
+    history_units: NotRequired[int]
+    lease_seconds: NotRequired[int]
+    max_attempts: NotRequired[int]
+
+
+class EXPORT(TypedDict):
+    role: str
+    cache_dir: NotRequired[str]
+    viewer: NotRequired[bool]
+    viewer_chunk_size: NotRequired[int]
+    search_index: NotRequired[bool]
+    thumbnails: NotRequired[bool]
+    thumbnail_size: NotRequired[int]
+    thumbnail_format: NotRequired[Literal["webp", "avif"]]
+    emoji_atlas: NotRequired[bool]
+    subset_fonts: NotRequired[bool]
+    guild_concurrency: NotRequired[int]
+    crawl_concurrency: NotRequired[int]
+    worker_processes: NotRequired[int]
+    download_mb_in_flight: NotRequired[int]
+    memory_budget_mb: NotRequired[int]
+    render_memo_size: NotRequired[int]
+    render_memo_shared: NotRequired[bool]
+    compact_html: NotRequired[bool]
+    renderers: NotRequired[list[Literal["html", "ndjson", "parquet"]]]
+    storage: NotRequired[STORAGE]
+    distributed: NotRequired[DISTRIBUTED]
+
+
+class MIRROR(TypedDict):
+    enabled: bool
+    database: NotRequired[str]
+    channels: NotRequired[list[int]]
+
+
 class Config(TypedDict):
     TOKENS: TOKENS
     LOGGING: LOGGING
     BOT: BOT
     TBOT: TBOT
+    EXPORT: EXPORT
+    MIRROR: NotRequired[MIRROR]